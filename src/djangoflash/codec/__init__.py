@@ -4,15 +4,55 @@
 """
 
 import base64
+import binascii
+import re
+import struct
+import time
 
 from django.conf import settings
 from django.utils.hashcompat import md5_constructor
 
 
+# Bounds of the length of an encoded-and-signed flash: a signature encoded
+# with base64 is 44 characters long, and cookies can't hold much more than 4KB
+_MIN_SIGNED_LENGTH = 44
+_MAX_SIGNED_LENGTH = 8192
+
+# Characters of an encoded-and-signed flash, as returned by base64.encodestring
+_SIGNED_RE = re.compile(r'^[A-Za-z0-9+/\n]+={0,2}\n?$')
+
+# Envelope header: a mark that can't start the data of any built-in codec,
+# followed by the identifier of the codec and the version of the envelope.
+# Version 2 headers are followed by the time (in seconds since the epoch) after
+# which the flash has expired
+_ENVELOPE_MARK = '\x00'
+_ENVELOPE_VERSION = 1
+_ENVELOPE_HEADER_LENGTH = 3
+_ENVELOPE_EXPIRING_VERSION = 2
+_ENVELOPE_DEADLINE = struct.Struct('>I')
+
+# Number of characters of an encoded-and-signed flash that hold the envelope
+# header and the expiration time, once decoded with base64
+_SIGNED_HEADER_LENGTH = 12
+
+
 class BaseCodec(object):
     """Base codec implementation. All codec implementations must extend this
     class.
+
+    Codecs that have a :attr:`codec_id` (see :data:`CODEC_IDS`) wrap the
+    encoded data in a small envelope which tells what codec was used to
+    encode it, so it can be decoded even after ``FLASH_CODEC`` is changed, as
+    long as that codec is listed in the ``FLASH_CODEC_FALLBACKS`` setting.
+    The envelope of a flash whose values all expire after some time (see
+    :meth:`djangoflash.models.FlashScope.expires_at`) also holds its
+    expiration time, so an expired flash can be discarded without even
+    checking its signature or decoding it.
     """
+
+    # One-character identifier written to the envelope header
+    codec_id = None
+
     def __init__(self):
         """Returns a new :class:`BaseCodec` object.
         """
@@ -28,28 +68,147 @@ class BaseCodec(object):
         """
         raise NotImplementedError
 
+    def pack(self, flash):
+        """Returns an encoded version of the given *flash*, wrapped in an
+        envelope that identifies this codec if it has a :attr:`codec_id`.
+        """
+        if self.codec_id is None:
+            return self.encode(flash)
+        deadline = flash.expires_at()
+        if deadline is None:
+            return '%s%s%s%s' % (_ENVELOPE_MARK, self.codec_id,
+                                 chr(_ENVELOPE_VERSION), self.encode(flash))
+        return '%s%s%s%s%s' % (_ENVELOPE_MARK, self.codec_id,
+                               chr(_ENVELOPE_EXPIRING_VERSION),
+                               _ENVELOPE_DEADLINE.pack(deadline),
+                               self.encode(flash))
+
+    def get_deadline(self, packed_flash):
+        """Returns the expiration time written to the envelope of the given
+        data returned by :meth:`pack`, or ``None`` if there's no such time.
+        Only the envelope header is read.
+        """
+        if packed_flash[2:3] != chr(_ENVELOPE_EXPIRING_VERSION) or \
+                not packed_flash.startswith(_ENVELOPE_MARK):
+            return None
+        deadline = packed_flash[_ENVELOPE_HEADER_LENGTH:
+            _ENVELOPE_HEADER_LENGTH + _ENVELOPE_DEADLINE.size]
+        if len(deadline) < _ENVELOPE_DEADLINE.size:
+            raise ValueError('Truncated envelope header')
+        return _ENVELOPE_DEADLINE.unpack(deadline)[0]
+
+    def is_expired(self, packed_flash):
+        """Returns ``True`` if the envelope of the given data returned by
+        :meth:`pack` tells that the flash has expired.
+        """
+        deadline = self.get_deadline(packed_flash)
+        return deadline is not None and deadline <= time.time()
+
+    def unpack(self, packed_flash):
+        """Restores the *flash* from the given data returned by :meth:`pack`,
+        using the codec identified in its envelope (see
+        :func:`get_codec_by_id`). Data without an envelope is decoded by this
+        codec. Returns ``None`` if the flash has expired.
+        """
+        if not packed_flash.startswith(_ENVELOPE_MARK):
+            return self.decode(packed_flash)
+
+        header = packed_flash[:_ENVELOPE_HEADER_LENGTH]
+        if len(header) < _ENVELOPE_HEADER_LENGTH:
+            raise ValueError('Truncated envelope header')
+        version, length = ord(header[2]), _ENVELOPE_HEADER_LENGTH
+        if version == _ENVELOPE_EXPIRING_VERSION:
+            if self.is_expired(packed_flash):
+                return None
+            length += _ENVELOPE_DEADLINE.size
+        elif version != _ENVELOPE_VERSION:
+            raise ValueError('Unsupported envelope version: %d' % version)
+        codec = self
+        if header[1] != self.codec_id:
+            codec = get_codec_by_id(header[1])
+        return codec.decode(packed_flash[length:])
+
     def encode_and_sign(self, flash):
         """Returns an encoded-and-signed version of the given *flash*.
         """
-        encoded = self.encode(flash)
+        encoded = self.pack(flash)
         encoded_md5 = md5_constructor(encoded + settings.SECRET_KEY).hexdigest()
         return base64.encodestring(encoded + encoded_md5)
 
-    def decode_signed(self, encoded_flash):
-        """Restores the *flash* object from the given encoded-and-signed data.
+    def is_well_formed(self, encoded_flash):
+        """Returns ``True`` if the given encoded-and-signed data looks like
+        something returned by :meth:`encode_and_sign`. Only the length and the
+        characters of the data are checked, so this is a lot cheaper than
+        actually checking the signature.
+        """
+        if not isinstance(encoded_flash, basestring):
+            return False
+        if not _MIN_SIGNED_LENGTH <= len(encoded_flash) <= _MAX_SIGNED_LENGTH:
+            return False
+        if not _SIGNED_RE.match(encoded_flash):
+            return False
+        return (len(encoded_flash) - encoded_flash.count('\n')) % 4 == 0
+
+    def is_signed_expired(self, encoded_flash):
+        """Returns ``True`` if the envelope of the given encoded-and-signed
+        data tells that the flash has expired. Only the first bytes of the
+        data are decoded, and the signature is *not* checked, which is fine
+        since a forged expiration time can only cause the flash to be
+        discarded.
+        """
+        try:
+            header = base64.decodestring(
+                str(encoded_flash[:_SIGNED_HEADER_LENGTH]))
+            return self.is_expired(header)
+        except (binascii.Error, ValueError):
+            return False
+
+    def _verify(self, encoded_flash):
+        """Returns the encoded flash contained in the given encoded-and-signed
+        data, or ``None`` if the signature doesn't match.
         """
         decoded_flash = base64.decodestring(encoded_flash)
         encoded, tamper_check = decoded_flash[:-32], decoded_flash[-32:]
         hex_digest = md5_constructor(encoded + settings.SECRET_KEY).hexdigest()
         if hex_digest != tamper_check:
+            return None
+        return encoded
+
+    def decode_signed(self, encoded_flash):
+        """Restores the *flash* object from the given encoded-and-signed data.
+        Returns ``None`` if the flash has expired.
+        """
+        if self.is_signed_expired(encoded_flash):
+            return None
+        encoded = self._verify(encoded_flash)
+        if encoded is None:
             from django.core.exceptions import SuspiciousOperation
             raise SuspiciousOperation('User tampered with data.')
         try:
-            return self.decode(encoded)
-        except:
+            return self.unpack(encoded)
+        except Exception:
             # Errors might happen when decoding. Return None if that's the case
             return None
 
+    def unsign(self, encoded_flash):
+        """Restores the *flash* object from the given encoded-and-signed data,
+        just like :meth:`decode_signed`, but returns ``None`` instead of raising
+        an exception if the data is malformed or was tampered with.
+        """
+        if not self.is_well_formed(encoded_flash) or \
+                self.is_signed_expired(encoded_flash):
+            return None
+        try:
+            encoded = self._verify(str(encoded_flash))
+        except binascii.Error:
+            return None
+        if encoded is None:
+            return None
+        try:
+            return self.unpack(encoded)
+        except Exception:
+            return None
+
 
 # Alias for use in settings file --> name of module in "codec" directory.
 # Any codec that is not in this dictionary is treated as a Python import
@@ -60,13 +219,16 @@ class BaseCodec(object):
 CODECS = {
     'json': 'json_impl',
     'json_zlib': 'json_zlib_impl',
+    'json_lazy': 'json_lazy_impl',
+    'json_typed': 'json_typed_impl',
     'pickle': 'pickle_impl',
 }
 
 def get_codec(module):
     """Creates and returns the codec defined in the given module path
     (ex: ``"myapp.mypackage.mymodule"``). The argument can also be an alias to
-    a built-in codec, such as ``"json"``, ``"json_zlib"`` or ``"pickle"``.
+    a built-in codec, such as ``"json"``, ``"json_zlib"``, ``"json_lazy"``,
+    ``"json_typed"`` or ``"pickle"``.
     """
     if module in CODECS:
         # The "_codec" suffix is to avoid conflicts with built-in module names
@@ -76,6 +238,50 @@ def get_codec(module):
         mod = __import__(module, {}, {}, [''])
     return getattr(mod, 'CodecClass')()
 
+# Codec identifier written to the envelope header --> codec alias or module
+# path. Each identifier must be a single character, and identifiers must never
+# be reused, otherwise existing data might be decoded by the wrong codec.
+CODEC_IDS = {
+    'j': 'json',
+    'z': 'json_zlib',
+    'l': 'json_lazy',
+    't': 'json_typed',
+    'p': 'pickle',
+}
+
+# Codec instances used to decode data, by codec identifier
+_codecs_by_id = {}
+
+def get_codec_by_id(codec_id):
+    """Returns the codec identified by the given *codec_id*, as written to
+    the envelope header. Raises a :exc:`ValueError` if the identifier is
+    unknown, or if its codec is neither the one chosen by the ``FLASH_CODEC``
+    setting nor one listed in the ``FLASH_CODEC_FALLBACKS`` setting, since
+    some codecs (such as the Pickle-based one) are not safe to decode
+    untrusted data with.
+    """
+    if codec_id not in CODEC_IDS:
+        raise ValueError('Unknown codec: %r' % codec_id)
+    allowed = [getattr(settings, 'FLASH_CODEC', 'json')]
+    allowed.extend(getattr(settings, 'FLASH_CODEC_FALLBACKS', ()))
+    if CODEC_IDS[codec_id] not in allowed:
+        raise ValueError('Codec not allowed: %r' % codec_id)
+    if codec_id not in _codecs_by_id:
+        _codecs_by_id[codec_id] = get_codec(CODEC_IDS[codec_id])
+    return _codecs_by_id[codec_id]
+
+def register_codec(codec_id, module):
+    """Registers the codec defined in the given module path under the given
+    *codec_id*, so data encoded by that codec can be decoded by any other
+    codec, once the module path is listed in the ``FLASH_CODEC_FALLBACKS``
+    setting. The codec class must have the same :attr:`codec_id`.
+    """
+    if len(codec_id) != 1:
+        raise ValueError('Codec identifiers must be a single character')
+    if CODEC_IDS.get(codec_id, module) != module:
+        raise ValueError('Codec identifier already in use: %r' % codec_id)
+    CODEC_IDS[codec_id] = module
+
 # Get the codec specified in the project's settings. Use the json codec by
 # default, for security reasons: http://nadiana.com/python-pickle-insecure
 codec = get_codec(getattr(settings, 'FLASH_CODEC', 'json'))
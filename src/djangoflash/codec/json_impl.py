@@ -1,31 +1,127 @@
 # -*- coding: utf-8 -*-
 
 """This module provides a JSON-based codec implementation.
+
+The JSON library (*engine*) used by this codec can be chosen through the
+``FLASH_JSON_ENGINE`` setting:
+
+* ``'auto'`` -- the fastest engine available (default);
+* ``'simplejson'`` -- the :mod:`simplejson` package;
+* ``'json'`` -- the :mod:`json` module of the standard library;
+* ``'django'`` -- the copy of :mod:`simplejson` bundled with Django;
+* ``'ujson'`` -- the :mod:`ujson` package, which is never chosen automatically
+  since it doesn't handle floats and large integers exactly like the others.
+
+All engines produce compact JSON strings, without any whitespace.
 """
 
-try:
-    import json 
-except ImportError:
-    from django.utils import simplejson as json
+from django.conf import settings
 
 from djangoflash.codec import BaseCodec
 from djangoflash.models import FlashScope
 
 
+# Engines tried, in this order, when the engine is chosen automatically
+AUTO_ENGINES = ('simplejson', 'json', 'django')
+
+# Separators that produce compact JSON strings
+_SEPARATORS = (',', ':')
+
+
+def _import_module(name):
+    """Imports the module of the given JSON engine, which must provide the
+    same API as the :mod:`json` module.
+    """
+    if name == 'simplejson':
+        import simplejson as json
+    elif name == 'json':
+        try:
+            import json
+        except ImportError:
+            from django.utils import simplejson as json
+    elif name == 'django':
+        from django.utils import simplejson as json
+    elif name == 'ujson':
+        raise ValueError('The ujson engine has no JSON decoder')
+    else:
+        raise ValueError('Unknown JSON engine: %s' % name)
+    return json
+
+def _import_engine(name):
+    """Imports the given JSON engine. Returns a ``(dumps, loads)`` tuple.
+    """
+    if name == 'ujson':
+        import ujson
+        def dumps(obj):
+            return ujson.dumps(obj, ensure_ascii=True,
+                               escape_forward_slashes=False)
+        return dumps, ujson.loads
+
+    json = _import_module(name)
+    def dumps(obj):
+        return json.dumps(obj, separators=_SEPARATORS)
+    return dumps, json.loads
+
+def _import_decoder(name, **kwargs):
+    """Imports the given JSON engine. Returns the ``decode`` method of a new
+    decoder created with the given keyword arguments.
+    """
+    return _import_module(name).JSONDecoder(**kwargs).decode
+
+def _import_first(name, function):
+    """Returns the value returned by *function* for the given JSON engine or,
+    if *name* is ``'auto'``, for the first engine available.
+    """
+    if name != 'auto':
+        return function(name)
+    for name in AUTO_ENGINES:
+        try:
+            return function(name)
+        except ImportError:
+            pass
+    raise ImportError('No JSON engine available')
+
+def get_engine(name='auto'):
+    """Returns the ``(dumps, loads)`` functions of the given JSON engine.
+    Raises an :exc:`ImportError` if the engine is not available.
+    """
+    return _import_first(name, _import_engine)
+
+def get_decoder(name='auto', **kwargs):
+    """Returns a function that decodes JSON strings using the given JSON
+    engine and the given keyword arguments (such as ``object_hook``). This is
+    faster than passing them to ``loads`` every time. Raises an
+    :exc:`ImportError` if the engine is not available, or a
+    :exc:`ValueError` if it has no decoder (e.g. :mod:`ujson`).
+    """
+    return _import_first(name, lambda name: _import_decoder(name, **kwargs))
+
+# Get the JSON engine specified in the project's settings
+dumps, loads = get_engine(getattr(settings, 'FLASH_JSON_ENGINE', 'auto'))
+
+
 class CodecClass(BaseCodec):
     """JSON-based codec implementation.
     """
-    def __init__(self):
-        """Returns a new JSON-based codec.
+
+    codec_id = 'j'
+
+    def __init__(self, engine=None):
+        """Returns a new JSON-based codec. The JSON *engine* defaults to the
+        one specified in the project's settings.
         """
         BaseCodec.__init__(self)
+        if engine is None:
+            self.dumps, self.loads = dumps, loads
+        else:
+            self.dumps, self.loads = get_engine(engine)
 
     def encode(self, flash):
         """Encodes the given *flash* as a JSON string.
         """
-        return json.dumps(flash.to_dict())
+        return self.dumps(flash.to_dict())
 
     def decode(self, encoded_flash):
         """Restores the *flash* from the given JSON string.
         """
-        return FlashScope(json.loads(encoded_flash))
+        return FlashScope(self.loads(encoded_flash))
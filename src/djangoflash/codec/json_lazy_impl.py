@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+"""This module provides a JSON-based codec implementation that decodes each
+value of the *flash* only when it's first accessed.
+
+The encoded flash is made of a small JSON index, a line break and the JSON
+encoded values, one after another. The index holds the *used* status of the
+values (and their expiration times, if any), as well as the key and the
+offsets of each encoded value::
+
+    {"_keys":[["info",0,6]],"_used":{"info":null}}
+    "Info"
+
+When the flash is restored, only the index is parsed. Values that are never
+accessed are never decoded, and they're written back exactly as they were
+read when the flash is encoded again. This makes carrying large values (such
+as form data or long lists of messages) through requests that don't display
+them a lot cheaper.
+
+This codec uses the same JSON engine as :mod:`djangoflash.codec.json_impl`.
+"""
+
+from djangoflash.codec import BaseCodec
+from djangoflash.codec.json_impl import dumps, loads, get_engine
+from djangoflash.models import FlashScope, _SESSION_KEY, _USED_KEY, \
+    _EXPIRES_KEY
+
+
+# Map key used to store the offsets of the encoded values in the index
+_KEYS_KEY = '_keys'
+
+
+class _EncodedValue(object):
+    """Placeholder for a value that wasn't decoded yet.
+    """
+
+    __slots__ = ('data', 'start', 'end', 'loads')
+
+    def __init__(self, data, start, end, loads=loads):
+        """Returns a placeholder for the value encoded in ``data[start:end]``,
+        to be decoded by the given *loads* function.
+        """
+        self.data, self.start, self.end = data, start, end
+        self.loads = loads
+
+    def raw(self):
+        """Returns the encoded value.
+        """
+        return self.data[self.start:self.end]
+
+    def decode(self):
+        """Returns the decoded value.
+        """
+        return self.loads(self.raw())
+
+    def __repr__(self):
+        return '<encoded %s>' % self.raw()
+
+
+class _LazyDict(dict):
+    """Dictionary whose values are decoded when they're first accessed.
+    Decoded values replace their placeholders, so they're decoded only once.
+    """
+
+    def _decoded(self, key, value):
+        """Returns the given *value*, decoding it first if needed.
+        """
+        if isinstance(value, _EncodedValue):
+            value = value.decode()
+            dict.__setitem__(self, key, value)
+        return value
+
+    def __getitem__(self, key):
+        return self._decoded(key, dict.__getitem__(self, key))
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return dict.pop(self, key, *default)
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def itervalues(self):
+        for key in self.keys():
+            yield self[key]
+
+    def iteritems(self):
+        for key in self.keys():
+            yield key, self[key]
+
+    def copy(self):
+        """Returns a shallow copy of this dictionary. Values that weren't
+        decoded yet remain encoded in the copy.
+        """
+        return _LazyDict(self)
+
+    def raw_items(self):
+        """Returns the list of items as tuples ``(key, value)``, without
+        decoding any value.
+        """
+        return dict.items(self)
+
+
+class CodecClass(BaseCodec):
+    """JSON-based codec implementation that decodes values lazily.
+    """
+
+    codec_id = 'l'
+
+    def __init__(self, engine=None):
+        """Returns a new lazy JSON-based codec. The JSON *engine* defaults to
+        the one specified in the project's settings.
+        """
+        BaseCodec.__init__(self)
+        if engine is None:
+            self.dumps, self.loads = dumps, loads
+        else:
+            self.dumps, self.loads = get_engine(engine)
+
+    def encode(self, flash):
+        """Encodes the given *flash* as a JSON index followed by the JSON
+        encoded values. Values that weren't decoded since the flash was
+        restored are not encoded again.
+        """
+        data = flash.to_dict()
+        session = data[_SESSION_KEY]
+        if isinstance(session, _LazyDict):
+            items = session.raw_items()
+        else:
+            items = session.items()
+        items.sort(key=lambda item: item[0])
+
+        keys, values, offset = [], [], 0
+        for key, value in items:
+            if isinstance(value, _EncodedValue):
+                value = value.raw()
+            else:
+                value = self.dumps(value)
+            keys.append((key, offset, offset + len(value)))
+            values.append(value)
+            offset += len(value)
+
+        index = '{"%s":%s,"%s":%s' % (_KEYS_KEY, self.dumps(keys),
+                                      _USED_KEY, self.dumps(data[_USED_KEY]))
+        if _EXPIRES_KEY in data:
+            index += ',"%s":%s' % (_EXPIRES_KEY, self.dumps(data[_EXPIRES_KEY]))
+        return '%s}\n%s' % (index, ''.join(values))
+
+    def decode(self, encoded_flash):
+        """Restores the *flash* from the given encoded data. Only the index
+        is parsed; values are decoded when they're first accessed.
+        """
+        index, values = encoded_flash.split('\n', 1)
+        index = self.loads(index)
+
+        session = _LazyDict()
+        for key, start, end in index[_KEYS_KEY]:
+            if not 0 <= start <= end <= len(values):
+                raise ValueError('Invalid offsets for key %r' % key)
+            session[key] = _EncodedValue(values, start, end, self.loads)
+
+        return FlashScope({_SESSION_KEY: session, _USED_KEY: index[_USED_KEY],
+                           _EXPIRES_KEY: index.get(_EXPIRES_KEY, {})})
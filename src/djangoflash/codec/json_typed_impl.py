@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+"""This module provides a JSON-based codec implementation that supports more
+types than plain JSON, such as dates, decimals and tuples, which makes it a
+safer (but slower) alternative to the :mod:`djangoflash.codec.pickle_impl`
+codec.
+
+Values of those types are encoded as single-key objects whose key (the *tag*)
+identifies the type::
+
+    {"~dt": [2011, 2, 12, 10, 30, 0, 0]}
+
+The following types are supported by default:
+
+========================================  =========  ====================
+Type                                      Tag        Encoded as
+========================================  =========  ====================
+:class:`datetime.datetime` (naive)        ``~dt``    array of fields
+:class:`datetime.date`                    ``~d``     array of fields
+:class:`datetime.time` (naive)            ``~t``     array of fields
+:class:`decimal.Decimal`                  ``~dec``   string
+:class:`tuple`                            ``~tu``    array
+:class:`uuid.UUID`                        ``~u``     hex string
+:class:`djangoflash.i18n.Message`         ``~m``     array
+Lazy translation strings                  --         string
+========================================  =========  ====================
+
+Lazy translation strings are translated when the flash is encoded, so they're
+decoded as plain strings. Other types can be supported through
+:func:`register_type`.
+
+Objects that look like tagged values (i.e. objects with a single key starting
+with ``~``) are escaped by prefixing their key with another ``~``, so any
+:class:`dict` is restored exactly as it was stored.
+
+Tagged values are restored by the JSON engine itself, through its
+``object_hook`` argument, as the flash is parsed. Engines that don't support
+it (such as :mod:`ujson`) restore them in a second pass.
+
+This codec writes smaller flashes than the Pickle-based one, but it's slower.
+On CPython 2.7 with the standard :mod:`json` module, encoding-and-signing and
+decoding a flash that holds dates, decimals and tuples takes about 51 and
+51 microseconds, against 35 and 25 with :mod:`cPickle` (1.5 and 2 times
+slower); a flash that holds plain values only takes about 25 and 21
+microseconds, against 17 and 15 (about 1.4 times slower). Run
+``python -m djangoflash.tests.benchmark`` to measure it on your own setup.
+"""
+
+from datetime import datetime, date, time
+from decimal import Decimal
+from uuid import UUID
+
+from django.conf import settings
+from django.utils.encoding import force_unicode
+from django.utils.functional import Promise
+
+from djangoflash.codec.json_impl import CodecClass as JSONCodecClass, \
+    get_decoder
+from djangoflash.i18n import Message
+from djangoflash.models import FlashScope
+
+
+# Types encoded as they are
+_PLAIN_TYPES = (str, unicode, int, long, float, bool, type(None))
+
+# Type --> (tag, function that encodes values of that type)
+_encoders = {}
+
+# Tag --> function that decodes values with that tag
+_decoders = {}
+
+
+def register_type(value_type, tag, encode, decode):
+    """Tells the typed JSON codec how to handle values of the given type.
+
+    The *encode* function is called with a value of type *value_type* and must
+    return a JSON-compatible value, which is passed to *decode* when the flash
+    is restored. The *tag* must start with ``~`` and be unique. If *tag* is
+    ``None``, the encoded value is stored as is, and *decode* is never called.
+
+    Subclasses of *value_type* are handled the same way, unless they're
+    registered themselves.
+    """
+    if tag is not None:
+        if not tag.startswith('~') or tag.startswith('~~') or len(tag) < 2:
+            raise ValueError("Tags must start with a single '~': %r" % tag)
+        if tag in _decoders:
+            raise ValueError('Tag already in use: %r' % tag)
+        _decoders[tag] = decode
+    _encoders[value_type] = (tag, encode)
+
+
+def _datetime_fields(value):
+    """Returns the fields of the given datetime as a list. Values that have a
+    timezone are not supported.
+    """
+    if value.tzinfo is not None:
+        raise TypeError('Values with timezone are not supported: %r' % value)
+    return [value.year, value.month, value.day, value.hour, value.minute,
+            value.second, value.microsecond]
+
+def _date_fields(value):
+    """Returns the fields of the given date as a list.
+    """
+    return [value.year, value.month, value.day]
+
+def _time_fields(value):
+    """Returns the fields of the given time as a list. Values that have a
+    timezone are not supported.
+    """
+    if value.tzinfo is not None:
+        raise TypeError('Values with timezone are not supported: %r' % value)
+    return [value.hour, value.minute, value.second, value.microsecond]
+
+def _message_fields(value):
+    """Returns the message id and the parameters (if any) of the given
+    message as a list.
+    """
+    if value.params is None:
+        return [value.msgid]
+    return [value.msgid, value.params]
+
+def _from_fields(value_type):
+    """Returns a function that builds a value of the given type from a list of
+    fields.
+    """
+    return lambda fields: value_type(*fields)
+
+register_type(datetime, '~dt', _datetime_fields, _from_fields(datetime))
+register_type(date, '~d', _date_fields, _from_fields(date))
+register_type(time, '~t', _time_fields, _from_fields(time))
+register_type(Decimal, '~dec', str, Decimal)
+register_type(tuple, '~tu', list, tuple)
+register_type(UUID, '~u', lambda value: value.hex, UUID)
+register_type(Message, '~m', _message_fields, _from_fields(Message))
+register_type(Promise, None, force_unicode, None)
+
+# Subclasses of the types supported by plain JSON (such as safe strings) are
+# encoded as their base types
+for _type in (str, unicode, int, long, float, list, dict):
+    register_type(_type, None, _type, None)
+
+
+def _find_encoder(value_type):
+    """Returns the ``(tag, encode)`` tuple registered for the given type or
+    its closest base class.
+    """
+    for base in value_type.__mro__:
+        if base in _encoders:
+            _encoders[value_type] = _encoders[base]
+            return _encoders[base]
+    raise TypeError('Type not supported: %s' % value_type.__name__)
+
+
+def _tag(value):
+    """Returns a JSON-compatible version of the given *value*. Lists and dicts
+    are only copied if some of their items had to be changed.
+    """
+    value_type = type(value)
+    if value_type in _PLAIN_TYPES:
+        return value
+    if value_type is list:
+        tagged = value
+        for index, item in enumerate(value):
+            if type(item) in _PLAIN_TYPES:
+                continue
+            tagged_item = _tag(item)
+            if tagged_item is not item:
+                if tagged is value:
+                    tagged = value[:]
+                tagged[index] = tagged_item
+        return tagged
+    if value_type is dict:
+        tagged = value
+        for key, item in value.iteritems():
+            if type(item) in _PLAIN_TYPES:
+                continue
+            tagged_item = _tag(item)
+            if tagged_item is not item:
+                if tagged is value:
+                    tagged = value.copy()
+                tagged[key] = tagged_item
+        if len(tagged) == 1:
+            key, = tagged
+            if isinstance(key, basestring) and key.startswith('~'):
+                return {'~' + key: tagged[key]}
+        return tagged
+
+    tag, encode = _encoders.get(value_type) or _find_encoder(value_type)
+    if tag is None:
+        return _tag(encode(value))
+    return {tag: _tag(encode(value))}
+
+
+def _untag_object(value):
+    """Restores the given object returned by :func:`_tag`, whose items were
+    already restored. This function is used as the ``object_hook`` of the
+    JSON engine.
+    """
+    if len(value) == 1:
+        key, = value
+        if key.startswith('~~'):
+            return {key[1:]: value[key]}
+        if key in _decoders:
+            return _decoders[key](value[key])
+        if key.startswith('~'):
+            raise ValueError('Unknown tag: %r' % key)
+    return value
+
+
+def _untag(value):
+    """Restores the given value returned by :func:`_tag`, for JSON engines that
+    don't support the ``object_hook`` argument.
+    """
+    value_type = type(value)
+    if value_type is list:
+        return [_untag(item) for item in value]
+    if value_type is not dict:
+        return value
+    return _untag_object(dict([(key, _untag(item)) for key, item
+                               in value.iteritems()]))
+
+
+class CodecClass(JSONCodecClass):
+    """Typed JSON-based codec implementation.
+    """
+
+    codec_id = 't'
+
+    def __init__(self, engine=None):
+        """Returns a new typed JSON-based codec. The JSON *engine* defaults to
+        the one specified in the project's settings.
+        """
+        JSONCodecClass.__init__(self, engine)
+        engine = engine or getattr(settings, 'FLASH_JSON_ENGINE', 'auto')
+        try:
+            self._loads_tagged = get_decoder(engine, object_hook=_untag_object)
+        except ValueError:
+            self._loads_tagged = self._loads_and_untag
+
+    def encode(self, flash):
+        """Encodes the given *flash* as a JSON string, tagging the values
+        that aren't supported by plain JSON.
+        """
+        data = flash.to_dict()
+        for name, values in data.items():
+            data[name] = _tag(values)
+        return self.dumps(data)
+
+    def decode(self, encoded_flash):
+        """Restores the *flash* from the given JSON string.
+        """
+        # Tagged values can only be found if there's a key starting with "~"
+        if '"~' not in encoded_flash:
+            return FlashScope(self.loads(encoded_flash))
+        return FlashScope(self._loads_tagged(encoded_flash))
+
+    def _loads_and_untag(self, encoded_flash):
+        """Parses the given JSON string and restores its tagged values, for
+        JSON engines that have no decoder supporting object hooks.
+        """
+        return _untag(self.loads(encoded_flash))
@@ -7,16 +7,19 @@
 import zlib
 
 from djangoflash.codec.json_impl import CodecClass as JSONCodecClass
-from djangoflash.models import FlashScope
 
 
 class CodecClass(JSONCodecClass):
     """JSON/zlib-based codec implementation.
     """
-    def __init__(self):
-        """Returns a new JSON/zlib-based codec.
+
+    codec_id = 'z'
+
+    def __init__(self, engine=None):
+        """Returns a new JSON/zlib-based codec. The JSON *engine* defaults to
+        the one specified in the project's settings.
         """
-        JSONCodecClass.__init__(self)
+        JSONCodecClass.__init__(self, engine)
 
     def encode(self, flash):
         """Encodes the given *flash* as a zlib compressed JSON string.
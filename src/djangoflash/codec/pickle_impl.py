@@ -20,6 +20,9 @@ from djangoflash.codec import BaseCodec
 class CodecClass(BaseCodec):
     """Pickle-based codec implementation.
     """
+
+    codec_id = 'p'
+
     def __init__(self):
         """Returns a new Pickle-based codec.
         """
@@ -26,7 +26,7 @@ using the ``flash`` context variable.
 """
 
 from django.core.exceptions import SuspiciousOperation
-from djangoflash.models import FlashScope
+from djangoflash.models import EMPTY_FLASH, FlashScope
 
 
 # Name of the variable used to keep FlashScope objects both as an attribute
@@ -47,12 +47,62 @@ def flash(request):
        </html>
     
     """
-    flash_scope = None
+    return {CONTEXT_VAR: _get_flash(request)}
+
+def lazy_flash(request):
+    """Works just like :func:`flash`, but the :class:`FlashScope` object is
+    only retrieved (and validated) when a template actually uses the ``flash``
+    context variable. Templates that never use it don't pay anything::
+
+        TEMPLATE_CONTEXT_PROCESSORS = (
+            'djangoflash.context_processors.lazy_flash',
+        )
+    """
+    return {CONTEXT_VAR: _LazyFlash(request)}
+
+def _get_flash(request):
+    """Returns the :class:`FlashScope` object from the given *request*. If
+    there's none, a shared empty (and immutable) flash is returned instead.
+    """
     try:
         flash_scope = getattr(request, CONTEXT_VAR)
-        if not isinstance(flash_scope, FlashScope):
-            raise SuspiciousOperation('Invalid flash: %s' % repr(flash_scope))
     except AttributeError:
         # Exposes an empty flash when none is available
-        flash_scope = FlashScope()
-    return {CONTEXT_VAR: flash_scope}
+        return EMPTY_FLASH
+    if not isinstance(flash_scope, FlashScope):
+        raise SuspiciousOperation('Invalid flash: %s' % repr(flash_scope))
+    return flash_scope
+
+
+class _LazyFlash(object):
+    """Proxy that delegates to the flash of a given request, retrieving it on
+    first use.
+    """
+
+    def __init__(self, request):
+        """Returns a new proxy to the flash of the given *request*.
+        """
+        self._request = request
+        self._flash = None
+
+    def _resolve(self):
+        """Returns the proxied :class:`FlashScope` object.
+        """
+        if self._flash is None:
+            self._flash = _get_flash(self._request)
+        return self._flash
+
+    # Makes isinstance(proxy, FlashScope) work as expected
+    __class__ = property(lambda self: self._resolve().__class__)
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __getitem__(self, key):
+        return self._resolve()[key]
+
+    def __contains__(self, key):
+        return key in self._resolve()
+
+    def __len__(self):
+        return len(self._resolve())
@@ -3,24 +3,76 @@
 """This module provides decorators to simplify common tasks.
 """
 
-from djangoflash.context_processors import CONTEXT_VAR
+from django.utils.functional import wraps
+
+
+# Names of the view attributes honoured by FlashMiddleware
+NO_FLASH_ATTR       = 'flash_disabled'
+FLASH_REQUIRED_ATTR = 'flash_required'
+KEEP_MESSAGES_ATTR  = 'flash_keep'
 
 
 def keep_messages(*keys):
     """Prevents specific values from being removed during the processing of
     the decorated view. If this decorator is used with no args, the entire
     flash is preserved.
+
+    The view is wrapped by a thin function that tells
+    :class:`djangoflash.middleware.FlashMiddleware` which values should not
+    be expired when the decorated view is requested; the *flash* isn't
+    touched when the view is called.
     """
     def _keep_messages(view_method):
-        def _wrapped_view_method(request, *args, **kwargs):
-            if hasattr(request, CONTEXT_VAR):
-                flash = getattr(request, CONTEXT_VAR)
-                flash.keep(*keys)
-                return view_method(request, *args, **kwargs)
-        return _wrapped_view_method
+        return _wrap_view(view_method, KEEP_MESSAGES_ATTR, tuple(keys))
 
     if len(keys) == 1 and callable(keys[0]):
         view_method = keys[0]
         keys = []
         return _keep_messages(view_method)
     return _keep_messages
+
+def no_flash(view_method):
+    """Tells :class:`djangoflash.middleware.FlashMiddleware` to leave the
+    *flash* alone when the decorated view is requested: the flash isn't
+    retrieved from (nor written to) the storage and its values aren't expired.
+    The decorated view gets an empty flash, which is discarded afterwards.
+    """
+    return _wrap_view(view_method, NO_FLASH_ATTR)
+
+def flash_required(view_method):
+    """Tells :class:`djangoflash.middleware.FlashMiddleware` to always handle
+    the *flash* when the decorated view is requested, even if the request or
+    the response would be ignored otherwise (see :ref:`configuration`).
+    """
+    return _wrap_view(view_method, FLASH_REQUIRED_ATTR)
+
+def _wrap_view(view_method, name, value=True):
+    """Returns a wrapper of the given view whose attribute *name* is *value*.
+    The view itself isn't changed, since it might be used by other URL
+    patterns. The attributes set by other decorators are kept.
+    """
+    def _wrapped_view_method(*args, **kwargs):
+        return view_method(*args, **kwargs)
+    wrapped_view_method = wraps(view_method)(_wrapped_view_method)
+    setattr(wrapped_view_method, name, value)
+    return wrapped_view_method
+
+
+class NoFlashMixin(object):
+    """Class-based view mixin that works like the :func:`no_flash` decorator.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return no_flash(super(NoFlashMixin, cls).as_view(**initkwargs))
+
+
+class FlashRequiredMixin(object):
+    """Class-based view mixin that works like the :func:`flash_required`
+    decorator.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return flash_required(super(FlashRequiredMixin, cls).as_view(
+            **initkwargs))
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""This module provides the :class:`Message` class, which allows views to put
+translatable messages into the *flash* without translating them right away::
+
+    from django.utils.translation import ugettext_noop
+    from djangoflash.i18n import Message
+
+    def my_view(request):
+        request.flash['message'] = Message(
+            ugettext_noop('Welcome back, %(name)s!'), {'name': user.first_name})
+
+Only the message id and its parameters are stored, which are usually a lot
+shorter than the translated message. The message is translated to the active
+language (and formatted) when it's displayed, e.g. when a template renders it.
+
+:class:`Message` objects are supported by the
+:mod:`djangoflash.codec.json_typed_impl` and
+:mod:`djangoflash.codec.pickle_impl` codecs, as well as by the session-based
+storage.
+"""
+
+from django.utils.translation import get_language, ugettext
+
+from djangoflash.utils import LRUCache
+
+
+# Translated message ids, by (message id, language)
+_translations = LRUCache(1000)
+
+
+def _translate(msgid):
+    """Returns the given message id translated to the active language.
+    """
+    key = (msgid, get_language())
+    translation = _translations.get(key)
+    if translation is None:
+        translation = ugettext(msgid)
+        _translations.set(key, translation)
+    return translation
+
+
+class Message(object):
+    """Message to be translated and formatted when it's displayed.
+    """
+
+    __slots__ = ('msgid', 'params')
+
+    def __init__(self, msgid, params=None):
+        """Returns a new message. The translated *msgid* is formatted with the
+        given *params* (with the ``%`` operator) when the message is
+        displayed.
+        """
+        self.msgid = msgid
+        self.params = params
+
+    def __unicode__(self):
+        """Returns the message translated to the active language.
+        """
+        translation = _translate(self.msgid)
+        if self.params is None:
+            return translation
+        return translation % self.params
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+    def __repr__(self):
+        return 'Message(%r, %r)' % (self.msgid, self.params)
+
+    def __eq__(self, other):
+        return isinstance(other, Message) and \
+            (self.msgid, self.params) == (other.msgid, other.params)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __reduce__(self):
+        """Returns a compact representation of this message to be pickled.
+        """
+        if self.params is None:
+            return (Message, (self.msgid,))
+        return (Message, (self.msgid, self.params))
@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+
+"""Dummy file to make this directory a package.
+"""
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+"""Management command that removes the expired flashes stored by a
+server-side flash storage, such as the database-based storage.
+"""
+
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+
+
+class Command(NoArgsCommand):
+    """Removes the expired flashes stored by a server-side flash storage.
+    """
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--storage', action='store', dest='storage', default=None,
+            help='Flash storage to purge. Defaults to FLASH_STORAGE.'),
+        make_option('--batch-size', action='store', type='int',
+            dest='batch_size', default=1000,
+            help='Maximum number of flashes removed at a time.'),
+        make_option('--pause', action='store', type='float', dest='pause',
+            default=0,
+            help='Number of seconds to wait between batches.'),
+    )
+    help = "Can be run as a cronjob or directly to remove the expired " \
+           "flashes stored by a server-side flash storage."
+
+    def handle_noargs(self, **options):
+        from djangoflash.storage import get_storage
+        name = options.get('storage') or \
+            getattr(settings, 'FLASH_STORAGE', 'session')
+        storage = get_storage(name)
+        if not hasattr(storage, 'purge'):
+            raise CommandError("The '%s' flash storage can't be purged" % name)
+
+        batch_size = options.get('batch_size', 1000)
+        if batch_size < 1:
+            raise CommandError('--batch-size must be a positive number')
+        removed = storage.purge(batch_size, options.get('pause', 0))
+        if int(options.get('verbosity', 1)) > 1:
+            print 'Removed %d expired flashes' % removed
@@ -12,20 +12,58 @@ To plug this middleware to your Django project, edit your project's
     )
 """
 
-from urlparse import urlparse
+import base64
+import os
+import re
+import urlparse
+
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
 
 from django.conf import settings
-from django.core.exceptions import SuspiciousOperation
-from django.core import urlresolvers
+from django.core.exceptions import ImproperlyConfigured, SuspiciousOperation
+from django.db import close_connection
 from django.views.static import serve
 
 from djangoflash.context_processors import CONTEXT_VAR
+from djangoflash.decorators import NO_FLASH_ATTR, FLASH_REQUIRED_ATTR, \
+    KEEP_MESSAGES_ATTR
 from djangoflash.models import FlashScope
-from djangoflash.storage import storage
+from djangoflash.storage import storage, BUCKET_ATTR, HINT_COOKIE, \
+    get_bucket, get_generation
+from djangoflash.utils import ThreadPool
+
+
+# Name of the attribute used to flag requests ignored by this middleware. Its
+# value is True for ignored requests and False for requests that must never
+# be ignored (views decorated with @flash_required)
+_IGNORED_VAR = '_flash_ignored'
+
+# Name of the attribute that tells whether a flash was retrieved from the
+# storage
+_STORED_VAR = '_flash_stored'
+
+# Name of the attribute that tells whether the flash might be stored, i.e.
+# whether the storage must be queried at all
+_HINTED_VAR = '_flash_hinted'
+
+# Generation numbers wrap around after this value
+_MAX_GENERATION = 999999999
+
+# Thread pool used to prefetch flashes, shared by all middleware instances
+_pool = None
+_pool_lock = threading.Lock()
 
+# Header that clients (e.g. AJAX requests) may use to tell the flash bucket,
+# and format of the bucket tokens
+_BUCKET_HEADER = 'X-Flash-Bucket'
+_BUCKET_RE = re.compile(r'^[A-Za-z0-9_-]{8}$')
 
-# This middleware integrates gracefully with CommonMiddleware
-_COMMON_MIDDLEWARE_CLASS = 'django.middleware.common.CommonMiddleware'
+# Status codes of the redirects that carry the flash bucket, as long as they
+# redirect to the same host
+_REDIRECT_STATUS_CODES = frozenset([301, 302, 303, 307])
 
 
 class FlashMiddleware(object):
@@ -34,36 +72,265 @@ class FlashMiddleware(object):
     :class:`djangoflash.models.FlashScope` objects, being also responsible for
     expiring old flash-scoped objects.
 
+    If the ``FLASH_BUCKETS`` setting is ``True``, a redirect issued by a
+    request that leaves values in the *flash* moves them to a new *bucket*,
+    identified by a short token that is added to the redirect URL (as the
+    ``FLASH_BUCKET_PARAM`` query parameter, ``'_flash'`` by default). The
+    request that follows the redirect only retrieves, expires and stores the
+    values of that bucket, so requests made by other browser tabs don't
+    consume them. Clients may also send the token in the ``X-Flash-Bucket``
+    header, which is added to the redirect responses as well.
+
+    If the ``FLASH_PRESENCE_HINT`` setting is ``True``, a small cookie is sent
+    to the user while the main *flash* is stored. The storage isn't queried at
+    all (thus the session isn't loaded, when using the session-based storage)
+    for requests that don't carry that cookie.
+
+    If the ``FLASH_PREFETCH`` setting is ``True``, the flash is retrieved from
+    a server-side storage by a background thread just before the view is
+    called, while the view runs. Using the *flash* only waits for the
+    retrieval to finish. Requests that are ignored, or whose view is decorated
+    with :func:`djangoflash.decorators.no_flash`, are not prefetched.
+
     .. note::
        This class is designed to be used by the Django framework itself.
     """
 
+    def __init__(self):
+        """Returns a new middleware, compiling the rules that tell which
+        requests and responses should be ignored.
+        """
+        self.rules = _IgnoreRules()
+        self.buckets = getattr(settings, 'FLASH_BUCKETS', False)
+        self.bucket_param = getattr(settings, 'FLASH_BUCKET_PARAM', '_flash')
+        self.hint = getattr(settings, 'FLASH_PRESENCE_HINT', False)
+        self.pool = None
+        if getattr(settings, 'FLASH_PREFETCH', False):
+            # Other storages (e.g. the session) can't be used by two threads
+            if not hasattr(storage, 'load'):
+                raise ImproperlyConfigured('FLASH_PREFETCH requires a '
+                                           'server-side flash storage')
+            self.pool = _get_pool()
+
     def process_request(self, request):
         """This method is called by the Django framework when a *request* hits
-        the server.
+        the server. The flash is only retrieved from the storage when it's
+        first used.
+        """
+        if self.buckets:
+            setattr(request, BUCKET_ATTR, self._get_bucket(request))
+        if self.hint and get_bucket(request) is None and \
+                get_generation(request) is None:
+            # Nothing is stored, the storage can be left alone
+            setattr(request, _HINTED_VAR, False)
+        _set_deferred_flash(request)
+        if self.rules.ignore_request(request):
+            setattr(request, _IGNORED_VAR, True)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """This method is called by the Django framework just before a view is
+        called. Expires old flash-scoped objects, unless the request is
+        ignored. The flash is expired as soon as it's retrieved from the
+        storage, so the view doesn't wait for it.
         """
-        flash = _get_flash_from_storage(request)
-        if _should_update_flash(request):
-            flash.update()
+        flash = _get_flash_from_request(request)
+        if flash is None:
+            return
+
+        if getattr(view_func, NO_FLASH_ATTR, False):
+            setattr(request, _IGNORED_VAR, True)
+            if not flash.is_loaded():
+                setattr(request, CONTEXT_VAR, FlashScope())
+        elif getattr(view_func, FLASH_REQUIRED_ATTR, False):
+            setattr(request, _IGNORED_VAR, False)
+            flash = self._prefetch(request, flash)
+            _update_flash(flash, view_func)
+            # Views that require the flash get it loaded and expired
+            flash.load()
+        elif not getattr(request, _IGNORED_VAR, False) and \
+            not _is_serve_view(view_func):
+            _update_flash(self._prefetch(request, flash), view_func)
+
+    def _prefetch(self, request, flash):
+        """Starts retrieving the given flash in the background, unless
+        prefetching is disabled or it was already retrieved. Returns the flash
+        to be used by the request.
+        """
+        if self.pool is None or flash.is_loaded():
+            return flash
+        return _set_deferred_flash(request, self.pool)
 
     def process_response(self, request, response):
         """This method is called by the Django framework when a *response* is
-        sent back to the user.
+        sent back to the user. The flash is only written to the storage if it
+        was used during the processing of the request, without the values
+        that were already used.
         """
         flash = _get_flash_from_request(request)
-        if flash:
-            storage.set(flash, request, response)
-        else:
-            _get_flash_from_storage(request)
+        if flash is None:
+            _set_deferred_flash(request)
+        elif flash.is_touched():
+            ignored = getattr(request, _IGNORED_VAR, None)
+            if ignored is None:
+                ignored = self.rules.ignore_response(response)
+            if not ignored:
+                # Values marked as used are dropped right away, so the stored
+                # flash is removed as soon as it becomes empty
+                flash = flash.persistent()
+                main = get_bucket(request) is None
+                if self.buckets and flash and \
+                        self._is_local_redirect(request, response):
+                    self._move_to_new_bucket(flash, request, response)
+                    flash = None
+                elif flash or getattr(request, _HINTED_VAR, True):
+                    # The stored flash might hold values added by concurrent
+                    # requests (custom storages might not tell)
+                    stored = storage.set(flash, request, response)
+                    if stored is not None:
+                        flash = stored
+                if self.hint and main:
+                    self._set_hint(bool(flash), request, response)
 
         return response
 
+    def _set_hint(self, stored, request, response):
+        """Sends the presence hint cookie, with the next generation number, if
+        the main flash was *stored*, or removes it otherwise.
+        """
+        generation = get_generation(request)
+        if stored:
+            generation = (generation or 0) % _MAX_GENERATION + 1
+            response.set_cookie(HINT_COOKIE, str(generation))
+        elif HINT_COOKIE in request.COOKIES:
+            response.delete_cookie(HINT_COOKIE)
+
+    def _get_bucket(self, request):
+        """Returns the flash bucket token sent by the client, or ``None`` if
+        there's no (valid) token.
+        """
+        bucket = request.GET.get(self.bucket_param) or \
+            request.META.get('HTTP_X_FLASH_BUCKET')
+        if bucket and _BUCKET_RE.match(bucket):
+            return str(bucket)
+        return None
+
+    def _is_local_redirect(self, request, response):
+        """Returns whether the given response redirects to a relative URL or
+        to the host of the given request. The bucket token is never sent to
+        other sites.
+        """
+        if response.status_code not in _REDIRECT_STATUS_CODES or \
+                not response.has_header('Location'):
+            return False
+        host = urlparse.urlsplit(response['Location'])[1]
+        return not host or host == request.get_host()
+
+    def _move_to_new_bucket(self, flash, request, response):
+        """Stores the given *flash* in a new bucket, whose token is added to
+        the redirect URL, removing it from the bucket it was retrieved from.
+        """
+        if getattr(request, _STORED_VAR, False):
+            storage.set(FlashScope(), request, response)
+        bucket = base64.urlsafe_b64encode(os.urandom(6))
+        setattr(request, BUCKET_ATTR, bucket)
+        storage.set(flash, request, response)
+
+        url, hash, fragment = response['Location'].partition('#')
+        separator = '?' in url and '&' or '?'
+        response['Location'] = '%s%s%s=%s%s%s' % (url, separator,
+            self.bucket_param, bucket, hash, fragment)
+        response[_BUCKET_HEADER] = bucket
 
-def _get_flash_from_storage(request):
-    """Gets the flash from the storage, adds it to the given request and
-    returns it. A new :class:`FlashScope` is used if the storage is empty.
+
+class _IgnoreRules(object):
+    """Rules that tell which requests and responses should not trigger the
+    *flash* lifecycle. The rules are compiled from the project's settings when
+    this object is created:
+
+    * ``FLASH_IGNORE_METHODS`` -- HTTP methods, such as ``'HEAD'``;
+    * ``FLASH_IGNORE_PATHS`` -- URL path prefixes, such as ``'/api/'``;
+    * ``FLASH_IGNORE_STATUS_CODES`` -- response status codes, such as ``304``;
+    * ``FLASH_IGNORE_CONTENT_TYPES`` -- response content types, such as
+      ``'application/json'``. Values ending with a slash, such as
+      ``'image/'``, match all content types that start with them;
+
+    The flash of an ignored request isn't updated. The flash of an ignored
+    request or response isn't stored either, so any changes made to it while
+    processing that request are lost.
     """
-    flash = storage.get(request) or FlashScope()
+
+    def __init__(self):
+        """Returns the rules defined in the project's settings.
+        """
+        self.methods = frozenset([method.upper() for method in \
+            getattr(settings, 'FLASH_IGNORE_METHODS', ())])
+        self.paths = tuple(getattr(settings, 'FLASH_IGNORE_PATHS', ()))
+        self.status_codes = frozenset([int(code) for code in \
+            getattr(settings, 'FLASH_IGNORE_STATUS_CODES', ())])
+
+        content_types = [content_type.lower() for content_type in \
+            getattr(settings, 'FLASH_IGNORE_CONTENT_TYPES', ())]
+        self.content_types = frozenset([content_type for content_type in \
+            content_types if not content_type.endswith('/')])
+        self.content_type_prefixes = tuple([content_type for content_type in \
+            content_types if content_type.endswith('/')])
+
+    def ignore_request(self, request):
+        """Returns True if the given *request* should be ignored, False
+        otherwise.
+        """
+        if request.method in self.methods:
+            return True
+        return bool(self.paths) and request.path_info.startswith(self.paths)
+
+    def ignore_response(self, response):
+        """Returns True if the given *response* should be ignored, False
+        otherwise.
+        """
+        if response.status_code in self.status_codes:
+            return True
+        if self.content_types or self.content_type_prefixes:
+            content_type = response.get('Content-Type', '')
+            content_type = content_type.split(';', 1)[0].strip().lower()
+            if content_type in self.content_types:
+                return True
+            return bool(self.content_type_prefixes) and \
+                content_type.startswith(self.content_type_prefixes)
+        return False
+
+
+def _get_pool():
+    """Returns the thread pool used to prefetch flashes, creating it if
+    needed. Its size is given by the ``FLASH_PREFETCH_THREADS`` setting.
+    Each thread keeps its database connection between prefetches, and
+    closes it when it exits.
+    """
+    global _pool
+    _pool_lock.acquire()
+    try:
+        if _pool is None:
+            _pool = ThreadPool(getattr(settings, 'FLASH_PREFETCH_THREADS', 4),
+                               close_connection)
+        return _pool
+    finally:
+        _pool_lock.release()
+
+def _set_deferred_flash(request, pool=None):
+    """Adds a flash to the given request whose contents are retrieved from the
+    storage when first used, unless the request tells that nothing is stored.
+    If a thread *pool* is given, the contents are retrieved by one of its
+    threads right away.
+    """
+    hinted = getattr(request, _HINTED_VAR, True)
+    def load():
+        stored = None
+        if hinted:
+            stored = storage.get(request)
+        setattr(request, _STORED_VAR, stored is not None)
+        return stored
+    if pool is not None and hinted:
+        load = pool.submit(load).result
+    flash = FlashScope.deferred(load)
     setattr(request, CONTEXT_VAR, flash)
     return flash
 
@@ -78,46 +345,24 @@ def _get_flash_from_request(request):
             raise SuspiciousOperation('Invalid flash: %s' % repr(flash))
     return flash
 
-def _should_update_flash(request):
-    """Returns True if the flash should be updated, False otherwise.
+def _update_flash(flash, view_func):
+    """Expires old flash-scoped objects, except the ones kept by the view
+    (see :meth:`djangoflash.decorators.keep_messages`).
     """
-    return not _is_trailing_slash_missing(request) and \
-        not _is_request_to_serve(request)
+    keys = getattr(view_func, KEEP_MESSAGES_ATTR, None)
+    if keys is None:
+        flash.update()
+    else:
+        flash.update(keep=keys or True)
 
-def _is_request_to_serve(request):
-    """Returns True if *request* resolves to the built-in ``serve`` view,
-    False othersise.
+def _is_serve_view(view_func):
+    """Returns True if *view_func* is the built-in ``serve`` view and requests
+    to it should be ignored, False othersise.
     """
     # Are we running in debug mode?
     debug = getattr(settings, 'DEBUG', False)
 
     # Uses the value of DEBUG as default value to FLASH_IGNORE_MEDIA
     if getattr(settings, 'FLASH_IGNORE_MEDIA', debug):
-        try:
-            return urlresolvers.resolve(request.path_info)[0] == serve
-        except urlresolvers.Resolver404:
-            pass
-    return False
-
-def _is_trailing_slash_missing(request):
-    """Returns True if the requested URL are elegible to be intercepted by the
-    CommonMiddleware (if it's being used), which  issues a HttpRedirect when a
-    trailing slash is missing. Returns False otherwise.
-    """
-    if _COMMON_MIDDLEWARE_CLASS in settings.MIDDLEWARE_CLASSES:
-        path = request.path
-        if getattr(settings, 'APPEND_SLASH', False) and not path.endswith('/'):
-            if not _is_valid_path(path) and _is_valid_path('%s/' % path):
-                return True
-    return False
-
-def _is_valid_path(path):
-    """Returns True if *path* resolves against the default URL resolver,
-    False otherwise.
-    """
-    try:
-        urlresolvers.resolve(path)
-        return True
-    except urlresolvers.Resolver404:
-        pass
+        return view_func == serve
     return False
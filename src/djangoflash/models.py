@@ -4,10 +4,23 @@
 way to pass temporary objects between views.
 """
 
+import time
+from copy import deepcopy
+from itertools import chain
+
+from django.conf import settings
+
 
 # Map keys used when exporting/importing a FlashScope to/from a dict
 _SESSION_KEY = '_session'
 _USED_KEY    = '_used'
+_EXPIRES_KEY = '_expires'
+
+# Attributes that trigger the loading of a deferred flash
+_DEFERRED_ATTRS = ('_session', '_used', '_expires')
+
+# Placeholder for missing values when merging flashes
+_MISSING = object()
 
 
 class FlashScope(object):
@@ -49,15 +62,21 @@ class FlashScope(object):
 
     .. describe:: flash.now[key] = value
 
-       Sets ``flash[key]`` to *value* and marks it as *used*.
+       Sets ``flash[key]`` to *value*, available to the current request only.
+       Immediate values are never stored.
 
-    .. describe:: flash.now(**items)
+    .. describe:: flash.now.put(**items)
 
-       Puts *items* into *flash* and marks those items  as *used*.
+       Puts *items* into *flash* as immediate values.
 
     .. describe:: flash.now.add(key, *values)
 
        Appends one or more *values* to *key* in *flash*.
+
+    Besides being removed after the next request, values can also expire
+    after some time: ``FLASH_MAX_AGE`` seconds after they're stored (if that
+    setting is given), or after the time given to :meth:`set_max_age`.
+    Expired values are removed as soon as the flash is restored.
     """
 
     def __init__(self, data=None):
@@ -66,39 +85,154 @@ class FlashScope(object):
         this flash.
         """
         self.now = _ImmediateFlashScopeAdapter(self)
+        self._immediate = {}
         if data:
             self._import_data(data)
         else:
-            self._session, self._used = {}, {}
+            self._session, self._used, self._expires = {}, {}, {}
+
+    @classmethod
+    def deferred(cls, loader):
+        """Returns a new flash whose contents are only retrieved when they're
+        first needed, by calling *loader*. The *loader* must return a
+        :class:`FlashScope` object or ``None``, if there's no flash to load.
+        """
+        flash = cls()
+        del flash._session, flash._used, flash._expires
+        flash._loader = loader
+        return flash
+
+    def __getattr__(self, name):
+        """Loads the contents of a deferred flash as soon as they're needed.
+        """
+        if name not in _DEFERRED_ATTRS or '_loader' not in self.__dict__:
+            raise AttributeError(name)
+        loaded = self._loader()
+        if loaded is None:
+            self._session, self._used, self._expires = {}, {}, {}
+        else:
+            self._session, self._used, self._expires = \
+                loaded._session, loaded._used, loaded._expires
+        del self._loader
+        # Applies the update requested before the contents were loaded
+        if '_keep' in self.__dict__:
+            self.update(self.__dict__.pop('_keep'))
+        return getattr(self, name)
+
+    def load(self):
+        """Retrieves the contents of a deferred flash right away, unless they
+        were already retrieved.
+        """
+        if not self.is_loaded():
+            self._session
+
+    def is_loaded(self):
+        """Returns ``False`` if this is a deferred flash whose contents weren't
+        needed yet, ``True`` otherwise.
+        """
+        return '_loader' not in self.__dict__
+
+    def is_touched(self):
+        """Returns ``True`` if this flash was loaded or updated (see
+        :meth:`update`), that is, if it must be written back to the storage.
+        """
+        return self.is_loaded() or '_keep' in self.__dict__
+
+    def __reduce__(self):
+        """Returns a compact representation of this flash to be pickled: just
+        the values, the keys of the values marked as *used* and the expiration
+        times (if any). Immediate values are never pickled, and deferred
+        flashes are loaded first.
+        """
+        session = self._session
+        if type(session) is not dict:
+            session = dict(session.items())
+        if self._expires:
+            state = (session, tuple(self._used), self._expires)
+        else:
+            state = (session, tuple(self._used))
+        return (self.__class__, (), state)
+
+    def __setstate__(self, state):
+        """Restores the state of this flash from the given unpickled *state*,
+        removing the expired values. Flashes pickled by previous versions are
+        supported as well.
+        """
+        if isinstance(state, tuple):
+            session, used, expires = (state + ({},))[:3]
+            self._session, self._used = session, dict.fromkeys(used)
+            self._expires = expires
+            self._remove_expired()
+        else:
+            self.__dict__.update(state)
+            self.now = _ImmediateFlashScopeAdapter(self)
+            self._immediate = {}
+            self._expires = {}
 
     def __contains__(self, key):
         """Returns ``True`` if there's a value under the given *key*.
         """
-        return key in self._session
+        return key in self._session or key in self._immediate
 
     def __getitem__(self, key):
         """Retrieves a value. Raises a :exc:`KeyError` if *key* does not exists.
         """
+        if key in self._immediate:
+            return self._immediate[key]
         return self._session[key]
 
     def __setitem__(self, key, value):
         """Puts a *value* under the given *key*.
         """
+        if key in self._immediate:
+            del self._immediate[key]
         self._session[key] = value
         self._update_status(key, is_used=False)
+        max_age = getattr(settings, 'FLASH_MAX_AGE', None)
+        if max_age is not None:
+            self._expires[key] = int(time.time() + max_age)
+        elif key in self._expires:
+            del self._expires[key]
 
     def __delitem__(self, key):
         """Removes the value under the given *key*.
         """
-        if key in self:
+        if key in self._immediate:
+            del self._immediate[key]
+        if key in self._session:
             del self._session[key]
         if key in self._used:
             del self._used[key]
+        if key in self._expires:
+            del self._expires[key]
 
     def __len__(self):
         """Returns the number of values inside this flash.
         """
-        return len(self._session)
+        return len(self._session) + len(self._immediate)
+
+    def _put_immediate(self, key, value):
+        """Puts an immediate *value* under the given *key*. Immediate values
+        are kept apart from the other values, since they're never stored.
+        """
+        if key in self._session:
+            del self._session[key]
+        if key in self._used:
+            del self._used[key]
+        if key in self._expires:
+            del self._expires[key]
+        self._immediate[key] = value
+
+    def _appended(self, key, values):
+        """Returns a new list with the value under the given *key* (if any)
+        followed by the given *values*.
+        """
+        if key in self:
+            current_value = self[key]
+            if isinstance(current_value, list):
+                return current_value + list(values)
+            return [current_value] + list(values)
+        return list(values)
 
     def _update_status(self, key=None, is_used=True):
         """Updates the status of a given value (or all values if no *key*
@@ -109,9 +243,9 @@ class FlashScope(object):
         removed from this flash.
         """
         if not key:
-            for existing_key in self.keys():
+            for existing_key in self._session.keys():
                 self._update_status(existing_key, is_used)
-        else:
+        elif key not in self._immediate:
             if not is_used:
                 if key in self._used:
                     del self._used[key]
@@ -124,46 +258,53 @@ class FlashScope(object):
     def keys(self):
         """Returns the list of keys.
         """
-        return self._session.keys()
+        return self._session.keys() + self._immediate.keys()
 
     def values(self):
         """Returns the list of values.
         """
-        return self._session.values()
+        return self._session.values() + self._immediate.values()
 
     def items(self):
         """Returns the list of items as tuples ``(key, value)``.
         """
-        return self._session.items()
+        return self._session.items() + self._immediate.items()
 
     def iterkeys(self):
         """Returns an iterator over the keys.
         """
-        return self._session.iterkeys()
+        return chain(self._session.iterkeys(), self._immediate.iterkeys())
 
     def itervalues(self):
         """Returns an iterator over the values.
         """
-        return self._session.itervalues()
+        return chain(self._session.itervalues(),
+                     self._immediate.itervalues())
 
     def iteritems(self):
         """Returns an iterator over the ``(key, value)`` items.
         """
-        return self._session.iteritems()
+        return chain(self._session.iteritems(), self._immediate.iteritems())
 
     def get(self, key, default=None):
         """Gets the value under the given *key*. If the *key* is not found,
         *default* is returned instead.
         """
+        if key in self._immediate:
+            return self._immediate[key]
         return self._session.get(key, default)
 
     def pop(self, key, default=None):
         """Removes the specified *key* and returns the corresponding value. If
         *key* is not found, *default* is returned instead.
         """
+        if key in self._immediate:
+            return self._immediate.pop(key)
         value = self._session.pop(key, default)
         if key in self._used:
             del self._used[key]
+        if key in self._expires:
+            del self._expires[key]
         return value
 
     def put(self, **kwargs):
@@ -175,22 +316,15 @@ class FlashScope(object):
     def add(self, key, *values):
         """Appends one or more *values* to *key* in this flash.
         """
-        if key in self:
-            current_value = self[key]
-            if not isinstance(current_value, list):
-                self[key] = [current_value]
-                self[key].extend(values)
-            else:
-                current_value.extend(values)
-                self[key] = current_value
-        else:
-            self[key] = list(values)
+        self[key] = self._appended(key, values)
 
     def clear(self):
         """Removes all items from this flash.
         """
         self._session.clear()
         self._used.clear()
+        self._expires.clear()
+        self._immediate.clear()
 
     def discard(self, *keys):
         """Marks the entire current flash or a single value as *used*, so when
@@ -203,14 +337,21 @@ class FlashScope(object):
         """Prevents specific values from being removed on the next request.
         If this method is called with no args, the entire flash is preserved.
         """
+        for key in keys or self._immediate.keys():
+            if key in self._immediate:
+                self[key] = self._immediate[key]
+
         if not keys:
             self._update_status(is_used=False)
         else:
             for key in keys:
                 self._update_status(key, is_used=False)
 
-    def update(self):
+    def update(self, keep=()):
         """Mark for removal entries that were kept, and delete unkept ones.
+        Entries under the keys listed in *keep* are not marked for removal;
+        if *keep* is ``True``, no entry is. The contents of a deferred flash
+        are only updated when they're loaded.
 
         .. note::
            This method is called automatically by
@@ -218,13 +359,123 @@ class FlashScope(object):
            request hits the server, so never call this method yourself, unless
            you have a very good reason to do so.
         """
-        self._update_status()
+        self._immediate.clear()
+        if not self.is_loaded():
+            self._keep = keep
+        elif not keep:
+            self._update_status()
+        else:
+            for key in self._session.keys():
+                if key in self._used:
+                    del self[key]
+                elif keep is not True and key not in keep:
+                    self._used[key] = None
+
+    def persistent(self):
+        """Returns a new flash holding only the values that must be available
+        to the next request, that is, values that are not marked as *used*.
+        Immediate values are not included either.
+
+        .. note::
+           This method is called automatically by
+           :class:`djangoflash.middleware.FlashMiddleware` to get the flash
+           to be written to the storage.
+        """
+        session = self._session.copy()
+        for key in self._used:
+            if key in session:
+                del session[key]
+        expires = dict([(key, deadline) for key, deadline
+                        in self._expires.iteritems() if key in session])
+        return FlashScope({_SESSION_KEY: session, _USED_KEY: {},
+                           _EXPIRES_KEY: expires})
+
+    def merged(self, base, other):
+        """Returns a new flash holding both the changes made by this flash and
+        by *other* to the *base* flash they were both derived from. This is
+        used to merge flashes written by concurrent requests, so all flashes
+        are expected to be persistent (see :meth:`persistent`).
+
+        Changes are merged key by key: values changed by a single flash
+        (including added and removed values) are taken from that flash. If
+        both flashes changed the same value, the value from this flash wins,
+        unless both appended items to the same list, in which case the items
+        appended by both flashes are kept.
+        """
+        session, expires = {}, {}
+        for key in set(self._session) | set(other._session) | set(base._session):
+            mine, theirs = self.get(key, _MISSING), other.get(key, _MISSING)
+            original = base.get(key, _MISSING)
+            deadlines = [self._expires.get(key)]
+            if mine == original:
+                mine, deadlines = theirs, [other._expires.get(key)]
+            elif theirs != original:
+                appended = _appended_items(original, mine, theirs)
+                if appended is not None:
+                    # The merged list expires when both lists have expired
+                    mine = mine + appended
+                    deadlines.append(other._expires.get(key))
+            if mine is _MISSING:
+                continue
+            session[key] = mine
+            if None not in deadlines:
+                expires[key] = max(deadlines)
+        return FlashScope({_SESSION_KEY: session, _USED_KEY: {},
+                           _EXPIRES_KEY: expires})
+
+    def copy(self):
+        """Returns a copy of this flash that can be changed without affecting
+        the original one. Values that can be changed in place (such as lists)
+        are copied; values that can't are shared.
+        """
+        session = self._session.copy()
+        for key, value in dict.items(session):
+            if isinstance(value, (list, dict)):
+                dict.__setitem__(session, key, deepcopy(value))
+        return FlashScope({_SESSION_KEY: session, _USED_KEY: self._used,
+                           _EXPIRES_KEY: self._expires})
+
+    def set_max_age(self, key, max_age):
+        """Makes the value under the given *key* expire after *max_age*
+        seconds, overriding the ``FLASH_MAX_AGE`` setting. If *max_age* is
+        ``None``, the value only expires after being used. Raises a
+        :exc:`KeyError` if *key* does not exists or is an immediate value.
+        """
+        if key not in self._session:
+            raise KeyError(key)
+        if max_age is None:
+            if key in self._expires:
+                del self._expires[key]
+        else:
+            self._expires[key] = int(time.time() + max_age)
+
+    def expires_at(self):
+        """Returns the time (in seconds since the epoch) after which all
+        values of this flash have expired, or ``None`` if some of them never
+        expire (or if this flash is empty).
+        """
+        if not self._session or len(self._expires) < len(self._session):
+            return None
+        return max(self._expires.itervalues())
+
+    def _remove_expired(self):
+        """Removes the values that have expired.
+        """
+        if self._expires:
+            now = time.time()
+            for key, deadline in self._expires.items():
+                if deadline <= now:
+                    del self[key]
 
     def to_dict(self):
-        """Exports this flash to a :class:`dict`.
+        """Exports this flash to a :class:`dict`. Immediate values are not
+        exported, and expiration times are only exported if there's any.
         """
-        return {_SESSION_KEY: self._session.copy(),
+        data = {_SESSION_KEY: self._session.copy(),
                 _USED_KEY   : self._used.copy()}
+        if self._expires:
+            data[_EXPIRES_KEY] = self._expires.copy()
+        return data
 
     def _import_data(self, data):
         """Imports the given :class:`dict` to this flash.
@@ -241,8 +492,28 @@ class FlashScope(object):
         if not isinstance(data[_USED_KEY], dict):
             raise ValueError("data['%s'] must be a dict." % _USED_KEY)
 
+        if not isinstance(data.get(_EXPIRES_KEY, {}), dict):
+            raise ValueError("data['%s'] must be a dict." % _EXPIRES_KEY)
+
         self._session = data[_SESSION_KEY].copy()
         self._used    = data[_USED_KEY].copy()
+        self._expires = data.get(_EXPIRES_KEY, {}).copy()
+        self._remove_expired()
+
+
+def _appended_items(original, mine, theirs):
+    """Returns the items appended by *theirs* to the *original* list (or to
+    an empty list, if there's no *original* value), provided that *mine* was
+    made by appending items to it as well. Otherwise, returns ``None``.
+    """
+    if original is _MISSING:
+        original = []
+    if not isinstance(original, list):
+        return None
+    for value in (mine, theirs):
+        if not isinstance(value, list) or value[:len(original)] != original:
+            return None
+    return theirs[len(original):]
 
 
 class _ImmediateFlashScopeAdapter(object):
@@ -271,8 +542,12 @@ class _ImmediateFlashScopeAdapter(object):
     def __setitem__(self, key, value):
         """Puts a *value* into this flash under the given *key*.
         """
-        self.delegate[key] = value
-        self.delegate.discard(key)
+        self.delegate._put_immediate(key, value)
+
+    def __len__(self):
+        """Returns the number of immediate values inside this flash.
+        """
+        return len(self.delegate._immediate)
 
     def put(self, **kwargs):
         """Puts one or more values into this flash.
@@ -283,5 +558,22 @@ class _ImmediateFlashScopeAdapter(object):
     def add(self, key, *values):
         """Appends one or more values to a key in this flash.
         """
-        self.delegate.add(key, *values)
-        self.delegate.discard(key)
+        self.delegate._put_immediate(key, self.delegate._appended(key, values))
+
+
+class _ImmutableFlashScope(FlashScope):
+    """Empty flash that cannot be modified. A single instance of this class is
+    shared by all requests that don't have a flash of their own.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        """Raises a :exc:`TypeError` since this flash is immutable.
+        """
+        raise TypeError('This flash is immutable')
+
+    __setitem__ = __delitem__ = _readonly
+    pop = put = add = clear = discard = _put_immediate = _readonly
+
+
+# Shared empty flash exposed when there's no flash available
+EMPTY_FLASH = _ImmutableFlashScope()
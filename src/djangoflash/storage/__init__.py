@@ -7,6 +7,34 @@ the *flash* contents across requests.
 from django.conf import settings
 
 
+# Name of the request attribute that holds the flash bucket used by the
+# request (see the FLASH_BUCKETS setting)
+BUCKET_ATTR = '_djflash_bucket'
+
+def get_bucket(request):
+    """Returns the flash bucket used by the given *request*, or ``None`` if
+    the request uses the client's main flash. Storage backends must keep the
+    flash of each bucket apart from the others.
+    """
+    return getattr(request, BUCKET_ATTR, None)
+
+
+# Name of the cookie that tells whether the user has a stored flash (see the
+# FLASH_PRESENCE_HINT setting)
+HINT_COOKIE = '_djflash_hint'
+
+def get_generation(request):
+    """Returns the generation of the client's main flash, as sent in the
+    presence hint cookie by the given *request*, or ``None`` if there's no
+    (valid) hint. The generation is incremented each time the flash is
+    stored.
+    """
+    value = request.COOKIES.get(HINT_COOKIE)
+    if value and value.isdigit() and len(value) < 10:
+        return int(value)
+    return None
+
+
 # Alias for use in settings file --> name of module in "storage" directory.
 # Any storage that is not in this dictionary is treated as a Python import
 # path to a custom storage.
@@ -16,20 +44,30 @@ from django.conf import settings
 STORAGES = {
     'session': 'session',
     'cookie': 'cookie',
+    'shm': 'shm',
+    'database': 'database',
+    'file': 'file',
 }
 
 def get_storage(module):
     """Creates and returns the flash storage backend defined in the given
     module path (ex: ``"myapp.mypackage.mymodule"``). The argument can also
-    be an alias to a built-in storage backend, such as ``"session"`` or
-    ``"cookie"``.
+    be an alias to a built-in storage backend, such as ``"session"``,
+    ``"cookie"``, ``"shm"``, ``"database"`` or ``"file"``.
+
+    If the ``FLASH_L1_CACHE_SIZE`` setting is greater than ``0``, the storage
+    is wrapped by a :class:`djangoflash.storage.cached.CachedFlashStorage`.
     """
     if module in STORAGES:
         mod = __import__('djangoflash.storage.%s' % STORAGES[module], \
             {}, {}, [''])
     else:
         mod = __import__(module, {}, {}, [''])
-    return getattr(mod, 'FlashStorageClass')()
+    storage = getattr(mod, 'FlashStorageClass')()
+    if getattr(settings, 'FLASH_L1_CACHE_SIZE', 0) > 0:
+        from djangoflash.storage.cached import CachedFlashStorage
+        storage = CachedFlashStorage(storage)
+    return storage
 
 # Get the flash storage specified in the project's settings. Use the session
 # storage by default (for both security and backward compatibility reasons).
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""This module provides a wrapper that keeps the flashes written by the
+current process in memory, in front of any flash storage backend, so the next
+request of the same client doesn't have to retrieve them from the storage
+when it's handled by the same process (e.g. with sticky load balancing).
+
+Each time a flash is written, a new random version stamp is sent to the user
+in a cookie, and the flash is cached under it. A cached flash is only used by
+requests that carry its version stamp, so a flash written by another process
+(which sends another version stamp) is always retrieved from the storage.
+Flashes stored in the user's session are also cached under the session key,
+so they don't outlive the session (e.g. when the user logs out).
+
+To use this wrapper, add the following settings to your project's
+``settings.py`` file::
+
+    FLASH_L1_CACHE_SIZE = 1000 # Number of cached flashes, per process
+    FLASH_L1_CACHE_TTL = 60    # Optional, in seconds
+
+.. warning::
+   Changes made to a cached flash by concurrent requests are not merged (see
+   :meth:`djangoflash.models.FlashScope.merged`); the last write wins.
+"""
+
+import base64
+import os
+import re
+import time
+
+from django.conf import settings
+
+from djangoflash.storage import get_bucket, session
+from djangoflash.utils import LRUCache
+
+
+# Name of the cookie that holds the version stamp of the client's flash, and
+# format of the version stamps
+VERSION_COOKIE = '_djflash_version'
+_VERSION_RE = re.compile(r'^[A-Za-z0-9_-]{16}$')
+
+
+class CachedFlashStorage(object):
+    """Wrapper that caches the flashes written to the given storage. Other
+    attributes (e.g. ``purge``) are looked up in the wrapped storage.
+    """
+
+    def __init__(self, storage, max_size=None, ttl=None):
+        """Returns a new wrapper around the given *storage*, which caches at
+        most *max_size* flashes for *ttl* seconds. Arguments not given are
+        read from the project's settings.
+        """
+        self.storage = storage
+        if max_size is None:
+            max_size = getattr(settings, 'FLASH_L1_CACHE_SIZE', 1000)
+        self.ttl = ttl or getattr(settings, 'FLASH_L1_CACHE_TTL', 60)
+        self.l1 = LRUCache(max_size)
+
+    def __getattr__(self, name):
+        """Looks up the attributes this wrapper doesn't have in the wrapped
+        storage.
+        """
+        return getattr(self.storage, name)
+
+    def _get_cache_key(self, request, version):
+        """Returns the key of the flash of the given version used by the given
+        request.
+        """
+        session_key = ''
+        if isinstance(self.storage, session.FlashStorageClass):
+            session_key = getattr(getattr(request, 'session', None),
+                                  'session_key', None) or ''
+        return '%s:%s:%s' % (session_key, get_bucket(request) or '', version)
+
+    def set(self, flash, request, response):
+        """Stores the given :class:`FlashScope` object in the wrapped storage
+        and caches the flash actually stored under a new version stamp.
+        Returns the stored flash.
+        """
+        stored = self.storage.set(flash, request, response)
+        if stored is not None:
+            flash = stored
+        version = request.COOKIES.get(VERSION_COOKIE)
+        if version:
+            self.l1.delete(self._get_cache_key(request, version))
+        if flash:
+            version = base64.urlsafe_b64encode(os.urandom(12))
+            self.l1.set(self._get_cache_key(request, version),
+                        (time.time() + self.ttl, flash.copy()))
+            response.set_cookie(VERSION_COOKIE, version)
+        elif version:
+            response.delete_cookie(VERSION_COOKIE)
+        return flash
+
+    def get(self, request):
+        """Returns a copy of the cached :class:`FlashScope` object whose
+        version stamp was sent by the user, or retrieves the flash from the
+        wrapped storage if it's not cached.
+        """
+        version = request.COOKIES.get(VERSION_COOKIE)
+        if version and _VERSION_RE.match(version):
+            key = self._get_cache_key(request, version)
+            entry = self.l1.get(key)
+            if entry is not None:
+                if entry[0] > time.time():
+                    return entry[1].copy()
+                self.l1.delete(key)
+        return self.storage.get(request)
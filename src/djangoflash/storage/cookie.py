@@ -16,29 +16,123 @@
    storage backend.
 """
 
+import logging
+import time
+
+from django.conf import settings
+from django.utils.hashcompat import md5_constructor
+
 from djangoflash.codec import codec
+from djangoflash.storage import get_bucket
+from djangoflash.utils import LRUCache
+
+
+logger = logging.getLogger('djangoflash.storage.cookie')
 
 
 class FlashStorageClass(object):
     """Cookie-based flash storage backend.
+
+    Since a page load usually triggers several requests carrying the same
+    cookie, flashes are cached after being verified and decoded, keyed by the
+    cookie contents. The number of cached flashes can be changed through the
+    ``FLASH_COOKIE_CACHE_SIZE`` setting (``0`` disables the cache), and the
+    cache stats are available through ``storage.cache.stats()``.
+
+    Malformed or tampered cookies are ignored (the request gets an empty
+    flash) and removed from the client. Since clients tend to send the same
+    bad cookie over and over again, the digests of the rejected cookies are
+    cached too, and rejections are logged at most once per minute.
     """
 
     def __init__(self):
         """Returns a new cookie-based flash storage backend.
         """
         self._key = '_djflash_cookie'
+        self.cache = LRUCache(getattr(settings, 'FLASH_COOKIE_CACHE_SIZE', 100))
+        self.rejected = LRUCache(
+            getattr(settings, 'FLASH_COOKIE_REJECTED_CACHE_SIZE', 100))
+        self.rejection_log = _RejectionLog()
+
+    def _get_key(self, request):
+        """Returns the name of the cookie that holds the flash used by the
+        given request.
+        """
+        bucket = get_bucket(request)
+        if bucket is None:
+            return self._key
+        return '%s_%s' % (self._key, bucket)
 
     def set(self, flash, request, response):
-        """Stores the given :class:`FlashScope` object in a cookie.
+        """Stores the given :class:`FlashScope` object in a cookie. The
+        cookie expires along with the flash, if all of its values expire.
+        Returns the stored flash.
         """
+        key = self._get_key(request)
         if flash:
-            response.set_cookie(self._key, codec.encode_and_sign(flash))
-        elif self._key in request.COOKIES:
-            response.delete_cookie(self._key)
+            max_age, deadline = None, flash.expires_at()
+            if deadline is not None:
+                max_age = max(int(deadline - time.time()), 0)
+            response.set_cookie(key, codec.encode_and_sign(flash),
+                                max_age=max_age)
+        elif key in request.COOKIES:
+            response.delete_cookie(key)
+        return flash
 
     def get(self, request):
-        """Returns :class:`FlashScope` object stored in a cookie.
+        """Returns :class:`FlashScope` object stored in a cookie, or ``None``
+        if there's no such cookie or if it's not valid.
         """
-        data = request.COOKIES.get(self._key)
+        data = request.COOKIES.get(self._get_key(request))
         if data:
-            return codec.decode_signed(data)
+            snapshot = self.cache.get(data)
+            if snapshot is None:
+                snapshot = self._unsign(data)
+                if snapshot is None:
+                    return None
+                self.cache.set(data, snapshot)
+            return snapshot.copy()
+
+    def _unsign(self, data):
+        """Restores the flash from the given cookie contents. Returns ``None``
+        if the cookie is not valid.
+        """
+        if not codec.is_well_formed(data):
+            self.rejection_log.add()
+            return None
+        if codec.is_signed_expired(data):
+            return None
+
+        digest = md5_constructor(data).hexdigest()
+        if self.rejected.get(digest):
+            self.rejection_log.add()
+            return None
+
+        flash = codec.unsign(data)
+        if flash is None:
+            self.rejected.set(digest, True)
+            self.rejection_log.add()
+        return flash
+
+
+class _RejectionLog(object):
+    """Counts the rejected cookies, logging how many were rejected at most
+    once every *interval* seconds.
+    """
+
+    def __init__(self, interval=60):
+        """Returns a new log of rejected cookies.
+        """
+        self.interval = interval
+        self.count = 0
+        self.last_logged = None
+
+    def add(self):
+        """Counts a rejected cookie, logging the rejected cookies if the last
+        message was logged more than :attr:`interval` seconds ago.
+        """
+        self.count += 1
+        now = time.time()
+        if self.last_logged is None or now - self.last_logged >= self.interval:
+            count, self.count, self.last_logged = self.count, 0, now
+            logger.warning('Rejected %d invalid flash cookie(s)', count)
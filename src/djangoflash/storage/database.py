@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+"""This module provides a database-based flash storage backend, which keeps
+the *flash* contents in a dedicated table (see
+:class:`djangoflash.storage.db.models.StoredFlash`) rather than in the user's
+session.
+Only an opaque client id is sent to the user in a cookie.
+
+Each request that uses the *flash* reads or writes a single narrow row, with
+a single statement: flashes are stored with an *upsert* on SQLite, PostgreSQL
+(9.5 or later) and MySQL, and with an update followed by an insert, if needed,
+on other databases.
+
+Expired rows are ignored, but never removed by this backend. Run the
+``flash_purge`` management command periodically (e.g. from a cron job) to
+remove them in small batches::
+
+    $ python manage.py flash_purge --batch-size=1000
+
+To use this backend, add ``'djangoflash.storage.db'`` to the
+``INSTALLED_APPS`` section of your project's ``settings.py`` file, create the
+table (``manage.py syncdb``) and add the following setting::
+
+    FLASH_STORAGE = 'database'
+"""
+
+import time
+from base64 import b64encode, b64decode
+from datetime import datetime, timedelta
+
+from django.db import connection, transaction, IntegrityError
+from django.db.models import F
+
+from djangoflash.storage.db.models import StoredFlash
+from djangoflash.storage.keyvalue import KeyValueFlashStorage
+
+
+# Single-statement upserts, by database backend. The version of existing
+# rows is incremented
+_UPSERTS = {
+    'sqlite3': 'INSERT OR REPLACE INTO %(table)s (%(client_id)s, %(data)s, '
+               '%(expires_at)s, %(version)s) VALUES (%%s, %%s, %%s, '
+               'COALESCE((SELECT %(version)s FROM %(table)s WHERE '
+               '%(client_id)s = %%s), 0) + 1)',
+    'postgresql_psycopg2': 'INSERT INTO %(table)s (%(client_id)s, %(data)s, '
+               '%(expires_at)s, %(version)s) VALUES (%%s, %%s, %%s, 1) ON '
+               'CONFLICT (%(client_id)s) DO UPDATE SET '
+               '%(data)s = EXCLUDED.%(data)s, '
+               '%(expires_at)s = EXCLUDED.%(expires_at)s, '
+               '%(version)s = %(table)s.%(version)s + 1',
+    'mysql': 'INSERT INTO %(table)s (%(client_id)s, %(data)s, %(expires_at)s, '
+             '%(version)s) VALUES (%%s, %%s, %%s, 1) ON DUPLICATE KEY UPDATE '
+             '%(data)s = VALUES(%(data)s), '
+             '%(expires_at)s = VALUES(%(expires_at)s), '
+             '%(version)s = %(version)s + 1',
+}
+_UPSERTS['postgresql'] = _UPSERTS['postgresql_psycopg2']
+
+
+def _get_upsert():
+    """Returns the upsert statement supported by the database in use, or
+    ``None`` if it doesn't support upserts.
+    """
+    engine = connection.settings_dict['ENGINE'].split('.')[-1]
+    if engine not in _UPSERTS:
+        return None
+    quote = connection.ops.quote_name
+    return _UPSERTS[engine] % {
+        'table': quote(StoredFlash._meta.db_table),
+        'client_id': quote('client_id'),
+        'data': quote('data'),
+        'expires_at': quote('expires_at'),
+        'version': quote('version'),
+    }
+
+
+class FlashStorageClass(KeyValueFlashStorage):
+    """Database-based flash storage backend.
+    """
+
+    def load(self, client_id):
+        """Returns the data stored under the given *client_id*, or ``None`` if
+        there's no such data or if it has expired.
+        """
+        rows = StoredFlash.objects.filter(client_id=client_id,
+            expires_at__gt=datetime.now()).values_list('data', flat=True)[:1]
+        for data in rows:
+            return b64decode(data)
+        return None
+
+    def save(self, client_id, data, ttl):
+        """Stores the given *data* under the given *client_id* for *ttl*
+        seconds.
+        """
+        data = b64encode(data)
+        expires_at = datetime.now() + timedelta(seconds=ttl)
+        upsert = _get_upsert()
+        if upsert is None:
+            updated = StoredFlash.objects.filter(client_id=client_id).update(
+                data=data, expires_at=expires_at, version=F('version') + 1)
+            if not updated:
+                StoredFlash.objects.create(client_id=client_id, data=data,
+                                           expires_at=expires_at)
+            return
+
+        cursor = connection.cursor()
+        cursor.execute(upsert, self._get_upsert_params(upsert, client_id, data,
+                                                       expires_at))
+        transaction.commit_unless_managed()
+
+    def _get_upsert_params(self, upsert, client_id, data, expires_at):
+        """Returns the parameters of the given upsert statement.
+        """
+        params = [client_id, data,
+                  connection.ops.value_to_db_datetime(expires_at)]
+        # The SQLite statement reads the current version in a sub-query
+        if upsert.count('%s') > len(params):
+            params.append(client_id)
+        return params
+
+    def save_many(self, items):
+        """Stores several flashes, given as ``(client_id, data, ttl)`` tuples,
+        with a single (upsert) statement executed in a single transaction,
+        if the database supports upserts.
+        """
+        upsert = _get_upsert()
+        if upsert is None:
+            KeyValueFlashStorage.save_many(self, items)
+            return
+
+        now = datetime.now()
+        cursor = connection.cursor()
+        cursor.executemany(upsert, [self._get_upsert_params(upsert, client_id,
+            b64encode(data), now + timedelta(seconds=ttl))
+            for client_id, data, ttl in items])
+        transaction.commit_unless_managed()
+
+    def load_versioned(self, client_id):
+        """Returns a ``(data, version)`` tuple holding the data stored under
+        the given *client_id* and the version of its row, or ``(None, None)``
+        if there's no such data or if it has expired.
+        """
+        rows = StoredFlash.objects.filter(client_id=client_id,
+            expires_at__gt=datetime.now()).values_list('data', 'version')[:1]
+        for data, version in rows:
+            return b64decode(data), version
+        return None, None
+
+    def cas(self, client_id, data, ttl, version):
+        """Stores the given *data* under the given *client_id* for *ttl*
+        seconds (or removes the stored data, if *data* is ``None``), but only
+        if the version of the stored data is still *version*. Returns
+        ``True`` on success, ``False`` otherwise.
+        """
+        now = datetime.now()
+        if version is None:
+            # Expired rows are treated as missing ones
+            rows = StoredFlash.objects.filter(client_id=client_id,
+                                              expires_at__lte=now)
+        else:
+            rows = StoredFlash.objects.filter(client_id=client_id,
+                                              version=version)
+
+        if data is None:
+            if version is None:
+                rows.delete()
+                transaction.commit_unless_managed()
+                return not StoredFlash.objects.filter(
+                    client_id=client_id).exists()
+            cursor = connection.cursor()
+            cursor.execute('DELETE FROM %s WHERE %s = %%s AND %s = %%s' % (
+                connection.ops.quote_name(StoredFlash._meta.db_table),
+                connection.ops.quote_name('client_id'),
+                connection.ops.quote_name('version')), [client_id, version])
+            transaction.commit_unless_managed()
+            return cursor.rowcount == 1
+
+        data = b64encode(data)
+        expires_at = now + timedelta(seconds=ttl)
+        updated = rows.update(data=data, expires_at=expires_at,
+                              version=F('version') + 1)
+        transaction.commit_unless_managed()
+        if updated or version is not None:
+            return bool(updated)
+
+        # There's no row at all, unless another request just inserted it
+        savepoint = transaction.savepoint()
+        try:
+            StoredFlash.objects.create(client_id=client_id, data=data,
+                                       expires_at=expires_at)
+        except IntegrityError:
+            transaction.savepoint_rollback(savepoint)
+            return False
+        transaction.savepoint_commit(savepoint)
+        transaction.commit_unless_managed()
+        return True
+
+    def delete(self, client_id):
+        """Removes the data stored under the given *client_id*, if any.
+        """
+        StoredFlash.objects.filter(client_id=client_id).delete()
+        transaction.commit_unless_managed()
+
+    def delete_many(self, client_ids):
+        """Removes the data stored under the given *client_ids*, if any, with
+        a single statement.
+        """
+        StoredFlash.objects.filter(client_id__in=client_ids).delete()
+        transaction.commit_unless_managed()
+
+    def _delete_expired(self, client_ids, now):
+        """Removes the rows stored under the given *client_ids* that expired at
+        *now*, with a single statement. Rows updated in the meantime are not
+        removed. Returns the number of rows removed.
+        """
+        quote = connection.ops.quote_name
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM %s WHERE %s IN (%s) AND %s <= %%s' % (
+            quote(StoredFlash._meta.db_table), quote('client_id'),
+            ', '.join(['%s'] * len(client_ids)), quote('expires_at')),
+            list(client_ids) + [connection.ops.value_to_db_datetime(now)])
+        transaction.commit_unless_managed()
+        return cursor.rowcount
+
+    def purge(self, batch_size=1000, pause=0):
+        """Removes the expired flashes, at most *batch_size* rows at a time,
+        sleeping for *pause* seconds between batches. Returns the number of
+        rows removed.
+        """
+        removed = 0
+        while True:
+            now = datetime.now()
+            expired = StoredFlash.objects.filter(expires_at__lte=now)
+            client_ids = list(expired.values_list('client_id',
+                                                  flat=True)[:batch_size])
+            if not client_ids:
+                break
+            removed += self._delete_expired(client_ids, now)
+            if len(client_ids) < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+        return removed
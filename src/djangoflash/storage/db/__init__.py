@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+"""Django application that provides the table used by the database-based
+flash storage (see :mod:`djangoflash.storage.database`). Only projects that
+use this storage need to add it to their ``INSTALLED_APPS``.
+"""
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+"""This module provides the :class:`StoredFlash` model, used by the
+database-based flash storage.
+"""
+
+from django.db import models
+
+
+class StoredFlash(models.Model):
+    """Encoded *flash* of a client, used by the
+    :mod:`djangoflash.storage.database` storage. Rows are kept as narrow as
+    possible, since they're read and written on every request that uses the
+    *flash*. The version is incremented whenever the row is written.
+    """
+    client_id = models.CharField(max_length=32, primary_key=True)
+    data = models.TextField()
+    expires_at = models.DateTimeField(db_index=True)
+    version = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        db_table = 'djangoflash_storedflash'
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+"""This module provides a file-based flash storage backend, which keeps the
+*flash* contents in files on a local (or shared) disk. Only an opaque client
+id is sent to the user in a cookie.
+
+Files are spread over two levels of sub-directories, named after the first
+characters of the client id, so no directory gets too large. Each file is
+written to a temporary file which is then renamed, so readers never see
+partially written files. The expiration time of each file is stored as its
+modification time, so expired files can be found without being read. Files
+are renamed and removed holding a lock on their directory, so a file that is
+being replaced is never removed as expired.
+
+Expired files are ignored, but never removed by this backend. Run the
+``flash_purge`` management command periodically (e.g. from a cron job) to
+remove them.
+
+To use this backend, add the following settings to your project's
+``settings.py`` file::
+
+    FLASH_STORAGE = 'file'
+    FLASH_FILE_PATH = '/var/tmp/myproject-flash' # Optional
+"""
+
+import errno
+import fcntl
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.utils.hashcompat import md5_constructor
+
+from djangoflash.storage.keyvalue import KeyValueFlashStorage
+
+
+# Prefix of the temporary files
+_TEMP_PREFIX = '.tmp-'
+
+# Name of the files used to lock each directory
+_LOCK_NAME = '.lock'
+
+# Age (in seconds) after which a temporary file is considered abandoned. Since
+# the modification time of temporary files is their expiration time, their
+# age is told by their change time
+_TEMP_MAX_AGE = 60
+
+
+def _default_path():
+    """Returns the default directory where flashes are stored.
+    """
+    return os.path.join(tempfile.gettempdir(), 'djangoflash-%d' % os.getuid())
+
+def _make_directory(directory):
+    """Creates the given directory (and its parents), if needed.
+    """
+    try:
+        os.makedirs(directory, 0700)
+    except OSError, e:
+        # Another process might have created it in the meantime
+        if e.errno != errno.EEXIST:
+            raise
+
+def _lock_directory(directory):
+    """Locks the given directory, creating it if needed. Returns the file
+    descriptor of the lock, which is released when it's closed.
+    """
+    _make_directory(directory)
+    lock = os.open(os.path.join(directory, _LOCK_NAME),
+                   os.O_RDWR | os.O_CREAT, 0600)
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+    except:
+        os.close(lock)
+        raise
+    return lock
+
+
+class FlashStorageClass(KeyValueFlashStorage):
+    """File-based flash storage backend.
+    """
+
+    def __init__(self, path=None):
+        """Returns a new file-based flash storage backend. The *path* of the
+        directory where flashes are stored is read from the project's
+        settings if not given.
+        """
+        KeyValueFlashStorage.__init__(self)
+        self.path = path or getattr(settings, 'FLASH_FILE_PATH', None) or \
+            _default_path()
+
+    def _get_directory(self, client_id):
+        """Returns the directory of the file of the given client.
+        """
+        return os.path.join(self.path, client_id[:2], client_id[2:4])
+
+    def load(self, client_id):
+        """Returns the data stored under the given *client_id*, or ``None`` if
+        there's no such data or if it has expired.
+        """
+        try:
+            fd = os.open(os.path.join(self._get_directory(client_id),
+                                      client_id), os.O_RDONLY)
+        except OSError:
+            return None
+        try:
+            stat = os.fstat(fd)
+            if stat.st_mtime <= time.time():
+                return None
+            return os.read(fd, stat.st_size)
+        finally:
+            os.close(fd)
+
+    def save(self, client_id, data, ttl):
+        """Stores the given *data* under the given *client_id* for *ttl*
+        seconds.
+
+        The directory of the client's file is locked meanwhile.
+        """
+        lock = _lock_directory(self._get_directory(client_id))
+        try:
+            self._store(client_id, data, ttl)
+        finally:
+            # Closing the file releases the lock
+            os.close(lock)
+
+    def _store(self, client_id, data, ttl):
+        """Stores the given *data* under the given *client_id* for *ttl*
+        seconds. The directory of the client's file must be locked.
+        """
+        directory = self._get_directory(client_id)
+        fd, temp_path = tempfile.mkstemp(prefix=_TEMP_PREFIX, dir=directory)
+        try:
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            expires = time.time() + ttl
+            os.utime(temp_path, (expires, expires))
+            os.rename(temp_path, os.path.join(directory, client_id))
+        except:
+            os.remove(temp_path)
+            raise
+
+    def delete(self, client_id):
+        """Removes the data stored under the given *client_id*, if any.
+        """
+        try:
+            os.remove(os.path.join(self._get_directory(client_id), client_id))
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def cas(self, client_id, data, ttl, version):
+        """Stores the given *data* under the given *client_id* for *ttl*
+        seconds (or removes the stored data, if *data* is ``None``), but only
+        if the version of the stored data is still *version*. Returns
+        ``True`` on success, ``False`` otherwise.
+
+        The directory of the client's file is locked meanwhile.
+        """
+        lock = _lock_directory(self._get_directory(client_id))
+        try:
+            current = self.load(client_id)
+            if current is not None:
+                current = md5_constructor(current).hexdigest()
+            if current != version:
+                return False
+            if data is None:
+                self.delete(client_id)
+            else:
+                self._store(client_id, data, ttl)
+            return True
+        finally:
+            # Closing the file releases the lock
+            os.close(lock)
+
+    def purge(self, batch_size=1000, pause=0):
+        """Removes the expired flashes (and abandoned temporary files),
+        sleeping for *pause* seconds after every *batch_size* files removed.
+        Returns the number of flashes removed.
+
+        Expired flashes are checked again, and removed, holding the lock of
+        their directory, so flashes written meanwhile are kept.
+        """
+        removed = 0
+        now = time.time()
+        for directory, subdirectories, files in os.walk(self.path):
+            expired = []
+            for name in files:
+                if name == _LOCK_NAME:
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.startswith(_TEMP_PREFIX):
+                    if stat.st_ctime < now - _TEMP_MAX_AGE:
+                        self._remove(path)
+                elif stat.st_mtime <= now:
+                    expired.append(path)
+            if not expired:
+                continue
+
+            lock = _lock_directory(directory)
+            try:
+                count = sum(1 for expired_path in expired
+                            if self._remove(expired_path, time.time()))
+            finally:
+                os.close(lock)
+            if pause and removed / batch_size < (removed + count) / batch_size:
+                time.sleep(pause)
+                now = time.time()
+            removed += count
+        return removed
+
+    def _remove(self, path, expired_at=None):
+        """Removes the given file, if it's expired at *expired_at* (when
+        given). Returns ``False`` if it was already removed or not expired.
+        """
+        try:
+            if expired_at is not None and \
+                    os.stat(path).st_mtime > expired_at:
+                return False
+            os.remove(path)
+            return True
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+"""This module provides a base class for flash storage backends that keep the
+*flash* contents on the server side, in some kind of key/value store, and just
+send an opaque client id to the user in a cookie.
+
+Flashes are stored for ``FLASH_STORAGE_TTL`` seconds, or until all of their
+values expire (see :meth:`djangoflash.models.FlashScope.expires_at`),
+whichever comes first.
+
+Subclasses only need to implement three primitives: :meth:`load`,
+:meth:`save` and :meth:`delete`. The flash is encoded by the codec specified
+in the project's settings (see :ref:`configuration`), without being signed,
+since it never leaves the server.
+
+Subclasses may also implement a ``cas(client_id, data, ttl, version)``
+method, which atomically replaces (or removes, if *data* is ``None``) the
+data stored under *client_id*, but only if its version is still *version*
+(``None`` meaning that there's no data). Such storages never lose the changes
+made by concurrent requests: when a flash was changed by another request
+since it was loaded, both flashes are merged (see
+:meth:`djangoflash.models.FlashScope.merged`) and the write is retried. The
+client id cookie of such storages is only removed by a request that found
+nothing stored, so a request that empties the flash never drops the values
+that an overlapping request adds to it.
+
+Writes may also be queued and made by a background thread, in batches (see
+:mod:`djangoflash.storage.writebehind`). Subclasses that can write several
+flashes at once should override :meth:`save_many` and :meth:`delete_many`.
+"""
+
+import os
+import re
+import time
+
+from django.conf import settings
+from django.utils.hashcompat import md5_constructor
+
+from djangoflash.codec import codec
+from djangoflash.models import FlashScope
+from djangoflash.storage import get_bucket
+from djangoflash.storage.writebehind import WriteBehindQueue
+
+
+# Format of the client ids generated by this backend
+_CLIENT_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+# Name of the request attribute that holds the key, the data and the version
+# of the flash loaded from the storage
+_LOADED_ATTR = '_djflash_loaded'
+
+# Number of attempts to write a flash before giving up on merging it
+_CAS_ATTEMPTS = 3
+
+
+def new_client_id():
+    """Returns a new random client id.
+    """
+    return os.urandom(16).encode('hex')
+
+
+class KeyValueFlashStorage(object):
+    """Base class for server-side flash storage backends.
+    """
+
+    def __init__(self):
+        """Returns a new server-side flash storage backend. Stored flashes
+        expire after ``FLASH_STORAGE_TTL`` seconds (one hour by default).
+        Writes are queued if the ``FLASH_WRITE_BEHIND`` setting is ``True``.
+        """
+        self._key = '_djflash_id'
+        self.ttl = getattr(settings, 'FLASH_STORAGE_TTL', 3600)
+        self.buckets = getattr(settings, 'FLASH_BUCKETS', False)
+        self.queue = None
+        if getattr(settings, 'FLASH_WRITE_BEHIND', False):
+            self.queue = WriteBehindQueue(self,
+                getattr(settings, 'FLASH_WRITE_BEHIND_INTERVAL', 0.05),
+                getattr(settings, 'FLASH_WRITE_BEHIND_BATCH_SIZE', 100),
+                getattr(settings, 'FLASH_WRITE_BEHIND_MAX_SIZE', 10000))
+
+    def _get_client_id(self, request):
+        """Returns the client id sent by the user, or ``None`` if there's no
+        (valid) client id.
+        """
+        client_id = request.COOKIES.get(self._key)
+        if client_id and _CLIENT_ID_RE.match(client_id):
+            return str(client_id)
+        return None
+
+    def _get_flash_key(self, client_id, request):
+        """Returns the key of the flash used by the given request. Flashes of
+        buckets other than the main one (see
+        :func:`djangoflash.storage.get_bucket`) get keys derived from the
+        client id.
+        """
+        bucket = get_bucket(request)
+        if bucket is None:
+            return client_id
+        return md5_constructor('%s:%s' % (client_id, bucket)).hexdigest()
+
+    def _get_ttl(self, flash):
+        """Returns the number of seconds the given flash should be stored.
+        """
+        deadline = flash.expires_at()
+        if deadline is None:
+            return self.ttl
+        return min(self.ttl, deadline - time.time())
+
+    def set(self, flash, request, response):
+        """Stores the given :class:`FlashScope` object under the client id
+        sent by the user, generating a new one if needed. Returns the flash
+        that was actually stored, which holds the changes made by concurrent
+        requests, if any.
+        """
+        client_id = self._get_client_id(request)
+        if client_id is None:
+            if flash:
+                client_id = new_client_id()
+                response.set_cookie(self._key, client_id)
+                self._write(self._get_flash_key(client_id, request), flash)
+            return flash
+
+        key = self._get_flash_key(client_id, request)
+        loaded = getattr(request, _LOADED_ATTR, None)
+        consumed = False
+        # Flashes can only be merged if it's known what they were derived from
+        if hasattr(self, 'cas') and loaded is not None and loaded[0] == key:
+            flash = self._merge_and_store(key, flash, loaded[1:])
+            # A concurrent request might still add values to the flash this
+            # request emptied, which would be lost without the client id
+            consumed = loaded[1] is not None
+        else:
+            self._write(key, flash)
+        # When buckets are used, the client id is needed by the other buckets
+        if not flash and not consumed and not self.buckets:
+            response.delete_cookie(self._key)
+        return flash
+
+    def _merge_and_store(self, key, flash, loaded):
+        """Stores the given flash (or removes the stored one, if the given
+        flash is empty) unless it was changed by another request since it was
+        loaded, in which case both flashes are merged. Returns the flash that
+        was actually stored.
+        """
+        data, version = loaded
+        base = None
+        for attempt in range(_CAS_ATTEMPTS):
+            packed = None
+            if flash:
+                packed = codec.pack(flash)
+            if self.cas(key, packed, self._get_ttl(flash), version):
+                return flash
+            if base is None:
+                base = self._unpack(data)
+            data, version = self.load_versioned(key)
+            other = self._unpack(data)
+            flash, base = flash.merged(base, other), other
+
+        # Too many concurrent changes: the last writer wins
+        self._write(key, flash)
+        return flash
+
+    def _write(self, key, flash):
+        """Stores the given flash under the given key, or removes the stored
+        one if the given flash is empty. The write is queued, if possible.
+        """
+        if self.queue is not None:
+            packed = None
+            if flash:
+                packed = codec.pack(flash)
+            self.queue.put(key, packed, self._get_ttl(flash))
+        elif flash:
+            self.save(key, codec.pack(flash), self._get_ttl(flash))
+        else:
+            self.delete(key)
+
+    def _unpack(self, data):
+        """Restores the flash from the given data, returning an empty flash if
+        there's no data or if it can't be decoded.
+        """
+        if data is not None:
+            try:
+                flash = codec.unpack(data)
+                if flash is not None:
+                    return flash
+            except Exception:
+                pass
+        return FlashScope()
+
+    def get(self, request):
+        """Returns the :class:`FlashScope` object stored under the client id
+        sent by the user, or ``None`` if there's no such object.
+        """
+        client_id = self._get_client_id(request)
+        if client_id is None:
+            return None
+        key = self._get_flash_key(client_id, request)
+        if self.queue is not None:
+            # Writes are queued rather than compared, so there's no version
+            queued, data = self.queue.lookup(key)
+            if not queued:
+                data = self.load(key)
+        elif hasattr(self, 'cas'):
+            data, version = self.load_versioned(key)
+            setattr(request, _LOADED_ATTR, (key, data, version))
+        else:
+            data = self.load(key)
+        if data is None:
+            return None
+        try:
+            return codec.unpack(data)
+        except Exception:
+            # Errors might happen when decoding. Return None if that's the case
+            return None
+
+    def load(self, client_id):
+        """Returns the data stored under the given *client_id*, or ``None`` if
+        there's no such data or if it has expired. Empty implementation that
+        raises :class:`NotImplementedError`.
+        """
+        raise NotImplementedError
+
+    def load_versioned(self, client_id):
+        """Returns a ``(data, version)`` tuple holding the data stored under
+        the given *client_id* and its version, or ``(None, None)`` if there's
+        no such data. The version is the MD5 digest of the data, unless this
+        method is overridden.
+        """
+        data = self.load(client_id)
+        if data is None:
+            return None, None
+        return data, md5_constructor(data).hexdigest()
+
+    def save(self, client_id, data, ttl):
+        """Stores the given *data* under the given *client_id* for *ttl*
+        seconds. Empty implementation that raises
+        :class:`NotImplementedError`.
+        """
+        raise NotImplementedError
+
+    def delete(self, client_id):
+        """Removes the data stored under the given *client_id*, if any. Empty
+        implementation that raises :class:`NotImplementedError`.
+        """
+        raise NotImplementedError
+
+    def save_many(self, items):
+        """Stores several flashes, given as ``(client_id, data, ttl)`` tuples.
+        Calls :meth:`save` for each one, unless this method is overridden.
+        """
+        for client_id, data, ttl in items:
+            self.save(client_id, data, ttl)
+
+    def delete_many(self, client_ids):
+        """Removes the data stored under the given *client_ids*, if any.
+        Calls :meth:`delete` for each one, unless this method is overridden.
+        """
+        for client_id in client_ids:
+            self.delete(client_id)
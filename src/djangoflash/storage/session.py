@@ -15,6 +15,13 @@ project's ``settings.py`` file::
   :ref:`configuration`
 """
 
+import time
+
+from django.conf import settings
+
+from djangoflash.storage import get_bucket
+
+
 class FlashStorageClass(object):
     """Session-based flash storage backend.
     """
@@ -22,18 +29,61 @@ class FlashStorageClass(object):
         """Returns a new session-based flash storage backend.
         """
         self._key = '_djflash_session'
+        # Session keys of the buckets, when the FLASH_BUCKETS setting is on
+        self._buckets_key = '_djflash_buckets'
+        self.buckets = getattr(settings, 'FLASH_BUCKETS', False)
+
+    def _get_key(self, request):
+        """Returns the session key of the flash used by the given request.
+        """
+        bucket = get_bucket(request)
+        if bucket is None:
+            return self._key
+        return '%s:%s' % (self._key, bucket)
 
     def set(self, flash, request, response):
         """Stores the given :class:`FlashScope` object in the session.
+        Returns the stored flash.
         """
         if hasattr(request, 'session'):
+            key = self._get_key(request)
             if flash:
-                request.session[self._key] = flash
-            elif self._key in request.session:
-                del request.session[self._key]
+                request.session[key] = flash
+            elif key in request.session:
+                del request.session[key]
+            if self.buckets:
+                self._remove_expired_buckets(request.session, key)
+        return flash
+
+    def _remove_expired_buckets(self, session, current):
+        """Removes the flashes of the buckets other than the *current* one
+        that are empty or have expired, so buckets whose redirect is never
+        followed don't stay in the session forever. Only the keys of the
+        buckets stored so far are checked.
+        """
+        now = time.time()
+        tracked = session.get(self._buckets_key, [])
+        keys = []
+        for key in tracked:
+            if key != current and key in session:
+                deadline = session[key].expires_at()
+                if not session[key] or (deadline is not None and \
+                        deadline <= now):
+                    del session[key]
+            if key in session:
+                keys.append(key)
+        if current != self._key and current in session and \
+                current not in keys:
+            keys.append(current)
+        if keys != tracked:
+            if keys:
+                session[self._buckets_key] = keys
+            else:
+                del session[self._buckets_key]
 
     def get(self, request):
         """Returns :class:`FlashScope` object stored in the session.
         """
-        if hasattr(request, 'session') and self._key in request.session:
-            return request.session[self._key]
+        key = self._get_key(request)
+        if hasattr(request, 'session') and key in request.session:
+            return request.session[key]
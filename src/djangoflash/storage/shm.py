@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+"""This module provides a flash storage backend that keeps the *flash*
+contents in a memory-mapped file shared by all processes running on the same
+host, which makes it a good fit for single-host deployments with several
+worker processes. Only an opaque client id is sent to the user in a cookie.
+
+The file is organized as a fixed-size hash table. Each slot holds the flash
+of one client, which expires after ``FLASH_STORAGE_TTL`` seconds. Writers
+lock the slot they're changing (using :func:`fcntl.lockf`), while readers
+rely on a sequence counter to detect concurrent changes without locking.
+
+To use this backend, add the following settings to your project's
+``settings.py`` file::
+
+    FLASH_STORAGE = 'shm'
+    FLASH_SHM_PATH = '/dev/shm/myproject-flash' # Optional
+    FLASH_SHM_SLOTS = 4096                      # Optional
+    FLASH_SHM_SLOT_SIZE = 4096                  # Optional
+
+.. warning::
+   All processes sharing the same file must use the same settings. The
+   encoded flash can't be larger than ``FLASH_SHM_SLOT_SIZE`` minus 32 bytes
+   (larger flashes are logged and dropped), and the flashes of clients whose
+   ids collide are evicted when the table is full, so choose the number of
+   slots wisely.
+
+.. note::
+   This backend requires an operating system that supports :mod:`fcntl` and
+   :mod:`mmap`, such as Linux.
+"""
+
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.hashcompat import md5_constructor
+
+from djangoflash.storage.keyvalue import KeyValueFlashStorage
+
+
+# File header: magic, format version, number of slots and slot size
+_HEADER = struct.Struct('<4sIII')
+_HEADER_SIZE = 64
+_MAGIC = 'DJFL'
+_VERSION = 1
+
+# Slot header: sequence counter, expiration time, data length and client id
+_SLOT = struct.Struct('<IdI16s')
+_SEQUENCE = struct.Struct('<I')
+
+# Number of consecutive slots where the flash of a client may be stored
+_PROBES = 8
+
+# Number of lock-free read attempts before locking the slot
+_READ_ATTEMPTS = 4
+
+# Client id of empty slots
+_EMPTY = '\0' * 16
+
+logger = logging.getLogger('djangoflash.storage.shm')
+
+
+def _default_path():
+    """Returns the default path of the shared file.
+    """
+    directory = '/dev/shm'
+    if not os.path.isdir(directory):
+        directory = tempfile.gettempdir()
+    return os.path.join(directory, 'djangoflash-%d' % os.getuid())
+
+
+class FlashStorageClass(KeyValueFlashStorage):
+    """Shared memory-based flash storage backend.
+    """
+
+    def __init__(self, path=None, slots=None, slot_size=None):
+        """Returns a new shared memory-based flash storage backend. Arguments
+        not given are read from the project's settings.
+        """
+        KeyValueFlashStorage.__init__(self)
+        self.path = path or getattr(settings, 'FLASH_SHM_PATH', None) or \
+            _default_path()
+        self.slots = slots or getattr(settings, 'FLASH_SHM_SLOTS', 4096)
+        self.slot_size = slot_size or \
+            getattr(settings, 'FLASH_SHM_SLOT_SIZE', 4096)
+        if self.slot_size <= _SLOT.size:
+            raise ImproperlyConfigured('FLASH_SHM_SLOT_SIZE is too small')
+        self._fd = self._map = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        """Opens and maps the shared file, creating it if needed.
+        """
+        if self._map is not None:
+            return self._map
+
+        self._lock.acquire()
+        try:
+            if self._map is None:
+                size = _HEADER_SIZE + self.slots * self.slot_size
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0600)
+                fcntl.lockf(fd, fcntl.LOCK_EX, _HEADER_SIZE, 0)
+                try:
+                    header = _HEADER.pack(_MAGIC, _VERSION, self.slots,
+                                          self.slot_size)
+                    if os.fstat(fd).st_size == 0:
+                        os.ftruncate(fd, size)
+                        os.write(fd, header)
+                    elif os.read(fd, _HEADER.size) != header:
+                        os.close(fd)
+                        raise ImproperlyConfigured('%s was created with '
+                            'different settings' % self.path)
+                finally:
+                    try:
+                        fcntl.lockf(fd, fcntl.LOCK_UN, _HEADER_SIZE, 0)
+                    except (OSError, IOError):
+                        pass
+                self._fd = fd
+                self._map = mmap.mmap(fd, size)
+            return self._map
+        finally:
+            self._lock.release()
+
+    def _offsets(self, key):
+        """Returns the offsets of the consecutive slots where the flash of the
+        client with the given (binary) *key* may be stored.
+        """
+        probes = min(_PROBES, self.slots)
+        first = struct.unpack('<Q', key[:8])[0] % (self.slots - probes + 1)
+        return [_HEADER_SIZE + (first + i) * self.slot_size
+                for i in range(probes)]
+
+    def _lock_slots(self, offsets):
+        """Locks the consecutive slots at the given offsets.
+        """
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, len(offsets) * self.slot_size,
+                    offsets[0])
+
+    def _unlock_slots(self, offsets):
+        """Unlocks the consecutive slots at the given offsets.
+        """
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, len(offsets) * self.slot_size,
+                    offsets[0])
+
+    def _read_slot(self, shm, offset, key, now):
+        """Returns a ``(sequence, client id, expiration time, data)`` tuple
+        read from the slot at the given offset. The data is only read if the
+        slot holds an unexpired flash of the given client.
+        """
+        sequence, expires, length, slot_key = _SLOT.unpack_from(shm, offset)
+        data = None
+        if slot_key == key and expires > now and \
+                length <= self.slot_size - _SLOT.size:
+            start = offset + _SLOT.size
+            data = shm[start:start + length]
+        return sequence, slot_key, expires, data
+
+    def _write_slot(self, shm, offset, key, expires, data):
+        """Writes the given values to the slot at the given offset. The slot
+        must be locked.
+        """
+        sequence = _SEQUENCE.unpack_from(shm, offset)[0]
+        # An odd sequence tells readers that the slot is being changed
+        _SEQUENCE.pack_into(shm, offset, (sequence + 1) & 0xffffffff)
+        start = offset + _SLOT.size
+        shm[start:start + len(data)] = data
+        _SLOT.pack_into(shm, offset, (sequence + 1) & 0xffffffff, expires,
+                        len(data), key)
+        _SEQUENCE.pack_into(shm, offset, (sequence + 2) & 0xffffffff)
+
+    def load(self, client_id):
+        """Returns the data stored under the given *client_id*, or ``None`` if
+        there's no such data or if it has expired.
+        """
+        shm = self._open()
+        key, now = client_id.decode('hex'), time.time()
+        for offset in self._offsets(key):
+            for attempt in range(_READ_ATTEMPTS):
+                sequence, slot_key, expires, data = \
+                    self._read_slot(shm, offset, key, now)
+                if not sequence & 1 and \
+                        _SEQUENCE.unpack_from(shm, offset)[0] == sequence:
+                    break
+            else:
+                # Too many concurrent changes: wait for the writer
+                self._lock.acquire()
+                try:
+                    self._lock_slots([offset])
+                    try:
+                        sequence, slot_key, expires, data = \
+                            self._read_slot(shm, offset, key, now)
+                    finally:
+                        self._unlock_slots([offset])
+                finally:
+                    self._lock.release()
+            if slot_key == key:
+                return data
+        return None
+
+    def _locked(self, client_id, function, *args):
+        """Calls the given function with the shared memory, the client's
+        (binary) key, the offsets of the client's slots and the given *args*,
+        holding the lock of those slots. Returns the value returned by the
+        function.
+        """
+        shm = self._open()
+        key = client_id.decode('hex')
+        offsets = self._offsets(key)
+        self._lock.acquire()
+        try:
+            self._lock_slots(offsets)
+            try:
+                return function(shm, key, offsets, *args)
+            finally:
+                self._unlock_slots(offsets)
+        finally:
+            self._lock.release()
+
+    def _store(self, shm, key, offsets, data, ttl):
+        """Stores the given data in one of the given (locked) slots. If all
+        slots are in use, the one that expires first is overwritten.
+        """
+        # Prefer the slot already used by the client, then an empty or
+        # expired slot, then the slot that expires first
+        now, chosen = time.time(), None
+        for offset in offsets:
+            sequence, expires, length, slot_key = _SLOT.unpack_from(shm, offset)
+            rank = (slot_key != key, expires > now, expires)
+            if chosen is None or rank < chosen[0]:
+                chosen = (rank, offset)
+        for offset in offsets:
+            if offset == chosen[1]:
+                self._write_slot(shm, offset, key, now + ttl, data)
+            elif _SLOT.unpack_from(shm, offset)[3] == key:
+                self._write_slot(shm, offset, _EMPTY, 0, '')
+
+    def _clear(self, shm, key, offsets):
+        """Clears the given (locked) slots used by the client.
+        """
+        for offset in offsets:
+            if _SLOT.unpack_from(shm, offset)[3] == key:
+                self._write_slot(shm, offset, _EMPTY, 0, '')
+
+    def _compare_and_store(self, shm, key, offsets, data, ttl, version):
+        """Stores the given data (or clears the client's slots, if *data* is
+        ``None``) in the given (locked) slots if the version of the data
+        currently stored is *version*. Returns ``True`` on success.
+        """
+        now, current = time.time(), None
+        for offset in offsets:
+            slot_key, expires, current = self._read_slot(shm, offset, key,
+                                                         now)[1:]
+            if slot_key == key:
+                break
+        if current is not None:
+            current = md5_constructor(current).hexdigest()
+        if current != version:
+            return False
+        if data is None:
+            self._clear(shm, key, offsets)
+        else:
+            self._store(shm, key, offsets, data, ttl)
+        return True
+
+    def save(self, client_id, data, ttl):
+        """Stores the given *data* under the given *client_id* for *ttl*
+        seconds. If all slots available to the client are in use, the one
+        that expires first is overwritten. Data that doesn't fit in a slot is
+        dropped, and the data stored under *client_id* is removed.
+        """
+        if not self._fits(data):
+            data = None
+        if data is None:
+            self.delete(client_id)
+        else:
+            self._locked(client_id, self._store, data, ttl)
+
+    def delete(self, client_id):
+        """Removes the data stored under the given *client_id*, if any.
+        """
+        self._locked(client_id, self._clear)
+
+    def cas(self, client_id, data, ttl, version):
+        """Stores the given *data* under the given *client_id* for *ttl*
+        seconds (or removes the stored data, if *data* is ``None``), but only
+        if the version of the stored data is still *version*. Returns
+        ``True`` on success, ``False`` otherwise. Data that doesn't fit in a
+        slot is dropped, and the stored data is removed instead.
+        """
+        if data is not None and not self._fits(data):
+            data = None
+        return self._locked(client_id, self._compare_and_store, data, ttl,
+                            version)
+
+    def _fits(self, data):
+        """Returns whether the given data fits in a slot, logging a warning if
+        it doesn't.
+        """
+        if len(data) > self.slot_size - _SLOT.size:
+            logger.warning('Dropped a flash larger than FLASH_SHM_SLOT_SIZE '
+                           'allows: %d bytes', len(data))
+            return False
+        return True
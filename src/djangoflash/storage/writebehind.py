@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+"""This module provides a write-behind queue for server-side flash storages
+(see :class:`djangoflash.storage.keyvalue.KeyValueFlashStorage`), so responses
+don't wait for the flash to be written.
+
+Writes are queued and coalesced per client (only the last flash written by
+each client is kept), and a background thread writes them to the storage in
+batches, using the storage's ``save_many`` and ``delete_many`` methods. Until
+a write reaches the storage, the flash is read from the queue, so the next
+request of the same client sees it, as long as it's handled by the same
+process.
+
+To use the queue, add the following settings to your project's
+``settings.py`` file::
+
+    FLASH_WRITE_BEHIND = True
+    FLASH_WRITE_BEHIND_INTERVAL = 0.05     # Optional
+    FLASH_WRITE_BEHIND_BATCH_SIZE = 100    # Optional
+    FLASH_WRITE_BEHIND_MAX_SIZE = 10000    # Optional
+
+.. warning::
+   Queued writes are lost if the process is killed. Since writes are no longer
+   compared with the stored flash, changes made by concurrent requests are not
+   merged either; the last write wins.
+"""
+
+import atexit
+import logging
+import time
+
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+
+logger = logging.getLogger('djangoflash.storage.writebehind')
+
+
+class WriteBehindQueue(object):
+    """Queue of flashes waiting to be written to a server-side storage. The
+    stats (see :meth:`stats`) tell how many writes were queued, coalesced,
+    flushed and dropped, how many are still waiting and how long they waited.
+    """
+
+    def __init__(self, storage, interval=0.05, batch_size=100,
+                 max_size=10000):
+        """Returns a new queue that writes to the given *storage*. Queued
+        writes are flushed every *interval* seconds, or as soon as
+        *batch_size* writes are waiting, at most *batch_size* at a time. When
+        *max_size* writes are waiting, new writes are made right away.
+        """
+        self.storage = storage
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_size = max_size
+        self.queued = self.coalesced = self.flushed = self.dropped = 0
+        self.overflows = 0
+        self.last_latency = self.max_latency = 0.0
+        # Client id --> (data, ttl, time queued). Data is None for removals
+        self._pending = {}
+        self._flushing = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._thread = None
+        self._closed = False
+        atexit.register(self.close)
+
+    def put(self, client_id, data, ttl):
+        """Queues the given *data* to be stored under the given *client_id*
+        for *ttl* seconds (or the stored data to be removed, if *data* is
+        ``None``), replacing the write already queued for the same client.
+        """
+        self._lock.acquire()
+        try:
+            if client_id in self._pending:
+                self.coalesced += 1
+                queued_at = self._pending[client_id][2]
+            elif len(self._pending) >= self.max_size and \
+                    client_id not in self._flushing:
+                # A write made right away could be overwritten by the older
+                # write being flushed, so those are always queued
+                self.overflows += 1
+                queued_at = None
+            else:
+                queued_at = time.time()
+            if queued_at is not None:
+                self.queued += 1
+                self._pending[client_id] = (data, ttl, queued_at)
+                if len(self._pending) >= self.batch_size:
+                    self._wakeup.notify()
+        finally:
+            self._lock.release()
+
+        if queued_at is None:
+            # The queue is full, so write it right away
+            if data is None:
+                self.storage.delete(client_id)
+            else:
+                self.storage.save(client_id, data, ttl)
+        elif not self._closed and \
+                (self._thread is None or not self._thread.isAlive()):
+            self._start()
+
+    def lookup(self, client_id):
+        """Returns a ``(queued, data)`` tuple, where *queued* tells whether a
+        write of the given client is waiting to reach the storage and *data*
+        is the data written (``None`` for removals).
+        """
+        self._lock.acquire()
+        try:
+            entry = self._pending.get(client_id) or \
+                self._flushing.get(client_id)
+        finally:
+            self._lock.release()
+        if entry is None:
+            return False, None
+        return True, entry[0]
+
+    def _start(self):
+        """Starts the thread that flushes the queue, unless it's running.
+        """
+        self._lock.acquire()
+        try:
+            if self._thread is None or not self._thread.isAlive():
+                self._thread = threading.Thread(target=self._work)
+                self._thread.setDaemon(True)
+                self._thread.start()
+        finally:
+            self._lock.release()
+
+    def _work(self):
+        """Flushes the queue every *interval* seconds, until it's closed.
+        """
+        while not self._closed:
+            self._lock.acquire()
+            try:
+                if len(self._pending) < self.batch_size and not self._closed:
+                    self._wakeup.wait(self.interval)
+            finally:
+                self._lock.release()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush the flash write queue')
+
+    def close(self):
+        """Stops the thread that flushes the queue, waits for the batch being
+        flushed and flushes the queue one last time. Writes queued from now on
+        are flushed by :meth:`flush` only. This method is called when the
+        process exits.
+        """
+        self._lock.acquire()
+        try:
+            self._closed = True
+            self._wakeup.notify()
+            thread = self._thread
+        finally:
+            self._lock.release()
+        if thread is not None and thread is not threading.currentThread():
+            thread.join(1)
+        self._lock.acquire()
+        try:
+            while self._flushing:
+                self._idle.wait()
+        finally:
+            self._lock.release()
+        self.flush()
+
+    def flush(self):
+        """Writes all queued flashes to the storage, in batches. Returns the
+        number of writes flushed.
+        """
+        flushed = 0
+        while True:
+            count = self._flush_batch()
+            if not count:
+                return flushed
+            flushed += count
+
+    def _flush_batch(self):
+        """Writes at most *batch_size* queued flashes to the storage. Returns
+        the number of writes flushed (or dropped, if the storage failed).
+        """
+        self._lock.acquire()
+        try:
+            if self._flushing or not self._pending:
+                # Another thread is flushing
+                return 0
+            for client_id in self._pending.keys()[:self.batch_size]:
+                self._flushing[client_id] = self._pending.pop(client_id)
+            batch = self._flushing.items()
+        finally:
+            self._lock.release()
+
+        saved = [(client_id, data, ttl) for client_id, (data, ttl, queued_at)
+                 in batch if data is not None]
+        deleted = [client_id for client_id, (data, ttl, queued_at)
+                   in batch if data is None]
+        try:
+            try:
+                if saved:
+                    self.storage.save_many(saved)
+                if deleted:
+                    self.storage.delete_many(deleted)
+            except Exception:
+                logger.exception('Dropped %d flash writes', len(batch))
+                self.dropped += len(batch)
+            else:
+                self.flushed += len(batch)
+                latency = time.time() - min([entry[2] for client_id, entry
+                                             in batch])
+                self.last_latency = latency
+                self.max_latency = max(self.max_latency, latency)
+        finally:
+            self._lock.acquire()
+            try:
+                self._flushing = {}
+                self._idle.notifyAll()
+            finally:
+                self._lock.release()
+        return len(batch)
+
+    def __len__(self):
+        """Returns the number of writes waiting to reach the storage.
+        """
+        return len(self._pending) + len(self._flushing)
+
+    def stats(self):
+        """Returns a :class:`dict` with the number of writes ``queued``,
+        ``coalesced`` with a write already queued, ``flushed`` to the storage,
+        ``dropped`` because the storage failed and made right away because the
+        queue was full (``overflows``), the number of writes waiting
+        (``depth``) and the time the last flushed batch (``last_latency``) and
+        the slowest one (``max_latency``) waited, in seconds, since its oldest
+        write was queued.
+        """
+        return {'queued': self.queued, 'coalesced': self.coalesced,
+                'flushed': self.flushed, 'dropped': self.dropped,
+                'overflows': self.overflows, 'depth': len(self),
+                'last_latency': self.last_latency,
+                'max_latency': self.max_latency}
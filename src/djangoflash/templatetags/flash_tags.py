@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""This module provides template tags and filters that render the *flash*
+contents straight from the :class:`djangoflash.models.FlashScope` object
+exposed by :mod:`djangoflash.context_processors`.
+
+To use them, add ``'djangoflash'`` to the ``INSTALLED_APPS`` section of your
+project's ``settings.py`` file and load the tag library in your templates:
+
+.. code-block:: html+django
+
+   {% load flash_tags %}
+
+   {% flash_messages %}
+       <ul>
+       {% for key, message in messages %}
+           <li class="{{ key }}">{{ message }}</li>
+       {% endfor %}
+       </ul>
+   {% endflash_messages %}
+
+   {% for message in flash|level:"error" %}
+       <p class="error">{{ message }}</p>
+   {% endfor %}
+"""
+
+from django import template
+from django.core.cache import cache
+from django.utils.hashcompat import md5_constructor
+from django.utils.translation import get_language
+
+from djangoflash.context_processors import CONTEXT_VAR
+from djangoflash.models import EMPTY_FLASH
+
+
+register = template.Library()
+
+# Name of the variable exposed to the contents of {% flash_messages %}
+MESSAGES_VAR = 'messages'
+
+
+def _as_sequence(value):
+    """Returns *value* itself if it's a list (values stored with
+    :meth:`FlashScope.add`), or a sequence containing only *value* otherwise.
+    """
+    if isinstance(value, list):
+        return value
+    return (value,)
+
+
+class _Messages(object):
+    """Iterable over the ``(key, message)`` pairs stored in a flash. Messages
+    are read directly from the flash, without any intermediate copies.
+    """
+
+    def __init__(self, flash, keys=None):
+        """Returns a new iterable over the messages stored under the given
+        *keys* of *flash* (or under all keys if no *keys* are given).
+        """
+        self.flash = flash
+        self.keys = keys
+
+    def __iter__(self):
+        flash = self.flash
+        for key in self.keys or flash.iterkeys():
+            if key in flash:
+                for message in _as_sequence(flash[key]):
+                    yield key, message
+
+    def __nonzero__(self):
+        for message in self:
+            return True
+        return False
+
+    def digest(self):
+        """Returns a hash of the messages and the active language, used to
+        cache rendered fragments.
+        """
+        return md5_constructor(repr((get_language(), list(self)))).hexdigest()
+
+
+class FlashMessagesNode(template.Node):
+    """Renders its contents only if there are messages in the flash.
+    """
+
+    def __init__(self, nodelist, keys, timeout=None, fragment_name=None):
+        self.nodelist = nodelist
+        self.keys = keys
+        self.timeout = timeout
+        self.fragment_name = fragment_name
+
+    def render(self, context):
+        flash = context.get(CONTEXT_VAR, EMPTY_FLASH) or EMPTY_FLASH
+        keys = [key.resolve(context) for key in self.keys]
+        messages = _Messages(flash, keys)
+        if not messages:
+            return ''
+
+        if self.timeout is None:
+            return self._render(context, messages)
+
+        cache_key = 'djangoflash.flash_messages.%s.%s' % \
+            (self.fragment_name, messages.digest())
+        output = cache.get(cache_key)
+        if output is None:
+            output = self._render(context, messages)
+            cache.set(cache_key, output, int(self.timeout.resolve(context)))
+        return output
+
+    def _render(self, context, messages):
+        context.push()
+        try:
+            context[MESSAGES_VAR] = messages
+            return self.nodelist.render(context)
+        finally:
+            context.pop()
+
+
+@register.tag
+def flash_messages(parser, token):
+    """Renders its contents only if the flash contains messages, exposing them
+    to the template as a ``messages`` variable that yields ``(key, message)``
+    pairs. Values stored with :meth:`FlashScope.add` yield one pair for each
+    message.
+
+    The messages may be limited to a set of keys::
+
+        {% flash_messages "error" "warning" %}...{% endflash_messages %}
+
+    The rendered contents may also be cached for a number of seconds, keyed by
+    a fragment name and a hash of the messages, just like Django's own
+    ``{% cache %}`` tag::
+
+        {% flash_messages cache 600 banner %}...{% endflash_messages %}
+    """
+    bits = token.split_contents()
+    tag_name, bits = bits[0], bits[1:]
+
+    timeout = fragment_name = None
+    if 'cache' in bits:
+        index = bits.index('cache')
+        try:
+            timeout, fragment_name = bits[index + 1:index + 3]
+        except ValueError:
+            raise template.TemplateSyntaxError(
+                "'%s' tag requires a timeout and a fragment name after "
+                "'cache'" % tag_name)
+        timeout = parser.compile_filter(timeout)
+        bits = bits[:index] + bits[index + 3:]
+
+    keys = [parser.compile_filter(bit) for bit in bits]
+    nodelist = parser.parse(('end%s' % tag_name,))
+    parser.delete_first_token()
+    return FlashMessagesNode(nodelist, keys, timeout, fragment_name)
+
+
+@register.filter
+def level(flash, key):
+    """Returns the messages stored in *flash* under the given *key*, which can
+    be used in a ``{% for %}`` loop even if a single message is stored::
+
+        {% for message in flash|level:"error" %}...{% endfor %}
+    """
+    if flash and key in flash:
+        return _as_sequence(flash[key])
+    return ()
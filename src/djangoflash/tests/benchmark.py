@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""Compares the speed and the output size of the built-in codecs when
+encoding-and-signing and decoding typical flashes. This module isn't part of
+the test suite; run it with::
+
+    $ python -m djangoflash.tests.benchmark
+"""
+
+import sys
+import time
+from datetime import datetime, date
+from decimal import Decimal
+
+from django.core.management import setup_environ
+import djangoflash.tests.testproj.settings as project_settings
+setup_environ(project_settings)
+
+from djangoflash.codec import get_codec
+from djangoflash.models import FlashScope
+
+
+# Codecs to compare, and whether they support the typed flash
+CODECS = (
+    ('json', False),
+    ('json_zlib', False),
+    ('json_lazy', False),
+    ('json_typed', True),
+    ('pickle', True),
+)
+
+
+def _plain_flash():
+    """Returns a flash holding a few messages.
+    """
+    flash = FlashScope()
+    flash['message'] = 'Your profile was updated successfully.'
+    flash.add('warning', 'Your password expires in 3 days.',
+              'Please confirm your e-mail address.')
+    return flash
+
+def _typed_flash():
+    """Returns a flash holding a few messages and some form data.
+    """
+    flash = _plain_flash()
+    flash['form'] = {'name': u'Jos\xe9 da Silva', 'email': 'jose@example.com',
+                     'birth_date': date(1980, 5, 17), 'amount': Decimal('99.90'),
+                     'submitted_at': datetime(2011, 2, 12, 10, 30, 15),
+                     'choices': (1, 3, 5)}
+    return flash
+
+
+def _best_time(function, number, repeat=3):
+    """Returns the best time, in microseconds, taken by a call to *function*.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        for j in xrange(number):
+            function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1000000 / number
+
+
+def run(number=10000, out=sys.stdout):
+    """Prints the time taken by each codec to encode-and-sign and to decode a
+    plain flash and a typed flash, along with the size of the signed data.
+    """
+    out.write('%-10s  %-5s  %10s  %10s  %6s\n' % \
+        ('codec', 'flash', 'encode(us)', 'decode(us)', 'bytes'))
+    for name, typed in CODECS:
+        codec = get_codec(name)
+        flashes = [('plain', _plain_flash())]
+        if typed:
+            flashes.append(('typed', _typed_flash()))
+        for label, flash in flashes:
+            signed = codec.encode_and_sign(flash)
+            encode = _best_time(lambda: codec.encode_and_sign(flash), number)
+            decode = _best_time(lambda: codec.decode_signed(signed), number)
+            out.write('%-10s  %-5s  %10.1f  %10.1f  %6d\n' % \
+                (name, label, encode, decode, len(signed)))
+
+
+if __name__ == '__main__':
+    run()
@@ -3,12 +3,19 @@
 """djangoflash.codec test cases.
 """
 
+from datetime import datetime, date, time
+from decimal import Decimal
 from unittest import TestCase
+from uuid import UUID
 
+from django.conf import settings
 from django.core.exceptions import SuspiciousOperation
+from django.utils.safestring import mark_safe
+from django.utils.translation import ugettext_lazy
 
 from djangoflash import codec
-from djangoflash.codec import pickle_impl, json_impl, json_zlib_impl, BaseCodec
+from djangoflash.codec import pickle_impl, json_impl, json_zlib_impl, \
+    json_lazy_impl, json_typed_impl
 from djangoflash.models import FlashScope
 
 
@@ -35,6 +42,18 @@ class CodecTestCase(TestCase):
         self.assertTrue(isinstance(codec_impl, json_impl.CodecClass))
         self.assertTrue(isinstance(codec_impl, json_zlib_impl.CodecClass))
 
+    def test_get_json_lazy_codec_by_alias(self):
+        """Codec: 'json_lazy' should resolve to lazy JSON-based codec.
+        """
+        codec_impl = codec.get_codec('json_lazy')
+        self.assertTrue(isinstance(codec_impl, json_lazy_impl.CodecClass))
+
+    def test_get_json_typed_codec_by_alias(self):
+        """Codec: 'json_typed' should resolve to typed JSON-based codec.
+        """
+        codec_impl = codec.get_codec('json_typed')
+        self.assertTrue(isinstance(codec_impl, json_typed_impl.CodecClass))
+
     def test_get_codec_by_module_name(self):
         """Codec: 'djangoflash.codec.json_impl' should resolve to JSON-based codec.
         """
@@ -64,9 +83,13 @@ class BaseCodecTestCase(TestCase):
         self.flash = FlashScope()
         self.flash['info'] = 'Info'
         self.flash.update()
-        self.expected = 'eyJfc2Vzc2lvbiI6IHsiaW5mbyI6ICJJbmZvIn0sICJfdXNlZCI6' \
-                        'IHsiaW5mbyI6IG51bGx9fWZk\nNDViYTljMmU3MWJlZjBjYjcxOW' \
-                        'EwYjdlYzJlZjUx\n'
+        self.expected = 'AGoBeyJfc2Vzc2lvbiI6eyJpbmZvIjoiSW5mbyJ9LCJfdXNlZCI6' \
+                        'eyJpbmZvIjpudWxsfX1hZWFl\nNDE0YjAyZWFkMjhhOTg4ODFkY2' \
+                        'VkMTg0OWExNg==\n'
+        # Data signed before the envelope was introduced
+        self.legacy = 'eyJfc2Vzc2lvbiI6IHsiaW5mbyI6ICJJbmZvIn0sICJfdXNlZCI6' \
+                      'IHsiaW5mbyI6IG51bGx9fWZk\nNDViYTljMmU3MWJlZjBjYjcxOW' \
+                      'EwYjdlYzJlZjUx\n'
 
     def test_encode_and_sign(self):
         """Codec: BaseCodec should return an encoded and signed version of the flash.
@@ -82,6 +105,13 @@ class BaseCodecTestCase(TestCase):
         flash.update()
         self.assertFalse('info' in flash)
 
+    def test_decoded_signed_legacy(self):
+        """Codec: BaseCodec should decode a flash signed without an envelope.
+        """
+        flash = self.codec.decode_signed(self.legacy)
+        self.assertEqual('Info', flash['info'])
+        self.assertEqual('Info', self.codec.unsign(self.legacy)['info'])
+
     def test_decoded_tampered(self):
         """Codec: BaseCodec should not decode a tampered version of the flash.
         """
@@ -91,6 +121,175 @@ class BaseCodecTestCase(TestCase):
         operation = lambda: self.codec.decode_signed(tampered)
         self.assertRaises(SuspiciousOperation, operation)
 
+    def test_decode_signed_invalid(self):
+        """Codec: BaseCodec should return None when the signed data can't be decoded.
+        """
+        signed = self.codec.encode_and_sign(self.flash)
+        self.codec.decode = lambda encoded: self.fail()
+        self.assertEqual(None, self.codec.decode_signed(signed))
+
+    def test_is_well_formed(self):
+        """Codec: BaseCodec should tell whether some data looks like an encoded and signed flash.
+        """
+        self.assertTrue(self.codec.is_well_formed(self.expected))
+        self.assertTrue(self.codec.is_well_formed(self.expected.strip()))
+        self.assertTrue(self.codec.is_well_formed(unicode(self.expected)))
+        self.assertFalse(self.codec.is_well_formed(None))
+        self.assertFalse(self.codec.is_well_formed(''))
+        self.assertFalse(self.codec.is_well_formed('eyJfc2Vzc2lvbiI6'))
+        self.assertFalse(self.codec.is_well_formed(self.expected[1:]))
+        self.assertFalse(self.codec.is_well_formed('<' + self.expected[1:]))
+        self.assertFalse(self.codec.is_well_formed('A' * 10000))
+
+    def test_unsign(self):
+        """Codec: BaseCodec should unsign an encoded and signed version of the flash.
+        """
+        flash = self.codec.unsign(self.expected)
+        self.assertEqual('Info', flash['info'])
+
+    def test_unsign_invalid(self):
+        """Codec: BaseCodec should not raise errors when unsigning invalid data.
+        """
+        tampered = 'eyJfc2Vzc2lvbiI6IHsiaW6mbyI6ICJJbmZvIn0sICJfdXNlZCI6IHsia' \
+                   'W5mbyI6IG51bGx9fWZk\nNDViYTljMmU3MWJlZjBjYjcxOWEwYjdlYzJl' \
+                   'ZjUx\n'
+        self.assertEqual(None, self.codec.unsign(tampered))
+        self.assertEqual(None, self.codec.unsign('A===' * 20))
+        self.assertEqual(None, self.codec.unsign('junk'))
+
+
+class CodecEnvelopeTestCase(TestCase):
+    """Tests the envelope that identifies the codec used to encode a flash.
+    """
+    def setUp(self):
+        """Creates a sample flash.
+        """
+        self.flash = FlashScope()
+        self.flash['info'] = 'Info'
+
+    def tearDown(self):
+        if hasattr(settings, 'FLASH_CODEC_FALLBACKS'):
+            del settings.FLASH_CODEC_FALLBACKS
+
+    def test_pack(self):
+        """Codec: BaseCodec should wrap the encoded flash in an envelope.
+        """
+        json_codec = json_impl.CodecClass()
+        self.assertEqual('\x00j\x01' + json_codec.encode(self.flash),
+                         json_codec.pack(self.flash))
+
+    def test_pack_without_codec_id(self):
+        """Codec: BaseCodec should not wrap the encoded flash if the codec has no identifier.
+        """
+        json_codec = json_impl.CodecClass()
+        json_codec.codec_id = None
+        self.assertEqual(json_codec.encode(self.flash),
+                         json_codec.pack(self.flash))
+
+    def test_unpack_with_other_codec(self):
+        """Codec: BaseCodec should decode a flash using the codec identified in the envelope.
+        """
+        settings.FLASH_CODEC_FALLBACKS = ('json_zlib', 'json_lazy', 'pickle')
+        json_codec = json_impl.CodecClass()
+        for codec_impl in (json_zlib_impl.CodecClass(),
+                           json_lazy_impl.CodecClass(),
+                           pickle_impl.CodecClass()):
+            flash = json_codec.unpack(codec_impl.pack(self.flash))
+            self.assertEqual('Info', flash['info'])
+            signed = codec_impl.encode_and_sign(self.flash)
+            self.assertEqual('Info', json_codec.decode_signed(signed)['info'])
+
+    def test_unpack_with_codec_not_allowed(self):
+        """Codec: BaseCodec should only decode a flash using the codecs allowed by the settings.
+        """
+        settings.FLASH_CODEC_FALLBACKS = ('json_zlib',)
+        json_codec = json_impl.CodecClass()
+        packed = pickle_impl.CodecClass().pack(self.flash)
+        self.assertRaises(ValueError, json_codec.unpack, packed)
+        signed = pickle_impl.CodecClass().encode_and_sign(self.flash)
+        self.assertEqual(None, json_codec.decode_signed(signed))
+        self.assertEqual(None, json_codec.unsign(signed))
+
+    def test_unpack_invalid_envelope(self):
+        """Codec: BaseCodec should not decode a flash with an invalid envelope.
+        """
+        json_codec = json_impl.CodecClass()
+        encoded = json_codec.encode(self.flash)
+        for packed in ('\x00j', '\x00j\x09' + encoded, '\x00?\x01' + encoded):
+            self.assertRaises(ValueError, json_codec.unpack, packed)
+
+    def test_pack_deadline(self):
+        """Codec: BaseCodec should write the expiration time of the flash to the envelope.
+        """
+        json_codec = json_impl.CodecClass()
+        self.flash.set_max_age('info', 60)
+        packed = json_codec.pack(self.flash)
+        self.assertEqual('\x00j\x02', packed[:3])
+        self.assertEqual(self.flash.expires_at(),
+                         json_codec.get_deadline(packed))
+        self.assertFalse(json_codec.is_expired(packed))
+        self.assertEqual('Info', json_codec.unpack(packed)['info'])
+        self.assertEqual(None, json_codec.get_deadline(
+            json_codec.pack(FlashScope({'_session': {'a': 1}, '_used': {}}))))
+
+    def test_unpack_expired(self):
+        """Codec: BaseCodec should not decode an expired flash.
+        """
+        self.flash.set_max_age('info', -1)
+        for codec_impl in (json_impl.CodecClass(), json_lazy_impl.CodecClass(),
+                           pickle_impl.CodecClass()):
+            packed = codec_impl.pack(self.flash)
+            self.assertTrue(codec_impl.is_expired(packed))
+            self.assertEqual(None, codec_impl.unpack(packed))
+
+    def test_decode_signed_expired(self):
+        """Codec: BaseCodec should discard an expired flash before checking its signature.
+        """
+        json_codec = json_impl.CodecClass()
+        self.flash.set_max_age('info', -1)
+        signed = json_codec.encode_and_sign(self.flash)
+        self.assertTrue(json_codec.is_signed_expired(signed))
+        self.assertEqual(None, json_codec.decode_signed(signed))
+
+        # The signature is not checked
+        tampered = signed[:-6] + 'AAAA==' + signed[-1:]
+        self.assertEqual(None, json_codec.decode_signed(tampered))
+        self.assertEqual(None, json_codec.unsign(tampered))
+
+        self.flash.set_max_age('info', 60)
+        signed = json_codec.encode_and_sign(self.flash)
+        self.assertFalse(json_codec.is_signed_expired(signed))
+        self.assertEqual('Info', json_codec.decode_signed(signed)['info'])
+
+    def test_get_codec_by_id(self):
+        """Codec: Codec identifiers should resolve to their codecs.
+        """
+        settings.FLASH_CODEC_FALLBACKS = ('json_zlib',)
+        self.assertTrue(isinstance(codec.get_codec_by_id('j'),
+                                   json_impl.CodecClass))
+        self.assertTrue(isinstance(codec.get_codec_by_id('z'),
+                                   json_zlib_impl.CodecClass))
+        self.assertTrue(codec.get_codec_by_id('j') is codec.get_codec_by_id('j'))
+        self.assertRaises(ValueError, codec.get_codec_by_id, '?')
+        self.assertRaises(ValueError, codec.get_codec_by_id, 'p')
+
+    def test_register_codec(self):
+        """Codec: Custom codecs should be registered under unused identifiers.
+        """
+        codec.register_codec('J', 'djangoflash.codec.json_impl')
+        settings.FLASH_CODEC_FALLBACKS = ('djangoflash.codec.json_impl',)
+        try:
+            self.assertTrue(isinstance(codec.get_codec_by_id('J'),
+                                       json_impl.CodecClass))
+            codec.register_codec('J', 'djangoflash.codec.json_impl')
+        finally:
+            del codec.CODEC_IDS['J']
+            del codec._codecs_by_id['J']
+        operation = lambda: codec.register_codec('j', 'myproj.codec')
+        self.assertRaises(ValueError, operation)
+        operation = lambda: codec.register_codec('jj', 'myproj.codec')
+        self.assertRaises(ValueError, operation)
+
 
 class PickleCodecTestCase(TestCase):
     """Tests the Pickle-based serialization codec implementation.
@@ -102,11 +301,15 @@ class PickleCodecTestCase(TestCase):
         self.flash = FlashScope()
         self.flash['info'] = 'Info'
         self.flash.update()
-        self.expected = '\x80\x02cdjangoflash.models\nFlashScope\nq\x01)\x81q' \
-                        '\x02}q\x03(U\x03nowq\x04cdjangoflash.models\n_Immedi' \
-                        'ateFlashScopeAdapter\nq\x05)\x81q\x06}q\x07U\x08dele' \
-                        'gateq\x08h\x02sbU\x08_sessionq\t}q\nU\x04infoq\x0bU' \
-                        '\x04Infoq\x0csU\x05_usedq\r}q\x0eh\x0bNsub.'
+        self.expected = '\x80\x02cdjangoflash.models\nFlashScope\nq\x01)Rq' \
+                        '\x02}q\x03U\x04infoq\x04U\x04Infoq\x05sh\x04\x85' \
+                        '\x86b.'
+        # Pickle dump made before FlashScope had a compact representation
+        self.legacy = '\x80\x02cdjangoflash.models\nFlashScope\nq\x01)\x81q' \
+                      '\x02}q\x03(U\x03nowq\x04cdjangoflash.models\n_Immedi' \
+                      'ateFlashScopeAdapter\nq\x05)\x81q\x06}q\x07U\x08dele' \
+                      'gateq\x08h\x02sbU\x08_sessionq\t}q\nU\x04infoq\x0bU' \
+                      '\x04Infoq\x0csU\x05_usedq\r}q\x0eh\x0bNsub.'
 
     def test_encode(self):
         """Codec: Pickle-based codec should return a Pickle dump of the flash.
@@ -122,14 +325,25 @@ class PickleCodecTestCase(TestCase):
         self.assertFalse('info' in flash)
 
 
+    def test_decode_legacy(self):
+        """Codec: Pickle-based codec should restore the flash from a Pickle dump made by previous versions.
+        """
+        flash = self.codec.decode(self.legacy)
+        self.assertEqual('Info', flash['info'])
+        self.assertTrue(flash.now.delegate is flash)
+        flash.now['error'] = 'Error'
+        self.assertEqual(['error', 'info'], sorted(flash.keys()))
+        flash.update()
+        self.assertFalse('info' in flash)
+
+
 class JSONCodecTestCase(TestCase):
     """Tests the JSON-based serialization codec implementation.
     """
     def setUp(self):
         """Creates a JSON-based codec and a sample flash.
         """
-        self.expected = '{"_session": {"info": "Info"}, ' \
-                        '"_used": {"info": null}}'
+        self.expected = '{"_session":{"info":"Info"},"_used":{"info":null}}'
         self.codec = json_impl.CodecClass()
         self.flash = FlashScope()
         self.flash['info'] = 'Info'
@@ -140,6 +354,12 @@ class JSONCodecTestCase(TestCase):
         """
         self.assertEqual(self.expected, self.codec.encode(self.flash))
 
+    def test_encode_immediate_values(self):
+        """Codec: JSON-based codec should not encode immediate values.
+        """
+        self.flash.now['error'] = 'Error'
+        self.assertEqual(self.expected, self.codec.encode(self.flash))
+
     def test_decode(self):
         """Codec: JSON-based codec should restore the flash from a JSON string.
         """
@@ -149,15 +369,66 @@ class JSONCodecTestCase(TestCase):
         self.assertFalse('info' in flash)
 
 
+class JSONEngineTestCase(TestCase):
+    """Tests the JSON engines used by the JSON-based codecs.
+    """
+    def setUp(self):
+        """Creates a sample flash and finds the available JSON engines.
+        """
+        self.flash = FlashScope()
+        self.flash['info'] = u'Caf\xe9 </script>'
+        self.flash.add('error', 'Error 1', 'Error 2')
+        self.flash['form'] = {'id': 12345678901, 'price': 0.5, 'tags': [],
+                              'active': True, 'parent': None}
+        self.flash.update()
+        self.engines = []
+        for name in ('simplejson', 'json', 'django', 'ujson'):
+            try:
+                json_impl.get_engine(name)
+                self.engines.append(name)
+            except ImportError:
+                pass
+
+    def test_get_engine(self):
+        """Codec: Should resolve JSON engines.
+        """
+        self.assertTrue('json' in self.engines)
+        self.assertTrue('django' in self.engines)
+        dumps, loads = json_impl.get_engine()
+        self.assertEqual('{"a":[1,2]}', dumps({'a': [1, 2]}))
+        self.assertEqual({'a': [1, 2]}, loads('{"a": [1, 2]}'))
+
+    def test_get_unknown_engine(self):
+        """Codec: Should raise an error when resolving an unknown JSON engine.
+        """
+        self.assertRaises(ValueError, json_impl.get_engine, 'invalid')
+
+    def test_round_trip(self):
+        """Codec: All JSON engines should produce byte-identical round trips.
+        """
+        for codec_class in (json_impl.CodecClass, json_zlib_impl.CodecClass,
+                            json_lazy_impl.CodecClass,
+                            json_typed_impl.CodecClass):
+            expected = codec_class('json').encode(self.flash)
+            for engine in self.engines:
+                codec_impl = codec_class(engine)
+                encoded = codec_impl.encode(self.flash)
+                self.assertEqual(expected, encoded)
+                flash = codec_impl.decode(encoded)
+                self.assertEqual(sorted(self.flash.items()),
+                                 sorted(flash.items()))
+                self.assertEqual(expected, codec_impl.encode(flash))
+
+
 class JSONZlibCodecTestCase(TestCase):
     """Tests the JSON/zlib-based serialization codec implementation.
     """
     def setUp(self):
         """Creates a JSON\zlib-based codec and a sample flash.
         """
-        self.expected = 'x\x9c\xabV\x8a/N-.\xce\xcc\xcfS\xb2R\xa8V\xca\xccK' \
-                        '\xcb\x072\x94<At\xad\x8e\x82R|iqj\n\xb2T^iNNm-\x00' \
-                        '\xf5\xa2\x12\x03'
+        self.expected = 'x\x9c\xabV\x8a/N-.\xce\xcc\xcfS\xb2\xaaV\xca\xccK' \
+                        '\xcbW\xb2R\xf2\x04Q\xb5:J\xf1\xa5\xc5\xa9)\x08\xf1' \
+                        '\xbc\xd2\x9c\x9c\xdaZ\x00\xb6q\x11c'
         self.codec = json_zlib_impl.CodecClass()
         self.flash = FlashScope()
         self.flash['info'] = 'Info'
@@ -175,3 +446,231 @@ class JSONZlibCodecTestCase(TestCase):
         self.assertEqual('Info', flash['info'])
         flash.update()
         self.assertFalse('info' in flash)
+
+
+class JSONLazyCodecTestCase(TestCase):
+    """Tests the lazy JSON-based serialization codec implementation.
+    """
+    def setUp(self):
+        """Creates a lazy JSON-based codec and a sample flash.
+        """
+        self.expected = '{"_keys":[["info",0,6]],"_used":{"info":null}}' \
+                        '\n"Info"'
+        self.codec = json_lazy_impl.CodecClass()
+        self.flash = FlashScope()
+        self.flash['info'] = 'Info'
+        self.flash.update()
+
+    def _is_decoded(self, flash, key):
+        return not isinstance(dict.__getitem__(flash._session, key),
+                              json_lazy_impl._EncodedValue)
+
+    def test_encode(self):
+        """Codec: Lazy JSON-based codec should return an index followed by the encoded values.
+        """
+        self.assertEqual(self.expected, self.codec.encode(self.flash))
+
+    def test_decode(self):
+        """Codec: Lazy JSON-based codec should restore the flash from an index followed by the encoded values.
+        """
+        flash = self.codec.decode(self.expected)
+        self.assertEqual('Info', flash['info'])
+        flash.update()
+        self.assertFalse('info' in flash)
+
+    def test_decode_lazily(self):
+        """Codec: Lazy JSON-based codec should decode a value only when it's accessed.
+        """
+        self.flash['error'] = ['Error 1', 'Error 2']
+        flash = self.codec.decode(self.codec.encode(self.flash))
+        self.assertEqual(2, len(flash))
+        self.assertFalse(self._is_decoded(flash, 'info'))
+        self.assertFalse(self._is_decoded(flash, 'error'))
+        self.assertEqual(['Error 1', 'Error 2'], flash['error'])
+        self.assertFalse(self._is_decoded(flash, 'info'))
+        self.assertTrue(self._is_decoded(flash, 'error'))
+
+    def test_decode_items(self):
+        """Codec: Lazy JSON-based codec should decode values when they're iterated.
+        """
+        self.flash['error'] = ['Error']
+        flash = self.codec.decode(self.codec.encode(self.flash))
+        self.assertEqual([('error', ['Error']), ('info', 'Info')],
+                         sorted(flash.items()))
+        self.assertEqual(['Error'], flash.pop('error'))
+        self.assertEqual('Info', flash.get('info'))
+        self.assertEqual(None, flash.get('warning'))
+
+    def test_update_doesnt_decode(self):
+        """Codec: Lazy JSON-based codec should not decode values when the flash is updated or stored.
+        """
+        self.flash['error'] = 'Error'
+        flash = self.codec.decode(self.codec.encode(self.flash))
+        self.assertFalse(self._is_decoded(flash.persistent(), 'error'))
+        flash.update()
+        self.assertFalse('info' in flash)
+        self.assertFalse(self._is_decoded(flash, 'error'))
+
+    def test_encode_untouched_values(self):
+        """Codec: Lazy JSON-based codec should write untouched values back as they were read.
+        """
+        encoded = '{"_keys":[["error",0,6],["info",6,12]],"_used":{}}' \
+                  '\n[1, 2]"Info"'
+        flash = self.codec.decode(encoded)
+        self.assertEqual(encoded, self.codec.encode(flash))
+
+    def test_encode_changed_values(self):
+        """Codec: Lazy JSON-based codec should encode values that were changed.
+        """
+        encoded = '{"_keys":[["error",0,5]],"_used":{}}\n[1,2]'
+        flash = self.codec.decode(encoded)
+        flash['error'].append(3)
+        flash = self.codec.decode(self.codec.encode(flash))
+        self.assertEqual([1, 2, 3], flash['error'])
+
+    def test_pickle(self):
+        """Codec: Flashes restored by the lazy JSON-based codec should be pickled with their values decoded.
+        """
+        flash = self.codec.decode(self.expected)
+        flash = pickle_impl.pickle.loads(pickle_impl.CodecClass().encode(flash))
+        self.assertEqual(dict, type(flash._session))
+        self.assertEqual('Info', flash['info'])
+
+    def test_decode_invalid_offsets(self):
+        """Codec: Lazy JSON-based codec should not restore the flash if the offsets are invalid.
+        """
+        encoded = '{"_keys":[["info",0,16]],"_used":{}}\n"Info"'
+        operation = lambda: self.codec.decode(encoded)
+        self.assertRaises(ValueError, operation)
+
+    def test_decode_signed(self):
+        """Codec: Lazy JSON-based codec should decode an encoded and signed version of the flash.
+        """
+        flash = self.codec.decode_signed(self.codec.encode_and_sign(self.flash))
+        self.assertEqual('Info', flash['info'])
+
+
+class JSONTypedCodecTestCase(TestCase):
+    """Tests the typed JSON-based serialization codec implementation.
+    """
+    def setUp(self):
+        """Creates a typed JSON-based codec and a sample flash.
+        """
+        self.codec = json_typed_impl.CodecClass()
+        self.flash = FlashScope()
+
+    def _round_trip(self, value):
+        """Encodes and decodes a flash holding the given value.
+        """
+        self.flash['value'] = value
+        return self.codec.decode(self.codec.encode(self.flash))['value']
+
+    def test_encode(self):
+        """Codec: Typed JSON-based codec should tag the values not supported by plain JSON.
+        """
+        self.flash['info'] = (date(2011, 2, 12), Decimal('1.50'))
+        self.flash.update()
+        self.assertEqual('{"_session":{"info":{"~tu":[{"~d":[2011,2,12]},'
+                         '{"~dec":"1.50"}]}},"_used":{"info":null}}',
+                         self.codec.encode(self.flash))
+
+    def test_plain_values(self):
+        """Codec: Typed JSON-based codec should restore values supported by plain JSON.
+        """
+        value = {'a': [1, 2.5, None, True], 'b': u'Caf\xe9', 'c': {}}
+        self.assertEqual(value, self._round_trip(value))
+
+    def test_typed_values(self):
+        """Codec: Typed JSON-based codec should restore dates, times, decimals, tuples and UUIDs.
+        """
+        values = [datetime(2011, 2, 12, 10, 30), datetime(2011, 2, 12, 10, 30, 0, 5),
+                  date(2011, 2, 12), time(10, 30), time(10, 30, 15, 250),
+                  Decimal('1.50'), (1, (2, 3)), (), UUID(int=12345)]
+        for value in values:
+            result = self._round_trip(value)
+            self.assertEqual(value, result)
+            self.assertEqual(type(value), type(result))
+
+    def test_nested_values(self):
+        """Codec: Typed JSON-based codec should restore typed values inside lists and dicts.
+        """
+        value = [{'when': date(2011, 2, 12), 'items': [(1, Decimal('2'))]}]
+        self.assertEqual(value, self._round_trip(value))
+
+    def test_escaped_dicts(self):
+        """Codec: Typed JSON-based codec should restore dicts that look like tagged values.
+        """
+        for value in ({'~d': '2011-02-12'}, {'~~d': 1}, {'~': {'~x': 1}}):
+            self.assertEqual(value, self._round_trip(value))
+
+    def test_keys_like_tags(self):
+        """Codec: Typed JSON-based codec should restore flashes whose single key looks like a tag.
+        """
+        self.flash['~d'] = [2011, 2, 12]
+        self.flash.update()
+        flash = self.codec.decode(self.codec.encode(self.flash))
+        self.assertEqual([2011, 2, 12], flash['~d'])
+        self.assertEqual(['~d'], flash._used.keys())
+
+    def test_without_object_hook(self):
+        """Codec: Typed JSON-based codec should restore values when the JSON engine doesn't support object hooks.
+        """
+        self.codec._loads_tagged = self.codec._loads_and_untag
+        value = [{'when': date(2011, 2, 12), '~d': (1,)}, {'~x': 1}]
+        self.assertEqual(value, self._round_trip(value))
+        self.assertRaises(ValueError, self.codec.decode,
+                          '{"_session":{"value":{"~?":1}},"_used":{}}')
+
+    def test_plain_values_not_copied(self):
+        """Codec: Typed JSON-based codec should not copy values supported by plain JSON when encoding.
+        """
+        value = {'a': [1, 'b', {'c': None}]}
+        self.assertTrue(json_typed_impl._tag(value) is value)
+        tagged = json_typed_impl._tag([1, (2,)])
+        self.assertEqual([1, {'~tu': [2]}], tagged)
+
+    def test_lazy_strings(self):
+        """Codec: Typed JSON-based codec should translate lazy strings.
+        """
+        result = self._round_trip([ugettext_lazy('Message'), mark_safe('<b>')])
+        self.assertEqual([u'Message', u'<b>'], result)
+
+    def test_unsupported_values(self):
+        """Codec: Typed JSON-based codec should not encode unsupported values.
+        """
+        self.flash['value'] = object()
+        self.assertRaises(TypeError, self.codec.encode, self.flash)
+
+    def test_unknown_tag(self):
+        """Codec: Typed JSON-based codec should not decode unknown tags.
+        """
+        encoded = '{"_session":{"value":{"~?":1}},"_used":{}}'
+        self.assertRaises(ValueError, self.codec.decode, encoded)
+
+    def test_register_type(self):
+        """Codec: Typed JSON-based codec should support custom types.
+        """
+        class Point(object):
+            def __init__(self, x, y):
+                self.x, self.y = x, y
+
+        json_typed_impl.register_type(Point, '~pt',
+                                      lambda point: [point.x, point.y],
+                                      lambda value: Point(*value))
+        try:
+            result = self._round_trip(Point(1, 2))
+            self.assertEqual((1, 2), (result.x, result.y))
+            operation = lambda: json_typed_impl.register_type(
+                Point, '~pt', None, None)
+            self.assertRaises(ValueError, operation)
+        finally:
+            del json_typed_impl._encoders[Point]
+            del json_typed_impl._decoders['~pt']
+
+    def test_register_invalid_tag(self):
+        """Codec: Typed JSON-based codec should reject invalid tags.
+        """
+        for tag in ('pt', '~', '~~pt'):
+            operation = lambda: json_typed_impl.register_type(
+                object, tag, None, None)
+            self.assertRaises(ValueError, operation)
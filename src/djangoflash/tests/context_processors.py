@@ -8,8 +8,8 @@ from unittest import TestCase
 from django.core.exceptions import SuspiciousOperation
 from django.http import HttpRequest
 
-from djangoflash.context_processors import CONTEXT_VAR, flash
-from djangoflash.models import FlashScope
+from djangoflash.context_processors import CONTEXT_VAR, flash, lazy_flash
+from djangoflash.models import EMPTY_FLASH, FlashScope
 
 
 class FlashContextProcessorTestCase(TestCase):
@@ -32,8 +32,51 @@ class FlashContextProcessorTestCase(TestCase):
         self.assertTrue(isinstance(flash(self.request)[CONTEXT_VAR], \
             FlashScope))
 
+    def test_expose_shared_empty_flash(self):
+        """FlashContextProcessor: should expose the same empty flash when there's no flash available.
+        """
+        delattr(self.request, CONTEXT_VAR)
+        self.assertTrue(flash(self.request)[CONTEXT_VAR] is EMPTY_FLASH)
+        self.assertTrue(flash(HttpRequest())[CONTEXT_VAR] is EMPTY_FLASH)
+
     def test_expose_invalid_flash(self):
         """FlashContextProcessor: should fail when exposing an invalid object as being the flash.
         """
         self.request.flash = 'Invalid object'
         self.assertRaises(SuspiciousOperation, flash, self.request)
+
+
+class LazyFlashContextProcessorTestCase(TestCase):
+    """Tests the context processor that lazily exposes the flash to view
+    templates.
+    """
+    def setUp(self):
+        self.request = HttpRequest()
+        self.scope = FlashScope()
+        self.scope['message'] = 'Message'
+        setattr(self.request, CONTEXT_VAR, self.scope)
+
+    def test_expose_flash(self):
+        """LazyFlashContextProcessor: should expose a proxy to the flash.
+        """
+        proxy = lazy_flash(self.request)[CONTEXT_VAR]
+        self.assertTrue(isinstance(proxy, FlashScope))
+        self.assertEqual(1, len(proxy))
+        self.assertTrue('message' in proxy)
+        self.assertEqual('Message', proxy['message'])
+        self.assertEqual('Message', proxy.get('message'))
+
+    def test_expose_inexistent_flash(self):
+        """LazyFlashContextProcessor: should expose the shared empty flash when there's no flash available.
+        """
+        delattr(self.request, CONTEXT_VAR)
+        proxy = lazy_flash(self.request)[CONTEXT_VAR]
+        self.assertEqual(0, len(proxy))
+        self.assertTrue(proxy._resolve() is EMPTY_FLASH)
+
+    def test_expose_invalid_flash(self):
+        """LazyFlashContextProcessor: should fail only when an invalid flash is actually used.
+        """
+        self.request.flash = 'Invalid object'
+        proxy = lazy_flash(self.request)[CONTEXT_VAR]
+        self.assertRaises(SuspiciousOperation, lambda: proxy['message'])
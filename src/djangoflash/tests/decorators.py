@@ -7,82 +7,163 @@ from unittest import TestCase
 
 from django.http import HttpRequest
 
-from djangoflash.decorators import keep_messages
+from djangoflash.decorators import keep_messages, no_flash, flash_required, \
+    NoFlashMixin, FlashRequiredMixin, NO_FLASH_ATTR, FLASH_REQUIRED_ATTR, \
+    KEEP_MESSAGES_ATTR
+from djangoflash.middleware import _update_flash
 from djangoflash.models import FlashScope
 
 
 # Only exports test cases
-__all__ = ['KeepMessagesDecoratorTestCase']
+__all__ = ['KeepMessagesDecoratorTestCase', 'FlashModeDecoratorsTestCase']
 
 
 def view_method(request):
     """Function that simulates a Django view.
     """
-    if hasattr(request, 'flash'):
-        request.flash.update()
-        return True
-    return False
+    return hasattr(request, 'flash')
+
+def _new_view_method():
+    """Returns a new function that simulates a Django view.
+    """
+    def _view_method(request):
+        return view_method(request)
+    return _view_method
 
 
 class KeepMessagesDecoratorTestCase(TestCase):
     """Tests the keep_messages decorator.
     """
     def setUp(self):
-        """Create a request with an used message inside the flash.
+        """Create a request with a message inside the flash.
         """
         self.request = HttpRequest()
         self.request.flash = self.flash = FlashScope()
         self.flash['message'] = 'Message'
+
+    def _assert_kept(self, view):
+        """Asserts that the message is not expired when the middleware
+        processes the given view.
+        """
+        _update_flash(self.flash, view)
+        self.assertEqual('Message', self.flash['message'])
         self.flash.update()
+        self.assertEqual('Message', self.flash['message'])
+        self.flash.update()
+        self.assertFalse('message' in self.flash)
 
     def test_decorator_with_no_flash(self):
         """Decorators: keep_messages should not break when there's no flash scope attached to the request.
         """
-        self.request = HttpRequest()
-        view = keep_messages(view_method)
-        self.assertFalse(view(self.request))
+        view = keep_messages(_new_view_method())
+        self.assertFalse(view(HttpRequest()))
 
-    def test_decorator_with_no_args(self):
-        """Decorators: keep_messages with no args should avoid the removal of all flash-scoped values. 
+    def test_decorator_does_not_touch_flash(self):
+        """Decorators: keep_messages should neither change the view nor touch the flash.
         """
-        view = keep_messages(view_method)
-        self.assertEqual('Message', self.flash['message'])
-
+        view_method = _new_view_method()
+        view = keep_messages('message')(view_method)
+        self.assertFalse(view is view_method)
+        self.assertFalse(hasattr(view_method, KEEP_MESSAGES_ATTR))
+        self.assertEqual(('message',), getattr(view, KEEP_MESSAGES_ATTR))
         self.assertTrue(view(self.request))
-        self.assertEqual('Message', self.flash['message'])
+        self.assertEqual({}, self.flash.to_dict()['_used'])
 
-        view_method(self.request)
+    def test_shared_view(self):
+        """Decorators: keep_messages should only affect the decorated view.
+        """
+        view = keep_messages('message')(view_method)
+        self.assertFalse(hasattr(view_method, KEEP_MESSAGES_ATTR))
+        self.assertEqual(('message',), getattr(view, KEEP_MESSAGES_ATTR))
+        _update_flash(self.flash, view_method)
+        self.flash.update()
         self.assertFalse('message' in self.flash)
 
+    def test_decorator_with_no_args(self):
+        """Decorators: keep_messages with no args should avoid the removal of all flash-scoped values. 
+        """
+        view = keep_messages(_new_view_method())
+        self.assertEqual((), getattr(view, KEEP_MESSAGES_ATTR))
+        self._assert_kept(view)
+
     def test_decorator_with_empty_args(self):
         """Decorators: keep_messages with empty args should avoid the removal of all flash-scoped values. 
         """
-        view = keep_messages()(view_method)
-        self.assertEqual('Message', self.flash['message'])
-
-        self.assertTrue(view(self.request))
-        self.assertEqual('Message', self.flash['message'])
-
-        view_method(self.request)
-        self.assertFalse('message' in self.flash)
+        view = keep_messages()(_new_view_method())
+        self.assertEqual((), getattr(view, KEEP_MESSAGES_ATTR))
+        self._assert_kept(view)
 
     def test_decorator_with_args(self):
         """Decorators: keep_messages should avoid the removal of specific flash-scoped values.
         """
-        view = keep_messages('message', 'another_message')(view_method)
-        self.assertEqual('Message', self.flash['message'])
-
-        self.assertTrue(view(self.request))
-        self.assertEqual('Message', self.flash['message'])
-
-        view_method(self.request)
-        self.assertFalse('message' in self.flash)
+        view = keep_messages('message', 'another_message')(_new_view_method())
+        self._assert_kept(view)
 
     def test_decorator_with_invalid_arg(self):
         """Decorators: keep_messages should not avoid the removal of flash-scoped values.
         """
-        view = keep_messages('another_message')(view_method)
+        view = keep_messages('another_message')(_new_view_method())
+        _update_flash(self.flash, view)
         self.assertEqual('Message', self.flash['message'])
-
-        self.assertTrue(view(self.request))
+        self.flash.update()
         self.assertFalse('message' in self.flash)
+
+
+class View(object):
+    """Class that simulates a Django class-based view.
+    """
+    @classmethod
+    def as_view(cls):
+        def view(request):
+            return True
+        return view
+
+    def method_view(self, request):
+        return True
+
+
+class FlashModeDecoratorsTestCase(TestCase):
+    """Tests the no_flash and flash_required decorators and mixins.
+    """
+    def test_no_flash(self):
+        """Decorators: no_flash should mark a wrapper, not the view itself.
+        """
+        view_method = _new_view_method()
+        view = no_flash(view_method)
+        self.assertTrue(getattr(view, NO_FLASH_ATTR))
+        self.assertFalse(hasattr(view_method, NO_FLASH_ATTR))
+        self.assertEqual(view_method.__name__, view.__name__)
+
+    def test_flash_required(self):
+        """Decorators: flash_required should mark a wrapper, not the view itself.
+        """
+        view_method = _new_view_method()
+        view = flash_required(view_method)
+        self.assertTrue(getattr(view, FLASH_REQUIRED_ATTR))
+        self.assertFalse(hasattr(view_method, FLASH_REQUIRED_ATTR))
+
+    def test_stacked_decorators(self):
+        """Decorators: wrappers should keep the marks of other decorators.
+        """
+        view = keep_messages('message')(flash_required(_new_view_method()))
+        self.assertTrue(getattr(view, FLASH_REQUIRED_ATTR))
+        self.assertEqual(('message',), getattr(view, KEEP_MESSAGES_ATTR))
+
+    def test_decorate_method(self):
+        """Decorators: no_flash should support views that don't support attributes.
+        """
+        view = no_flash(View().method_view)
+        self.assertTrue(getattr(view, NO_FLASH_ATTR))
+        self.assertTrue(view(HttpRequest()))
+
+    def test_mixins(self):
+        """Decorators: mixins should mark class-based views.
+        """
+        class NoFlashView(NoFlashMixin, View):
+            pass
+        class FlashRequiredView(FlashRequiredMixin, View):
+            pass
+        self.assertTrue(getattr(NoFlashView.as_view(), NO_FLASH_ATTR))
+        self.assertTrue(getattr(FlashRequiredView.as_view(), \
+            FLASH_REQUIRED_ATTR))
+        self.assertFalse(hasattr(View.as_view(), NO_FLASH_ATTR))
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""djangoflash.i18n test cases.
+"""
+
+from unittest import TestCase
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from django.template import Context, Template
+from django.utils import translation
+
+from djangoflash import i18n
+from djangoflash.codec import json_typed_impl
+from djangoflash.context_processors import CONTEXT_VAR
+from djangoflash.i18n import Message
+from djangoflash.models import FlashScope
+
+
+# Only exports test cases
+__all__ = ['MessageTestCase']
+
+
+class MessageTestCase(TestCase):
+    """Tests the translatable messages.
+    """
+    def setUp(self):
+        """Activates a language other than English.
+        """
+        translation.activate('pt-br')
+
+    def tearDown(self):
+        """Restores the default language.
+        """
+        translation.deactivate()
+
+    def test_translate(self):
+        """Message: should be translated to the active language.
+        """
+        message = Message('Yes')
+        self.assertEqual(u'Sim', unicode(message))
+        translation.activate('en')
+        self.assertEqual(u'Yes', unicode(message))
+
+    def test_format(self):
+        """Message: should be formatted with its parameters.
+        """
+        self.assertEqual(u'Sim, Jo\xe3o', unicode(Message(
+            '%(answer)s, %(name)s', {'answer': 'Sim', 'name': u'Jo\xe3o'})))
+        self.assertEqual('100%', str(Message('%d%%', 100)))
+
+    def test_translation_cached(self):
+        """Message: translations should be cached by message id and language.
+        """
+        unicode(Message('No'))
+        self.assertEqual(u'N\xe3o', i18n._translations.get(('No', 'pt-br')))
+
+    def test_equal(self):
+        """Message: messages with the same id and parameters should be equal.
+        """
+        self.assertEqual(Message('Yes', {'a': 1}), Message('Yes', {'a': 1}))
+        self.assertNotEqual(Message('Yes', {'a': 1}), Message('Yes'))
+        self.assertNotEqual(Message('Yes'), 'Yes')
+
+    def test_pickle(self):
+        """Message: should be pickled as its id and parameters.
+        """
+        for message in (Message('Yes'), Message('%(a)s', {'a': 1})):
+            dump = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+            self.assertEqual(message, pickle.loads(dump))
+            self.assertFalse('msgid' in dump)
+
+    def test_typed_codec(self):
+        """Message: should be encoded by the typed JSON-based codec.
+        """
+        codec = json_typed_impl.CodecClass()
+        flash = FlashScope()
+        flash['message'] = Message('Yes')
+        flash.add('error', Message('%(a)s', {'a': 1}))
+        encoded = codec.encode(flash)
+        self.assertTrue('{"~m":["Yes"]}' in encoded)
+        self.assertEqual(flash.to_dict(), codec.decode(encoded).to_dict())
+
+    def test_render(self):
+        """Message: should be translated when rendered by a template.
+        """
+        flash = FlashScope()
+        flash['message'] = Message('Yes')
+        template = Template('{{ flash.message }}')
+        self.assertEqual(u'Sim', template.render(Context({CONTEXT_VAR: flash})))
+        translation.activate('en')
+        self.assertEqual(u'Yes', template.render(Context({CONTEXT_VAR: flash})))
@@ -3,9 +3,19 @@
 """djangoflash.models test cases.
 """
 
+import time
+from copy import deepcopy
 from unittest import TestCase
 
-from djangoflash.models import FlashScope, _SESSION_KEY, _USED_KEY
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from django.conf import settings
+
+from djangoflash.models import EMPTY_FLASH, FlashScope, _SESSION_KEY, \
+    _USED_KEY, _EXPIRES_KEY
 
 
 class FlashScopeTestCase(TestCase):
@@ -212,6 +222,20 @@ class FlashScopeTestCase(TestCase):
         self.flash.update()
         self.assertFalse('info' in self.flash)
 
+    def test_update_with_keep(self):
+        """FlashScope: Should not mark the kept values for removal when updating.
+        """
+        self.flash['error'] = 'Error'
+        self.flash.update(keep=('info', 'warning'))
+        self.assertEqual({'error': None}, self.flash.to_dict()[_USED_KEY])
+        self.flash.update(keep=('info', 'error'))
+        self.assertEqual('Info', self.flash['info'])
+        self.assertFalse('error' in self.flash)
+        self.flash.update()
+        self.assertEqual('Info', self.flash['info'])
+        self.flash.update()
+        self.assertFalse('info' in self.flash)
+
     def test_keep_all(self):
         """FlashScope: Should avoid the removal of all values.
         """
@@ -253,6 +277,23 @@ class FlashScopeTestCase(TestCase):
         data = self.flash.to_dict()
         self.assertEqual(expected_data, data)
 
+    def test_persistent(self):
+        """FlashScope: Should return a new flash without used and immediate values.
+        """
+        self.flash.update()
+        self.flash['error'] = 'Error'
+        self.flash.now['warning'] = 'Warning'
+        persistent = self.flash.persistent()
+        expected_data = {_SESSION_KEY: {'error': 'Error'}, _USED_KEY: {}}
+        self.assertEqual(expected_data, persistent.to_dict())
+        self.assertEqual(3, len(self.flash))
+
+    def test_persistent_empty(self):
+        """FlashScope: Should return an empty flash if all values were used.
+        """
+        self.flash.discard()
+        self.assertEqual(0, len(self.flash.persistent()))
+
     def test_to_dict_immutability(self):
         """FlashScope: Should export a copy of the flash data as a dict.
         """
@@ -261,6 +302,316 @@ class FlashScopeTestCase(TestCase):
         self.assertEqual('Info', data[_SESSION_KEY]['info'])
 
 
+class DeferredFlashScopeTestCase(TestCase):
+    """Tests flashes whose contents are retrieved when first needed.
+    """
+    def setUp(self):
+        """Create a flash to be returned by the loader.
+        """
+        self.loaded = FlashScope()
+        self.loaded['info'] = 'Info'
+        self.calls = 0
+
+    def _loader(self):
+        self.calls += 1
+        return self.loaded
+
+    def test_not_loaded(self):
+        """DeferredFlashScope: Should not load the flash until it's needed.
+        """
+        flash = FlashScope.deferred(self._loader)
+        self.assertFalse(flash.is_loaded())
+        self.assertEqual(0, self.calls)
+        self.assertFalse(hasattr(flash, 'missing_attribute'))
+        self.assertEqual(0, self.calls)
+
+    def test_load(self):
+        """DeferredFlashScope: Should load the flash only once, when it's needed.
+        """
+        flash = FlashScope.deferred(self._loader)
+        self.assertEqual('Info', flash['info'])
+        self.assertTrue(flash.is_loaded())
+        flash.update()
+        flash['error'] = 'Error'
+        self.assertEqual(2, len(flash))
+        self.assertEqual(1, self.calls)
+
+    def test_load_nothing(self):
+        """DeferredFlashScope: Should be empty when there's nothing to load.
+        """
+        flash = FlashScope.deferred(lambda: None)
+        self.assertEqual(0, len(flash))
+        self.assertTrue(flash.is_loaded())
+        flash['info'] = 'Info'
+        self.assertEqual('Info', flash['info'])
+
+    def test_deferred_update(self):
+        """DeferredFlashScope: Should only be updated when it's loaded.
+        """
+        flash = FlashScope.deferred(self._loader)
+        flash.update()
+        self.assertEqual(0, self.calls)
+        self.assertFalse(flash.is_loaded())
+        self.assertTrue(flash.is_touched())
+        self.assertEqual('Info', flash['info'])
+        flash.update()
+        self.assertFalse('info' in flash)
+
+    def test_deferred_update_keep_all(self):
+        """DeferredFlashScope: Should keep every value if asked to.
+        """
+        flash = FlashScope.deferred(self._loader)
+        flash.update(keep=True)
+        flash.update()
+        self.assertEqual('Info', flash['info'])
+        self.assertFalse(FlashScope.deferred(self._loader).is_touched())
+
+
+class PickledFlashScopeTestCase(TestCase):
+    """Tests the pickled representation of the flash.
+    """
+    def setUp(self):
+        """Create a flash holding a used and an unused value.
+        """
+        self.flash = FlashScope()
+        self.flash['info'] = 'Info'
+        self.flash.update()
+        self.flash['error'] = 'Error'
+
+    def _pickled(self, flash):
+        """Pickles and unpickles the given flash.
+        """
+        return pickle.loads(pickle.dumps(flash, pickle.HIGHEST_PROTOCOL))
+
+    def test_pickle(self):
+        """FlashScope: Pickled flash should keep its values and their status.
+        """
+        flash = self._pickled(self.flash)
+        self.assertEqual(self.flash.to_dict(), flash.to_dict())
+        self.assertTrue(flash.now.delegate is flash)
+        flash.update()
+        self.assertEqual(['error'], flash.keys())
+
+    def test_pickle_all_protocols(self):
+        """FlashScope: Flash should be pickled with any protocol.
+        """
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            flash = pickle.loads(pickle.dumps(self.flash, protocol))
+            self.assertEqual(self.flash.to_dict(), flash.to_dict())
+
+    def test_pickle_compact(self):
+        """FlashScope: Pickled flash should not include the immediate values adapter.
+        """
+        dump = pickle.dumps(self.flash, pickle.HIGHEST_PROTOCOL)
+        self.assertFalse('_ImmediateFlashScopeAdapter' in dump)
+        self.assertFalse('_session' in dump)
+
+    def test_pickle_deferred(self):
+        """FlashScope: Deferred flash should be loaded before being pickled.
+        """
+        flash = self._pickled(FlashScope.deferred(lambda: self.flash))
+        self.assertTrue(flash.is_loaded())
+        self.assertEqual(self.flash.to_dict(), flash.to_dict())
+
+    def test_copy(self):
+        """FlashScope: Copied flash should not share its values with the original one.
+        """
+        flash = deepcopy(self.flash)
+        flash['error'] = 'Another error'
+        self.assertEqual('Error', self.flash['error'])
+        self.assertTrue(flash.now.delegate is flash)
+
+
+class ExpiringFlashScopeTestCase(TestCase):
+    """Tests the values that expire after some time.
+    """
+    def setUp(self):
+        """Create a flash holding a value that never expires.
+        """
+        self.flash = FlashScope()
+        self.flash['info'] = 'Info'
+
+    def tearDown(self):
+        """Removes the max age setting, if any.
+        """
+        if hasattr(settings, 'FLASH_MAX_AGE'):
+            del settings.FLASH_MAX_AGE
+
+    def test_no_max_age(self):
+        """FlashScope: Values should not expire by default.
+        """
+        self.assertEqual(None, self.flash.expires_at())
+        self.assertFalse(_EXPIRES_KEY in self.flash.to_dict())
+
+    def test_set_max_age(self):
+        """FlashScope: Values should expire after the given max age.
+        """
+        self.flash.set_max_age('info', 60)
+        deadline = self.flash.expires_at()
+        self.assertTrue(time.time() < deadline <= time.time() + 60)
+        self.flash['error'] = 'Error'
+        self.assertEqual(None, self.flash.expires_at())
+        self.flash.set_max_age('error', 120)
+        self.assertTrue(deadline < self.flash.expires_at())
+        self.flash.set_max_age('error', None)
+        self.assertEqual(None, self.flash.expires_at())
+        self.assertRaises(KeyError, self.flash.set_max_age, 'warning', 60)
+
+    def test_default_max_age(self):
+        """FlashScope: Values should expire after FLASH_MAX_AGE seconds.
+        """
+        settings.FLASH_MAX_AGE = 60
+        self.flash['error'] = 'Error'
+        self.assertEqual(None, self.flash.expires_at())
+        self.flash['info'] = 'Info'
+        self.assertTrue(time.time() < self.flash.expires_at())
+
+    def test_remove_expired(self):
+        """FlashScope: Expired values should be removed when the flash is restored.
+        """
+        self.flash['error'] = 'Error'
+        self.flash.set_max_age('info', -1)
+        self.flash.set_max_age('error', 60)
+        flash = FlashScope(self.flash.to_dict())
+        self.assertEqual(['error'], flash.keys())
+        self.assertEqual(['error'], flash.to_dict()[_EXPIRES_KEY].keys())
+
+    def test_remove_expired_pickled(self):
+        """FlashScope: Expired values should be removed when the flash is unpickled.
+        """
+        self.flash['error'] = 'Error'
+        self.flash.set_max_age('info', -1)
+        flash = pickle.loads(pickle.dumps(self.flash, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(['error'], flash.keys())
+
+    def test_persistent(self):
+        """FlashScope: Expiration times of the persistent values should be kept.
+        """
+        self.flash.set_max_age('info', 60)
+        self.assertEqual(self.flash.expires_at(),
+                         self.flash.persistent().expires_at())
+
+    def test_remove_value(self):
+        """FlashScope: Expiration times should be removed along with their values.
+        """
+        self.flash.set_max_age('info', 60)
+        del self.flash['info']
+        self.assertEqual({}, self.flash._expires)
+        self.flash['info'] = 'Info'
+        self.flash.set_max_age('info', 60)
+        self.flash.pop('info')
+        self.assertEqual({}, self.flash._expires)
+
+
+class MergedFlashScopeTestCase(TestCase):
+    """Tests the merging of flashes written by concurrent requests.
+    """
+    def setUp(self):
+        """Create the flash both flashes were derived from.
+        """
+        self.base = FlashScope()
+        self.base['info'] = 'Info'
+        self.base['messages'] = ['First']
+
+    def _derived(self):
+        """Returns a copy of the base flash.
+        """
+        return FlashScope(deepcopy(self.base.to_dict()))
+
+    def _merged(self, mine, theirs):
+        """Merges the given flashes, returning the result as a dict.
+        """
+        return dict(mine.merged(self.base, theirs).items())
+
+    def test_merge_unchanged(self):
+        """FlashScope: Merging unchanged flashes should return the base flash.
+        """
+        self.assertEqual(dict(self.base.items()),
+                         self._merged(self._derived(), self._derived()))
+
+    def test_merge_changes(self):
+        """FlashScope: Values changed by a single flash should be merged.
+        """
+        mine, theirs = self._derived(), self._derived()
+        mine['error'] = 'Error'
+        del mine['messages']
+        theirs['info'] = 'Another info'
+        self.assertEqual({'info': 'Another info', 'error': 'Error'},
+                         self._merged(mine, theirs))
+
+    def test_merge_conflict(self):
+        """FlashScope: Values changed by both flashes should be taken from the first one.
+        """
+        mine, theirs = self._derived(), self._derived()
+        mine['info'] = 'Mine'
+        del theirs['info']
+        self.assertEqual('Mine', self._merged(mine, theirs)['info'])
+        mine['info'], theirs['info'] = 'Mine', 'Theirs'
+        self.assertEqual('Mine', self._merged(mine, theirs)['info'])
+
+    def test_merge_appended(self):
+        """FlashScope: Items appended to a list by both flashes should be kept.
+        """
+        mine, theirs = self._derived(), self._derived()
+        mine.add('messages', 'Mine')
+        theirs.add('messages', 'Theirs')
+        mine.add('warnings', 'Mine')
+        theirs.add('warnings', 'Theirs')
+        merged = self._merged(mine, theirs)
+        self.assertEqual(['First', 'Mine', 'Theirs'], merged['messages'])
+        self.assertEqual(['Mine', 'Theirs'], merged['warnings'])
+
+    def test_merge_expiration_times(self):
+        """FlashScope: Expiration times should be merged along with their values.
+        """
+        mine, theirs = self._derived(), self._derived()
+        theirs['error'] = 'Error'
+        theirs.set_max_age('error', 60)
+        mine.add('messages', 'Mine')
+        mine.set_max_age('messages', 60)
+        theirs.add('messages', 'Theirs')
+        merged = mine.merged(self.base, theirs)
+        self.assertEqual(theirs._expires['error'], merged._expires['error'])
+        self.assertFalse('messages' in merged._expires)
+
+    def test_copy(self):
+        """FlashScope: Changing a copy should not change the original flash.
+        """
+        copy = self.base.copy()
+        copy.add('messages', 'Second')
+        copy['info'] = 'Changed'
+        self.assertEqual(['First'], self.base['messages'])
+        self.assertEqual('Info', self.base['info'])
+
+
+class ImmutableFlashScopeTestCase(TestCase):
+    """Tests the shared empty flash.
+    """
+    def test_empty(self):
+        """EmptyFlash: Should be an empty flash.
+        """
+        self.assertTrue(isinstance(EMPTY_FLASH, FlashScope))
+        self.assertEqual(0, len(EMPTY_FLASH))
+        self.assertFalse('info' in EMPTY_FLASH)
+        EMPTY_FLASH.update()
+        EMPTY_FLASH.keep()
+
+    def test_immutable(self):
+        """EmptyFlash: Should not be modified.
+        """
+        def _set_now():
+            EMPTY_FLASH.now['info'] = 'Info'
+        def _set():
+            EMPTY_FLASH['info'] = 'Info'
+        self.assertRaises(TypeError, _set)
+        self.assertRaises(TypeError, _set_now)
+        self.assertRaises(TypeError, EMPTY_FLASH.add, 'info', 'Info')
+        self.assertRaises(TypeError, EMPTY_FLASH.put, info='Info')
+        self.assertRaises(TypeError, EMPTY_FLASH.discard, 'info')
+        self.assertRaises(TypeError, EMPTY_FLASH.clear)
+        self.assertEqual(0, len(EMPTY_FLASH))
+
+
 class ImmediateFlashScope(TestCase):
     """Tests the ``Flashscope.now``.
     """
@@ -320,6 +671,74 @@ class ImmediateFlashScope(TestCase):
         self.assertEqual(['Error 1', 'Error 2', 'Error 3', 'Error 4'], self.flash['error'])
 
 
+class ImmediateValuesStorageTestCase(TestCase):
+    """Tests that immediate values are kept apart from regular values.
+    """
+    def setUp(self):
+        """Create a FlashScope object to be used by the test methods.
+        """
+        self.flash = FlashScope()
+        self.flash['info'] = 'Info'
+        self.flash.now['error'] = 'Error'
+
+    def test_len(self):
+        """FlashScope.now: "len(flash.now)" should return the number of immediate values.
+        """
+        self.assertEqual(2, len(self.flash))
+        self.assertEqual(1, len(self.flash.now))
+
+    def test_items(self):
+        """FlashScope.now: Immediate values should be listed along with regular values.
+        """
+        self.assertEqual(['error', 'info'], sorted(self.flash.keys()))
+        self.assertEqual(['Error', 'Info'], sorted(self.flash.values()))
+        self.assertEqual([('error', 'Error'), ('info', 'Info')], \
+            sorted(self.flash.iteritems()))
+        self.assertEqual('Error', self.flash.get('error'))
+
+    def test_to_dict(self):
+        """FlashScope.now: Immediate values should not be exported.
+        """
+        expected_data = {_SESSION_KEY: {'info': 'Info'}, _USED_KEY: {}}
+        self.assertEqual(expected_data, self.flash.to_dict())
+
+    def test_pickle(self):
+        """FlashScope.now: Immediate values should not be pickled.
+        """
+        flash = pickle.loads(pickle.dumps(self.flash, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual('Info', flash['info'])
+        self.assertFalse('error' in flash)
+        flash.now['error'] = 'Error'
+        self.assertEqual('Error', flash['error'])
+
+    def test_discard(self):
+        """FlashScope.now: Discarding the flash should not affect immediate values.
+        """
+        self.flash.discard()
+        self.assertEqual({'info': None}, self.flash.to_dict()[_USED_KEY])
+        self.assertEqual('Error', self.flash['error'])
+
+    def test_keep(self):
+        """FlashScope.now: Keeping an immediate value should make it a regular value.
+        """
+        self.flash.keep('error')
+        self.assertEqual(0, len(self.flash.now))
+        self.flash.update()
+        self.assertEqual('Error', self.flash['error'])
+
+    def test_pop(self):
+        """FlashScope.now: Should pop an immediate value from the flash scope.
+        """
+        self.assertEqual('Error', self.flash.pop('error'))
+        self.assertFalse('error' in self.flash)
+
+    def test_clear(self):
+        """FlashScope.now: flash.clear() should remove immediate values too.
+        """
+        self.flash.clear()
+        self.assertEqual(0, len(self.flash))
+
+
 class MixedFlashScope(TestCase):
     """Tests mixing regular and immediate values.
     """
@@ -3,13 +3,30 @@
 """djangoflash.storage test cases.
 """
 
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
 from unittest import TestCase
 
+from django.conf import settings
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
 from django.http import HttpRequest, HttpResponse
 
+from djangoflash.codec import codec
 from djangoflash.models import FlashScope
 from djangoflash import storage
-from djangoflash.storage import session, cookie
+from djangoflash.storage import session, cookie, shm, database, file
+from djangoflash.storage.keyvalue import KeyValueFlashStorage, \
+    new_client_id
+from djangoflash.storage import writebehind
+from djangoflash.storage.cached import CachedFlashStorage, VERSION_COOKIE
+from djangoflash.storage.db.models import StoredFlash
+from djangoflash.storage.writebehind import WriteBehindQueue
 
 
 class StorageTestCase(TestCase):
@@ -28,6 +45,12 @@ class StorageTestCase(TestCase):
         storage_impl = storage.get_storage('cookie')
         self.assertTrue(isinstance(storage_impl, cookie.FlashStorageClass))
 
+    def test_get_shm_storage_by_alias(self):
+        """Storage: 'shm' should resolve to shared memory flash storage.
+        """
+        storage_impl = storage.get_storage('shm')
+        self.assertTrue(isinstance(storage_impl, shm.FlashStorageClass))
+
     def test_get_storage_by_module_name(self):
         """Storage: 'djangoflash.storage.cookie' should resolve to cookie flash storage.
         """
@@ -107,6 +130,57 @@ class SessionFlashStorageTestCase(TestCase):
         self.storage.set(self.flash, self.request, self.response)
         self.assertEqual('Message', self.storage.get(self.request)['message'])
 
+    def test_buckets(self):
+        """SessionStorage: each bucket should be stored under its own key.
+        """
+        self.flash['message'] = 'Message'
+        self.storage.set(self.flash, self.request, self.response)
+        setattr(self.request, storage.BUCKET_ATTR, 'abcd_-12')
+        self.assertEqual(None, self.storage.get(self.request))
+
+        self.flash = FlashScope()
+        self.flash['message'] = 'Another message'
+        self.storage.set(self.flash, self.request, self.response)
+        self.assertEqual(2, len(self.request.session))
+        self.assertEqual('Another message',
+                         self.storage.get(self.request)['message'])
+
+        delattr(self.request, storage.BUCKET_ATTR)
+        self.assertEqual('Message', self.storage.get(self.request)['message'])
+
+    def test_expired_buckets_removed(self):
+        """SessionStorage: expired buckets should be removed when the flash is stored.
+        """
+        self.storage.buckets = True
+        for bucket, max_age in (('abcd_-12', -1), ('abcd_-34', 60),
+                                ('abcd_-56', None)):
+            setattr(self.request, storage.BUCKET_ATTR, bucket)
+            flash = FlashScope()
+            flash['message'] = 'Message'
+            flash.set_max_age('message', max_age)
+            self.storage.set(flash, self.request, self.response)
+        self.assertEqual(['_djflash_buckets', '_djflash_session:abcd_-34',
+                          '_djflash_session:abcd_-56'],
+                         sorted(self.request.session.keys()))
+        self.assertEqual(['_djflash_session:abcd_-34',
+                          '_djflash_session:abcd_-56'],
+                         self.request.session['_djflash_buckets'])
+
+        # The tracked keys are removed along with the last bucket
+        for bucket in ('abcd_-34', 'abcd_-56'):
+            setattr(self.request, storage.BUCKET_ATTR, bucket)
+            self.storage.set(FlashScope(), self.request, self.response)
+        self.assertEqual([], self.request.session.keys())
+
+    def test_buckets_disabled(self):
+        """SessionStorage: buckets should not be tracked or removed when they're disabled.
+        """
+        self.request.session['_djflash_session:abcd_-12'] = FlashScope()
+        self.flash['message'] = 'Message'
+        self.storage.set(self.flash, self.request, self.response)
+        self.assertEqual(['_djflash_session', '_djflash_session:abcd_-12'],
+                         sorted(self.request.session.keys()))
+
 
 class CookieFlashStorageTestCase(TestCase):
     """Tests the cookie-based flash storage class.
@@ -118,12 +192,21 @@ class CookieFlashStorageTestCase(TestCase):
         self.response = HttpResponse('')
         self.flash = FlashScope()
         self.storage = cookie.FlashStorageClass()
+        self.records = []
+        self.handler = logging.Handler()
+        self.handler.emit = self.records.append
+        cookie.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        """Removes the handler used to record the log messages.
+        """
+        cookie.logger.removeHandler(self.handler)
 
     def _transfer_cookies_from_response_to_request(self):
         """Transfers the cookies set in the response to the request.
         """
-        for key, cookie in self.response.cookies.items():
-            self.request.COOKIES[key] = cookie.value
+        for key, morsel in self.response.cookies.items():
+            self.request.COOKIES[key] = morsel.value
 
     def _get_cookie(self):
         """Returns the cookie used to store the flash contents.
@@ -179,3 +262,969 @@ class CookieFlashStorageTestCase(TestCase):
         # Simulates a request-response cycle
         self._transfer_cookies_from_response_to_request()
         self.assertEqual('Message', self.storage.get(self.request)['message'])
+
+    def test_buckets(self):
+        """CookieStorage: each bucket should be stored in its own cookie.
+        """
+        setattr(self.request, storage.BUCKET_ATTR, 'abcd_-12')
+        self.flash['message'] = 'Message'
+        self.storage.set(self.flash, self.request, self.response)
+        self.assertEqual(['_djflash_cookie_abcd_-12'],
+                         self.response.cookies.keys())
+
+        self._transfer_cookies_from_response_to_request()
+        self.assertEqual('Message', self.storage.get(self.request)['message'])
+        delattr(self.request, storage.BUCKET_ATTR)
+        self.assertEqual(None, self.storage.get(self.request))
+
+    def test_get_cached(self):
+        """CookieStorage: should decode the same cookie only once.
+        """
+        self.flash['message'] = 'Message'
+        self.storage.set(self.flash, self.request, self.response)
+        self._transfer_cookies_from_response_to_request()
+
+        self.assertEqual('Message', self.storage.get(self.request)['message'])
+        self.assertEqual('Message', self.storage.get(self.request)['message'])
+        stats = self.storage.cache.stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+
+    def test_get_cached_copy(self):
+        """CookieStorage: changes to a flash should not affect the cached one.
+        """
+        self.flash.add('message', 'Message 1')
+        self.storage.set(self.flash, self.request, self.response)
+        self._transfer_cookies_from_response_to_request()
+
+        flash = self.storage.get(self.request)
+        flash['message'].append('Message 2')
+        flash['error'] = 'Error'
+        flash.update()
+
+        flash = self.storage.get(self.request)
+        self.assertEqual(['Message 1'], flash['message'])
+        self.assertFalse('error' in flash)
+        flash.update()
+        self.assertTrue('message' in flash)
+
+    def test_get_cache_disabled(self):
+        """CookieStorage: should not cache flashes if the cache size is 0.
+        """
+        self.storage.cache.max_size = 0
+        self.flash['message'] = 'Message'
+        self.storage.set(self.flash, self.request, self.response)
+        self._transfer_cookies_from_response_to_request()
+
+        self.assertEqual('Message', self.storage.get(self.request)['message'])
+        self.assertEqual('Message', self.storage.get(self.request)['message'])
+        self.assertEqual(0, self.storage.cache.stats()['hits'])
+        self.assertEqual(0, len(self.storage.cache))
+
+    def test_get_tampered(self):
+        """CookieStorage: should ignore tampered cookies.
+        """
+        self.flash['message'] = 'Message'
+        self.storage.set(self.flash, self.request, self.response)
+        self._transfer_cookies_from_response_to_request()
+        data = self.request.COOKIES[self.storage._key]
+        self.request.COOKIES[self.storage._key] = data.replace('e', 'f', 1)
+
+        self.assertEqual(None, self.storage.get(self.request))
+        self.assertEqual(1, len(self.storage.rejected))
+        self.assertEqual(0, len(self.storage.cache))
+
+    def test_get_malformed(self):
+        """CookieStorage: should ignore malformed cookies without checking their signature.
+        """
+        self.request.COOKIES[self.storage._key] = '<junk>'
+        self.assertEqual(None, self.storage.get(self.request))
+        self.assertEqual(0, len(self.storage.rejected))
+
+    def test_get_rejected_cached(self):
+        """CookieStorage: should not check the signature of recently rejected cookies.
+        """
+        self.request.COOKIES[self.storage._key] = 'A' * 64
+        self.assertEqual(None, self.storage.get(self.request))
+        cookie.codec.unsign = lambda data: self.fail()
+        try:
+            self.assertEqual(None, self.storage.get(self.request))
+        finally:
+            del cookie.codec.unsign
+
+    def test_rejected_cookies_logged(self):
+        """CookieStorage: should log the number of rejected cookies at most once per interval.
+        """
+        self.request.COOKIES[self.storage._key] = '<junk>'
+        for i in range(3):
+            self.storage.get(self.request)
+        self.assertEqual(1, len(self.records))
+        self.assertEqual('Rejected 1 invalid flash cookie(s)',
+                         self.records[0].getMessage())
+
+        self.storage.rejection_log.interval = 0
+        self.storage.get(self.request)
+        self.assertEqual(2, len(self.records))
+        self.assertEqual('Rejected 3 invalid flash cookie(s)',
+                         self.records[1].getMessage())
+
+    def test_rejected_cookie_cleared(self):
+        """CookieStorage: should remove rejected cookies.
+        """
+        self.request.COOKIES[self.storage._key] = '<junk>'
+        flash = self.storage.get(self.request) or FlashScope()
+        self.storage.set(flash.persistent(), self.request, self.response)
+        self.assertEqual(0, self._get_cookie()['max-age'])
+
+    def test_expiring_cookie(self):
+        """CookieStorage: the cookie should expire along with the flash.
+        """
+        self.flash['message'] = 'Message'
+        self.flash.set_max_age('message', 60)
+        self.storage.set(self.flash, self.request, self.response)
+        self.assertTrue(0 < self._get_cookie()['max-age'] <= 60)
+
+    def test_get_expired(self):
+        """CookieStorage: expired cookies should be ignored, but not logged.
+        """
+        self.flash['message'] = 'Message'
+        self.flash.set_max_age('message', -1)
+        self.storage.set(self.flash, self.request, self.response)
+        self._transfer_cookies_from_response_to_request()
+        self.assertEqual(None, self.storage.get(self.request))
+        self.assertEqual([], self.records)
+
+
+class ConcurrentWritesTestMixin(object):
+    """Tests how server-side storages that support compare-and-set handle
+    flashes written by concurrent requests.
+    """
+    def _store(self, **values):
+        """Stores a flash holding the given values. Returns its client id.
+        """
+        client_id = new_client_id()
+        self.storage.save(client_id, codec.pack(FlashScope(
+            {'_session': values, '_used': {}})), 60)
+        return client_id
+
+    def _load(self, client_id):
+        """Simulates a request that loads the flash of the given client.
+        Returns the request and the flash.
+        """
+        request = HttpRequest()
+        request.COOKIES[self.storage._key] = client_id
+        return request, self.storage.get(request)
+
+    def _stored(self, client_id):
+        """Returns the stored flash of the given client, as a dict.
+        """
+        data = self.storage.load(client_id)
+        if data is None:
+            return {}
+        return dict(codec.unpack(data).items())
+
+    def test_concurrent_changes(self):
+        """ServerSideStorage: changes made by concurrent requests should be merged.
+        """
+        client_id = self._store(info='Info')
+        first, first_flash = self._load(client_id)
+        second, second_flash = self._load(client_id)
+
+        first_flash['error'] = 'Error'
+        self.storage.set(first_flash.persistent(), first, HttpResponse(''))
+        second_flash['info'] = 'Another info'
+        self.storage.set(second_flash.persistent(), second, HttpResponse(''))
+        self.assertEqual({'info': 'Another info', 'error': 'Error'},
+                         self._stored(client_id))
+
+    def test_concurrent_appends(self):
+        """ServerSideStorage: values appended by concurrent requests should be kept.
+        """
+        client_id = self._store(messages=['First'])
+        first, first_flash = self._load(client_id)
+        second, second_flash = self._load(client_id)
+
+        first_flash.add('messages', 'Second')
+        self.storage.set(first_flash.persistent(), first, HttpResponse(''))
+        second_flash.add('messages', 'Third')
+        self.storage.set(second_flash.persistent(), second, HttpResponse(''))
+        self.assertEqual(['First', 'Third', 'Second'],
+                         self._stored(client_id)['messages'])
+
+    def test_concurrent_removal(self):
+        """ServerSideStorage: values added while the flash is emptied should be kept.
+        """
+        client_id = self._store(info='Info')
+        first, first_flash = self._load(client_id)
+        second, second_flash = self._load(client_id)
+
+        second_flash['error'] = 'Error'
+        self.storage.set(second_flash.persistent(), second, HttpResponse(''))
+        first_flash.update()
+        response = HttpResponse('')
+        self.storage.set(first_flash.persistent(), first, response)
+        self.assertEqual({'error': 'Error'}, self._stored(client_id))
+        self.assertFalse(self.storage._key in response.cookies)
+
+        # Nothing changed since the flash was loaded
+        first, first_flash = self._load(client_id)
+        first_flash.update()
+        self.storage.set(first_flash.persistent(), first, response)
+        self.assertEqual({}, self._stored(client_id))
+        self.assertFalse(self.storage._key in response.cookies)
+
+        # The client id is dropped once nothing is found
+        first, first_flash = self._load(client_id)
+        self.storage.set(first_flash or FlashScope(), first, response)
+        self.assertEqual(0, response.cookies[self.storage._key]['max-age'])
+
+    def test_overlapping_consume_and_add(self):
+        """ServerSideStorage: values added while an overlapping request empties the flash should keep their client id.
+        """
+        client_id = self._store(info='Info')
+        first, first_flash = self._load(client_id)
+        second, second_flash = self._load(client_id)
+
+        # The first request consumes the flash and is stored first
+        first_flash.update()
+        first_response = HttpResponse('')
+        stored = self.storage.set(first_flash.persistent(), first,
+                                  first_response)
+        self.assertFalse(stored)
+        second_flash['error'] = 'Error'
+        second_response = HttpResponse('')
+        stored = self.storage.set(second_flash.persistent(), second,
+                                  second_response)
+        self.assertEqual({'error': 'Error'}, dict(stored.items()))
+        self.assertEqual({'error': 'Error'}, self._stored(client_id))
+        self.assertFalse(self.storage._key in first_response.cookies)
+        self.assertFalse(self.storage._key in second_response.cookies)
+
+        # The request that adds values is stored first
+        first, first_flash = self._load(client_id)
+        second, second_flash = self._load(client_id)
+        second_flash['info'] = 'Info'
+        second_response = HttpResponse('')
+        self.storage.set(second_flash.persistent(), second, second_response)
+        first_flash.update()
+        first_response = HttpResponse('')
+        stored = self.storage.set(first_flash.persistent(), first,
+                                  first_response)
+        self.assertEqual({'info': 'Info'}, dict(stored.items()))
+        self.assertEqual({'info': 'Info'}, self._stored(client_id))
+        self.assertFalse(self.storage._key in first_response.cookies)
+        self.assertFalse(self.storage._key in second_response.cookies)
+
+    def test_cas(self):
+        """ServerSideStorage: data should only be replaced if its version matches.
+        """
+        client_id = new_client_id()
+        self.assertTrue(self.storage.cas(client_id, 'first', 60, None))
+        self.assertFalse(self.storage.cas(client_id, 'second', 60, None))
+        data, version = self.storage.load_versioned(client_id)
+        self.assertEqual('first', data)
+        self.assertTrue(self.storage.cas(client_id, 'second', 60, version))
+        self.assertFalse(self.storage.cas(client_id, None, 60, version))
+        data, version = self.storage.load_versioned(client_id)
+        self.assertTrue(self.storage.cas(client_id, None, 60, version))
+        self.assertEqual((None, None), self.storage.load_versioned(client_id))
+
+
+class ShmFlashStorageTestCase(TestCase, ConcurrentWritesTestMixin):
+    """Tests the shared memory-based flash storage class.
+    """
+    def setUp(self):
+        """Creates a shared memory-based flash storage for testing.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'flash')
+        self.request = HttpRequest()
+        self.response = HttpResponse('')
+        self.flash = FlashScope()
+        self.storage = shm.FlashStorageClass(self.path, 16, 256)
+        self.handler = logging.Handler()
+        self.handler.emit = lambda record: None
+        shm.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        """Removes the shared file.
+        """
+        shutil.rmtree(self.directory)
+        shm.logger.removeHandler(self.handler)
+
+    def _transfer_cookies_from_response_to_request(self):
+        """Transfers the cookies set in the response to the request.
+        """
+        for key, morsel in self.response.cookies.items():
+            self.request.COOKIES[key] = morsel.value
+
+    def _fork(self, function):
+        """Calls the given function in a child process. Returns the child's
+        process id.
+        """
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                function()
+                status = 0
+            finally:
+                os._exit(status)
+        return pid
+
+    def _wait(self, pid):
+        """Waits for the given child process, which should exit successfully.
+        """
+        self.assertEqual(0, os.waitpid(pid, 0)[1])
+
+    def test_set_empty_object(self):
+        """ShmStorage: should not store an empty object.
+        """
+        self.storage.set(self.flash, self.request, self.response)
+        self.assertEqual(0, len(self.response.cookies))
+
+    def test_get_empty(self):
+        """ShmStorage: should return nothing when empty.
+        """
+        self.assertEqual(None, self.storage.get(self.request))
+        self.request.COOKIES[self.storage._key] = new_client_id()
+        self.assertEqual(None, self.storage.get(self.request))
+        self.request.COOKIES[self.storage._key] = '../invalid'
+        self.assertEqual(None, self.storage.get(self.request))
+
+    def test_get(self):
+        """ShmStorage: should return the stored object.
+        """
+        self.flash['message'] = 'Message'
+        self.storage.set(self.flash, self.request, self.response)
+        self.assertEqual(None, self.storage.get(self.request))
+
+        # Simulates a request-response cycle
+        self._transfer_cookies_from_response_to_request()
+        self.assertEqual('Message', self.storage.get(self.request)['message'])
+
+        # The same client id is used from now on
+        self.response = HttpResponse('')
+        self.flash['message'] = 'Another message'
+        self.storage.set(self.flash, self.request, self.response)
+        self.assertEqual(0, len(self.response.cookies))
+        self.assertEqual('Another message',
+                         self.storage.get(self.request)['message'])
+
+    def test_buckets(self):
+        """ShmStorage: buckets should share the client id, but not the flash.
+        """
+        self.storage.buckets = True
+        self.flash['message'] = 'Message'
+        self.storage.set(self.flash, self.request, self.response)
+        self._transfer_cookies_from_response_to_request()
+        setattr(self.request, storage.BUCKET_ATTR, 'abcd_-12')
+        self.assertEqual(None, self.storage.get(self.request))
+
+        self.response = HttpResponse('')
+        self.flash['message'] = 'Another message'
+        self.storage.set(self.flash, self.request, self.response)
+        self.assertEqual('Another message',
+                         self.storage.get(self.request)['message'])
+
+        # Clearing a bucket keeps the client id
+        self.storage.set(FlashScope(), self.request, self.response)
+        self.assertEqual(0, len(self.response.cookies))
+        delattr(self.request, storage.BUCKET_ATTR)
+        self.assertEqual('Message', self.storage.get(self.request)['message'])
+
+    def test_clear_storage(self):
+        """ShmStorage: should remove the stored object and the client id.
+        """
+        self.flash['message'] = 'Message'
+        self.storage.set(self.flash, self.request, self.response)
+        self._transfer_cookies_from_response_to_request()
+        client_id = self.request.COOKIES[self.storage._key]
+
+        del self.flash['message']
+        self.storage.set(self.flash, self.request, self.response)
+        self.assertEqual(0, self.response.cookies[self.storage._key]['max-age'])
+        self.assertEqual(None, self.storage.load(client_id))
+
+    def test_expired(self):
+        """ShmStorage: should not return expired objects.
+        """
+        client_id = new_client_id()
+        self.storage.save(client_id, 'data', -1)
+        self.assertEqual(None, self.storage.load(client_id))
+
+    def test_evict(self):
+        """ShmStorage: should overwrite the object that expires first when there's no room left.
+        """
+        self.storage = shm.FlashStorageClass(self.path, 8, 256)
+        client_ids = [new_client_id() for i in range(9)]
+        for i, client_id in enumerate(client_ids):
+            self.storage.save(client_id, 'data %d' % i, 60 + i)
+        self.assertEqual(None, self.storage.load(client_ids[0]))
+        for i, client_id in enumerate(client_ids[1:]):
+            self.assertEqual('data %d' % (i + 1), self.storage.load(client_id))
+
+    def test_replace(self):
+        """ShmStorage: should keep a single copy of each object.
+        """
+        client_id = new_client_id()
+        self.storage.save(client_id, 'first', 60)
+        self.storage.save(client_id, 'second', 60)
+        self.storage.delete(client_id)
+        self.assertEqual(None, self.storage.load(client_id))
+
+    def test_too_large(self):
+        """ShmStorage: should drop objects larger than a slot, removing the stored ones.
+        """
+        client_id = new_client_id()
+        self.storage.save(client_id, 'data', 60)
+        self.storage.save(client_id, 'x' * 256, 60)
+        self.assertEqual(None, self.storage.load(client_id))
+
+        self.storage.save(client_id, 'data', 60)
+        version = self.storage.load_versioned(client_id)[1]
+        self.assertTrue(self.storage.cas(client_id, 'x' * 256, 60, version))
+        self.assertEqual(None, self.storage.load(client_id))
+
+    def test_different_settings(self):
+        """ShmStorage: should not use a file created with different settings.
+        """
+        self.storage.save(new_client_id(), 'data', 60)
+        other = shm.FlashStorageClass(self.path, 32, 256)
+        self.assertRaises(ImproperlyConfigured, other.load, new_client_id())
+
+    def test_shared_between_processes(self):
+        """ShmStorage: objects should be shared by all processes.
+        """
+        parent_id = new_client_id()
+        self.storage.save(parent_id, 'parent', 60)
+        client_ids = [new_client_id() for i in range(4)]
+
+        def child(client_id):
+            other = shm.FlashStorageClass(self.path, 16, 256)
+            assert other.load(parent_id) == 'parent'
+            other.save(client_id, client_id, 60)
+
+        pids = [self._fork(lambda: child(client_id)) for client_id in client_ids]
+        for pid in pids:
+            self._wait(pid)
+        for client_id in client_ids:
+            self.assertEqual(client_id, self.storage.load(client_id))
+
+    def test_concurrent_reads(self):
+        """ShmStorage: readers should never see partially written objects.
+        """
+        client_id = new_client_id()
+        values = ('a' * 10, 'b' * 200)
+        self.storage.save(client_id, values[0], 60)
+
+        def writer():
+            other = shm.FlashStorageClass(self.path, 16, 256)
+            for i in range(2000):
+                other.save(client_id, values[i % 2], 60)
+
+        pid = self._fork(writer)
+        try:
+            for i in range(2000):
+                self.assertTrue(self.storage.load(client_id) in values)
+        finally:
+            self._wait(pid)
+
+
+class DatabaseFlashStorageTestCase(TestCase, ConcurrentWritesTestMixin):
+    """Tests the database-based flash storage class.
+    """
+    def setUp(self):
+        """Creates a database-based flash storage for testing.
+        """
+        self.request = HttpRequest()
+        self.response = HttpResponse('')
+        self.flash = FlashScope()
+        self.storage = database.FlashStorageClass()
+
+    def tearDown(self):
+        """Removes the stored flashes.
+        """
+        StoredFlash.objects.all().delete()
+
+    def _transfer_cookies_from_response_to_request(self):
+        """Transfers the cookies set in the response to the request.
+        """
+        for key, morsel in self.response.cookies.items():
+            self.request.COOKIES[key] = morsel.value
+
+    def test_get_database_storage_by_alias(self):
+        """DatabaseStorage: 'database' should resolve to this storage.
+        """
+        storage_impl = storage.get_storage('database')
+        self.assertTrue(isinstance(storage_impl, database.FlashStorageClass))
+
+    def test_get(self):
+        """DatabaseStorage: should return the stored object.
+        """
+        self.flash['message'] = 'Message'
+        self.storage.set(self.flash, self.request, self.response)
+        self._transfer_cookies_from_response_to_request()
+        self.assertEqual('Message', self.storage.get(self.request)['message'])
+
+        self.flash['message'] = 'Another message'
+        self.storage.set(self.flash, self.request, self.response)
+        self.assertEqual('Another message',
+                         self.storage.get(self.request)['message'])
+        self.assertEqual(1, StoredFlash.objects.count())
+
+    def test_clear_storage(self):
+        """DatabaseStorage: should remove the row of an empty flash.
+        """
+        self.flash['message'] = 'Message'
+        self.storage.set(self.flash, self.request, self.response)
+        self._transfer_cookies_from_response_to_request()
+        del self.flash['message']
+        self.storage.set(self.flash, self.request, self.response)
+        self.assertEqual(0, StoredFlash.objects.count())
+        self.assertEqual(None, self.storage.get(self.request))
+
+    def test_binary_data(self):
+        """DatabaseStorage: should store any byte string.
+        """
+        client_id = new_client_id()
+        data = ''.join([chr(i) for i in range(256)])
+        self.storage.save(client_id, data, 60)
+        self.assertEqual(data, self.storage.load(client_id))
+
+    def test_save_without_upsert(self):
+        """DatabaseStorage: should work on databases that don't support upserts.
+        """
+        get_upsert = database._get_upsert
+        database._get_upsert = lambda: None
+        try:
+            client_id = new_client_id()
+            self.storage.save(client_id, 'first', 60)
+            self.storage.save(client_id, 'second', 60)
+            self.assertEqual('second', self.storage.load(client_id))
+            self.assertEqual(1, StoredFlash.objects.count())
+        finally:
+            database._get_upsert = get_upsert
+
+    def test_save_many(self):
+        """DatabaseStorage: should store and remove several objects at once.
+        """
+        first, second = new_client_id(), new_client_id()
+        self.storage.save(first, 'old', 60)
+        self.storage.save_many([(first, 'first', 60), (second, 'second', 60)])
+        self.assertEqual('first', self.storage.load(first))
+        self.assertEqual('second', self.storage.load(second))
+        self.storage.delete_many([first, second])
+        self.assertEqual(0, StoredFlash.objects.count())
+
+    def test_expired(self):
+        """DatabaseStorage: should not return expired objects.
+        """
+        client_id = new_client_id()
+        self.storage.save(client_id, 'data', -1)
+        self.assertEqual(None, self.storage.load(client_id))
+
+    def test_purge(self):
+        """DatabaseStorage: should remove expired objects only.
+        """
+        client_ids = [new_client_id() for i in range(5)]
+        for client_id in client_ids:
+            self.storage.save(client_id, 'data', -1)
+        self.storage.save(client_ids[0], 'data', 60)
+        self.assertEqual(4, self.storage.purge(batch_size=2))
+        self.assertEqual([client_ids[0]], list(StoredFlash.objects.values_list(
+            'client_id', flat=True)))
+
+    def test_purge_while_saving(self):
+        """DatabaseStorage: should only count the rows actually removed.
+        """
+        client_ids = [new_client_id() for i in range(2)]
+        for client_id in client_ids:
+            self.storage.save(client_id, 'old', -1)
+        delete_expired = self.storage._delete_expired
+        def save_and_delete(selected, now):
+            # One of the selected rows is replaced before being removed
+            self.storage.save(client_ids[0], 'new', 60)
+            return delete_expired(selected, now)
+        self.storage._delete_expired = save_and_delete
+        self.assertEqual(1, self.storage.purge())
+        self.assertEqual('new', self.storage.load(client_ids[0]))
+        self.assertEqual(None, self.storage.load(client_ids[1]))
+
+    def test_purge_command(self):
+        """DatabaseStorage: the 'flash_purge' command should remove expired objects.
+        """
+        for i in range(3):
+            self.storage.save(new_client_id(), 'data', -1)
+        call_command('flash_purge', storage='database', batch_size=2)
+        self.assertEqual(0, StoredFlash.objects.count())
+
+
+class FileFlashStorageTestCase(TestCase, ConcurrentWritesTestMixin):
+    """Tests the file-based flash storage class.
+    """
+    def setUp(self):
+        """Creates a file-based flash storage for testing.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.request = HttpRequest()
+        self.response = HttpResponse('')
+        self.flash = FlashScope()
+        self.storage = file.FlashStorageClass(self.directory)
+
+    def tearDown(self):
+        """Removes the stored files.
+        """
+        shutil.rmtree(self.directory)
+
+    def _files(self):
+        """Returns the names of the stored files.
+        """
+        names = []
+        for directory, subdirectories, files in os.walk(self.directory):
+            names.extend([name for name in files if name != file._LOCK_NAME])
+        return names
+
+    def test_get_file_storage_by_alias(self):
+        """FileStorage: 'file' should resolve to this storage.
+        """
+        storage_impl = storage.get_storage('file')
+        self.assertTrue(isinstance(storage_impl, file.FlashStorageClass))
+
+    def test_get(self):
+        """FileStorage: should return the stored object.
+        """
+        self.flash['message'] = 'Message'
+        self.storage.set(self.flash, self.request, self.response)
+        for key, morsel in self.response.cookies.items():
+            self.request.COOKIES[key] = morsel.value
+        self.assertEqual('Message', self.storage.get(self.request)['message'])
+
+        del self.flash['message']
+        self.storage.set(self.flash, self.request, self.response)
+        self.assertEqual(None, self.storage.get(self.request))
+        self.assertEqual([], self._files())
+
+    def test_sharded(self):
+        """FileStorage: should spread files over sub-directories.
+        """
+        client_id = new_client_id()
+        self.storage.save(client_id, 'data', 60)
+        path = os.path.join(self.directory, client_id[:2], client_id[2:4],
+                            client_id)
+        self.assertTrue(os.path.isfile(path))
+        self.assertEqual([client_id], self._files())
+
+    def test_replace(self):
+        """FileStorage: should replace the stored data.
+        """
+        client_id = new_client_id()
+        self.storage.save(client_id, 'first', 60)
+        self.storage.save(client_id, 'second', 60)
+        self.assertEqual('second', self.storage.load(client_id))
+        self.assertEqual([client_id], self._files())
+
+    def test_purge_while_saving(self):
+        """FileStorage: should not remove files replaced while purging.
+        """
+        client_id = new_client_id()
+        self.storage.save(client_id, 'old', -1)
+        lock_directory = file._lock_directory
+        def save_and_lock(directory):
+            # The expired file is replaced before the directory is locked
+            file._lock_directory = lock_directory
+            self.storage.save(client_id, 'new', 60)
+            return lock_directory(directory)
+        file._lock_directory = save_and_lock
+        try:
+            self.assertEqual(0, self.storage.purge())
+        finally:
+            file._lock_directory = lock_directory
+        self.assertEqual('new', self.storage.load(client_id))
+
+    def test_delete_missing(self):
+        """FileStorage: should ignore missing files when deleting.
+        """
+        self.storage.delete(new_client_id())
+
+    def test_expired(self):
+        """FileStorage: should not return expired objects.
+        """
+        client_id = new_client_id()
+        self.storage.save(client_id, 'data', -1)
+        self.assertEqual(None, self.storage.load(client_id))
+
+    def test_purge(self):
+        """FileStorage: should remove expired and abandoned files only.
+        """
+        client_ids = [new_client_id() for i in range(3)]
+        self.storage.save(client_ids[0], 'data', 60)
+        self.storage.save(client_ids[1], 'data', -1)
+        self.storage.save(client_ids[2], 'data', -1)
+
+        # Temporary files left by writers that crashed, whose modification
+        # time was already set to their expiration time
+        directory = self.storage._get_directory(client_ids[0])
+        abandoned = os.path.join(directory, file._TEMP_PREFIX + 'abandoned')
+        recent = os.path.join(directory, file._TEMP_PREFIX + 'recent')
+        future = time.time() + 60
+        max_age, file._TEMP_MAX_AGE = file._TEMP_MAX_AGE, 0.2
+        try:
+            open(abandoned, 'w').close()
+            os.utime(abandoned, (future, future))
+            time.sleep(0.3)
+            open(recent, 'w').close()
+            os.utime(recent, (future, future))
+            self.assertEqual(2, self.storage.purge())
+        finally:
+            file._TEMP_MAX_AGE = max_age
+        self.assertEqual(sorted([client_ids[0], os.path.basename(recent)]),
+                         sorted(self._files()))
+
+
+class WriteBehindQueueTestCase(TestCase):
+    """Tests the queue used to write flashes in the background.
+    """
+    def setUp(self):
+        """Creates a dict-based storage whose writes are queued.
+        """
+        self.data, self.calls = {}, []
+        test = self
+        class DictStorage(KeyValueFlashStorage):
+            def load(self, client_id):
+                return test.data.get(client_id)
+            def save(self, client_id, data, ttl):
+                test.calls.append('save')
+                test.data[client_id] = data
+            def delete(self, client_id):
+                test.calls.append('delete')
+                test.data.pop(client_id, None)
+            def save_many(self, items):
+                test.calls.append('save_many')
+                KeyValueFlashStorage.save_many(self, items)
+        self.storage = DictStorage()
+        # The queue is only flushed by the tests
+        self.queue = self.storage.queue = WriteBehindQueue(self.storage, 3600,
+                                                           max_size=3)
+        self.request = HttpRequest()
+        self.response = HttpResponse('')
+        self.handler = logging.Handler()
+        self.handler.emit = lambda record: None
+        writebehind.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        """Stops the thread that flushes the queue.
+        """
+        self.queue.close()
+        writebehind.logger.removeHandler(self.handler)
+
+    def test_read_your_writes(self):
+        """WriteBehindQueue: queued flashes should be returned by the storage.
+        """
+        flash = FlashScope()
+        flash['message'] = 'Message'
+        self.storage.set(flash, self.request, self.response)
+        self.assertEqual({}, self.data)
+        self.request.COOKIES = {self.storage._key:
+            self.response.cookies[self.storage._key].value}
+        self.assertEqual('Message', self.storage.get(self.request)['message'])
+
+        self.storage.set(FlashScope(), self.request, self.response)
+        self.assertEqual(None, self.storage.get(self.request))
+        self.assertEqual(1, self.queue.flush())
+        self.assertEqual({}, self.data)
+        self.assertEqual(['delete'], self.calls)
+
+    def test_coalesce(self):
+        """WriteBehindQueue: only the last write of each client should be made.
+        """
+        self.queue.put('a', 'first', 60)
+        self.queue.put('a', 'second', 60)
+        self.queue.put('b', 'other', 60)
+        self.assertEqual((True, 'second'), self.queue.lookup('a'))
+        self.assertEqual((False, None), self.queue.lookup('c'))
+        self.assertEqual(2, len(self.queue))
+
+        self.assertEqual(2, self.queue.flush())
+        self.assertEqual({'a': 'second', 'b': 'other'}, self.data)
+        self.assertEqual(['save_many', 'save', 'save'], self.calls)
+        self.assertEqual((False, None), self.queue.lookup('a'))
+        stats = self.queue.stats()
+        self.assertEqual((3, 1, 2, 0), (stats['queued'], stats['coalesced'],
+                                        stats['flushed'], stats['depth']))
+        self.assertTrue(stats['last_latency'] >= 0)
+
+    def test_batches(self):
+        """WriteBehindQueue: writes should be flushed in batches.
+        """
+        self.queue.batch_size = 2
+        for client_id in 'abc':
+            self.queue.put(client_id, client_id, 60)
+        self.assertEqual(3, self.queue.flush())
+        self.assertEqual(2, self.calls.count('save_many'))
+
+    def test_overflow(self):
+        """WriteBehindQueue: writes should be made right away when the queue is full.
+        """
+        for client_id in 'abcd':
+            self.queue.put(client_id, client_id, 60)
+        self.assertEqual({'d': 'd'}, self.data)
+        self.assertEqual(1, self.queue.stats()['overflows'])
+
+    def test_overflow_while_flushing(self):
+        """WriteBehindQueue: writes of clients being flushed should be queued even when the queue is full.
+        """
+        self.queue._flushing['a'] = ('old', 60, time.time())
+        for client_id in 'bcd':
+            self.queue.put(client_id, client_id, 60)
+        self.queue.put('a', 'new', 60)
+        self.assertEqual({}, self.data)
+        self.assertEqual((True, 'new'), self.queue.lookup('a'))
+        self.assertEqual(0, self.queue.stats()['overflows'])
+
+        self.queue._flushing = {}
+        self.assertEqual(4, self.queue.flush())
+        self.assertEqual('new', self.data['a'])
+
+    def test_close_waits_for_batch(self):
+        """WriteBehindQueue: close should wait for the batch being flushed.
+        """
+        started, release = threading.Event(), threading.Event()
+        save_many = self.storage.save_many
+        def slow_save_many(items):
+            started.set()
+            release.wait(2)
+            save_many(items)
+        self.storage.save_many = slow_save_many
+        self.queue.put('a', 'a', 60)
+        thread = threading.Thread(target=self.queue.flush)
+        thread.start()
+        started.wait(2)
+
+        self.queue.put('b', 'b', 60)
+        threading.Timer(0.05, release.set).start()
+        self.queue.close()
+        self.assertEqual({'a': 'a', 'b': 'b'}, self.data)
+        thread.join()
+
+    def test_dropped(self):
+        """WriteBehindQueue: writes should be dropped when the storage fails.
+        """
+        def save_many(items):
+            raise IOError('Storage is down')
+        self.storage.save_many = save_many
+        self.queue.put('a', 'data', 60)
+        self.assertEqual(1, self.queue.flush())
+        self.assertEqual(1, self.queue.stats()['dropped'])
+        self.assertEqual(0, len(self.queue))
+
+    def test_background_flush(self):
+        """WriteBehindQueue: writes should be flushed by a background thread.
+        """
+        self.queue.interval = 0.01
+        self.queue.put('a', 'data', 60)
+        for attempt in range(100):
+            if self.data:
+                break
+            time.sleep(0.01)
+        self.assertEqual({'a': 'data'}, self.data)
+
+
+class CachedFlashStorageTestCase(TestCase):
+    """Tests the wrapper that caches the flashes written by the process.
+    """
+    def setUp(self):
+        """Creates two processes' wrappers around the same session-based
+        storage, counting the flashes retrieved from the storage.
+        """
+        self.calls = []
+        test = self
+        class CountingStorage(session.FlashStorageClass):
+            def get(self, request):
+                test.calls.append('get')
+                return session.FlashStorageClass.get(self, request)
+        self.storage = CachedFlashStorage(CountingStorage(), 10, 60)
+        self.other = CachedFlashStorage(CountingStorage(), 10, 60)
+        self.request = HttpRequest()
+        self.request.session = {}
+        self.response = HttpResponse('')
+
+    def tearDown(self):
+        if hasattr(settings, 'FLASH_L1_CACHE_SIZE'):
+            del settings.FLASH_L1_CACHE_SIZE
+
+    def _set(self, storage, message):
+        """Stores a flash holding the given message, simulating a
+        request-response cycle.
+        """
+        flash = FlashScope()
+        flash['message'] = message
+        self.response = HttpResponse('')
+        storage.set(flash, self.request, self.response)
+        self.request.COOKIES[VERSION_COOKIE] = \
+            self.response.cookies[VERSION_COOKIE].value
+
+    def test_get_cached(self):
+        """CachedStorage: flashes written by the process should be cached.
+        """
+        self._set(self.storage, 'Message')
+        flash = self.storage.get(self.request)
+        self.assertEqual('Message', flash['message'])
+        self.assertEqual([], self.calls)
+
+        # Each request gets its own copy
+        flash['message'] = 'Changed'
+        self.assertEqual('Message', self.storage.get(self.request)['message'])
+
+    def test_session_flushed(self):
+        """CachedStorage: flashes stored in the session should not outlive it.
+        """
+        self.request.session = SessionStore()
+        self._set(self.storage, 'Message')
+        self.assertEqual('Message', self.storage.get(self.request)['message'])
+        self.request.session.flush()
+        self.assertEqual(None, self.storage.get(self.request))
+
+    def test_written_by_other_process(self):
+        """CachedStorage: flashes written by another process should be retrieved from the storage.
+        """
+        self._set(self.storage, 'Message')
+        self._set(self.other, 'Another message')
+        self.assertEqual('Another message',
+                         self.storage.get(self.request)['message'])
+        self.assertEqual(['get'], self.calls)
+
+    def test_expired(self):
+        """CachedStorage: cached flashes should expire after some time.
+        """
+        self.storage.ttl = -1
+        self._set(self.storage, 'Message')
+        self.assertEqual('Message', self.storage.get(self.request)['message'])
+        self.assertEqual(['get'], self.calls)
+        self.assertEqual(0, len(self.storage.l1))
+
+    def test_clear_storage(self):
+        """CachedStorage: empty flashes should not be cached.
+        """
+        self._set(self.storage, 'Message')
+        self.storage.set(FlashScope(), self.request, self.response)
+        self.assertEqual(0, self.response.cookies[VERSION_COOKIE]['max-age'])
+        self.assertEqual(0, len(self.storage.l1))
+        self.assertEqual(None, self.storage.get(self.request))
+
+    def test_invalid_version(self):
+        """CachedStorage: invalid version stamps should be ignored.
+        """
+        self.request.COOKIES[VERSION_COOKIE] = '../../etc/passwd'
+        self.assertEqual(None, self.storage.get(self.request))
+        self.assertEqual(['get'], self.calls)
+
+    def test_get_storage(self):
+        """CachedStorage: storages should be wrapped if the cache is enabled.
+        """
+        settings.FLASH_L1_CACHE_SIZE = 10
+        storage_impl = storage.get_storage('session')
+        self.assertTrue(isinstance(storage_impl, CachedFlashStorage))
+        self.assertTrue(isinstance(storage_impl.storage,
+                                   session.FlashStorageClass))
+        self.assertEqual('_djflash_session', storage_impl._key)
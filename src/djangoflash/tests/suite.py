@@ -13,9 +13,12 @@ sys.path.insert(0, setup_environ(project_settings))
 # Imports unit tests
 from context_processors import *
 from decorators import *
+from i18n import *
 from models import *
 from storage import *
 from codec import *
+from templatetags import *
+from utils import *
 
 # Now, the integration tests, which depends on SQLite
 has_sqlite = True
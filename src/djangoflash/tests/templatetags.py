@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""djangoflash.templatetags test cases.
+"""
+
+from unittest import TestCase
+
+from django.template import Context, Template, TemplateSyntaxError
+from django.utils import translation
+
+from djangoflash.context_processors import CONTEXT_VAR
+from djangoflash.models import FlashScope
+
+
+# Only exports test cases
+__all__ = ['FlashMessagesTagTestCase', 'LevelFilterTestCase']
+
+
+def _render(source, flash):
+    """Renders the given template *source* with the given *flash*.
+    """
+    template = Template('{% load flash_tags %}' + source)
+    return template.render(Context({CONTEXT_VAR: flash}))
+
+
+class FlashMessagesTagTestCase(TestCase):
+    """Tests the {% flash_messages %} template tag.
+    """
+    def setUp(self):
+        self.flash = FlashScope()
+        self.flash['info'] = 'Info'
+        self.flash.add('error', 'Error 1', 'Error 2')
+        self.source = '{% flash_messages %}<ul>{% for key, message in ' \
+                      'messages %}[{{ key }}:{{ message }}]{% endfor %}' \
+                      '</ul>{% endflash_messages %}'
+
+    def test_empty_flash(self):
+        """FlashMessagesTag: should skip its contents when the flash is empty.
+        """
+        self.assertEqual('', _render(self.source, FlashScope()))
+
+    def test_missing_flash(self):
+        """FlashMessagesTag: should skip its contents when there's no flash.
+        """
+        self.assertEqual('', Template('{% load flash_tags %}' + \
+            self.source).render(Context()))
+
+    def test_render_messages(self):
+        """FlashMessagesTag: should render every message in the flash.
+        """
+        output = _render(self.source, self.flash)
+        self.assertTrue(output.startswith('<ul>'))
+        self.assertTrue('[info:Info]' in output)
+        self.assertTrue('[error:Error 1][error:Error 2]' in output)
+
+    def test_render_selected_keys(self):
+        """FlashMessagesTag: should render only the messages under the given keys.
+        """
+        source = self.source.replace('{% flash_messages %}', \
+            '{% flash_messages "error" "warning" %}')
+        output = _render(source, self.flash)
+        self.assertEqual('<ul>[error:Error 1][error:Error 2]</ul>', output)
+
+        source = self.source.replace('{% flash_messages %}', \
+            '{% flash_messages "warning" %}')
+        self.assertEqual('', _render(source, self.flash))
+
+    def test_cache(self):
+        """FlashMessagesTag: should cache the rendered contents by the flash contents.
+        """
+        source = '{% flash_messages cache 60 test_cache %}{{ counter }}' \
+                 '{% endflash_messages %}'
+        template = Template('{% load flash_tags %}' + source)
+        render = lambda flash, counter: template.render( \
+            Context({CONTEXT_VAR: flash, 'counter': counter}))
+
+        self.assertEqual('1', render(self.flash, 1))
+        self.assertEqual('1', render(self.flash, 2))
+
+        # Different flash contents produce a different fragment
+        self.flash['info'] = 'Another info'
+        self.assertEqual('3', render(self.flash, 3))
+
+    def test_cache_by_language(self):
+        """FlashMessagesTag: should cache the rendered contents by the active language.
+        """
+        source = '{% flash_messages cache 60 test_cache_by_language %}' \
+                 '{{ counter }}{% endflash_messages %}'
+        template = Template('{% load flash_tags %}' + source)
+        render = lambda counter: template.render( \
+            Context({CONTEXT_VAR: self.flash, 'counter': counter}))
+
+        self.assertEqual('1', render(1))
+        translation.activate('pt-br')
+        try:
+            self.assertEqual('2', render(2))
+        finally:
+            translation.deactivate()
+
+    def test_cache_syntax_error(self):
+        """FlashMessagesTag: should complain about a missing fragment name.
+        """
+        source = '{% load flash_tags %}{% flash_messages cache 60 %}' \
+                 '{% endflash_messages %}'
+        self.assertRaises(TemplateSyntaxError, Template, source)
+
+
+class LevelFilterTestCase(TestCase):
+    """Tests the "level" template filter.
+    """
+    def setUp(self):
+        self.flash = FlashScope()
+        self.flash['info'] = 'Info'
+        self.flash.add('error', 'Error 1', 'Error 2')
+        self.source = '{% for m in flash|level:"KEY" %}[{{ m }}]{% endfor %}'
+
+    def test_single_value(self):
+        """LevelFilter: should iterate over a single value.
+        """
+        source = self.source.replace('KEY', 'info')
+        self.assertEqual('[Info]', _render(source, self.flash))
+
+    def test_list_value(self):
+        """LevelFilter: should iterate over a list of values.
+        """
+        source = self.source.replace('KEY', 'error')
+        self.assertEqual('[Error 1][Error 2]', _render(source, self.flash))
+
+    def test_missing_value(self):
+        """LevelFilter: should render nothing for a missing key.
+        """
+        source = self.source.replace('KEY', 'warning')
+        self.assertEqual('', _render(source, self.flash))
@@ -3,13 +3,22 @@
 """Integration test cases.
 """
 
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
 from django.conf import settings
-from django.core.exceptions import SuspiciousOperation
+from django.core.exceptions import ImproperlyConfigured, SuspiciousOperation
 from django.core.urlresolvers import reverse
+from django.http import HttpRequest
 from django.test import TestCase
 
+from djangoflash import middleware
 from djangoflash.context_processors import CONTEXT_VAR
 from djangoflash.middleware import FlashScope
+from djangoflash.storage import HINT_COOKIE, shm
 
 from testproj.app import views
 
@@ -211,3 +220,504 @@ class IntegrationTestCase(TestCase):
         # Flash value will be removed when this request hits the app
         self.response = self.client.get(reverse(views.render_template))
         self.assertFalse('message' in self._flash())
+
+
+class IgnoreRulesIntegrationTestCase(TestCase):
+    """Test the rules used to ignore some requests and responses.
+    """
+    def tearDown(self):
+        for name in ('FLASH_IGNORE_METHODS', 'FLASH_IGNORE_PATHS',
+                     'FLASH_IGNORE_STATUS_CODES', 'FLASH_IGNORE_CONTENT_TYPES'):
+            if hasattr(settings, name):
+                delattr(settings, name)
+
+    def _flash(self):
+        """Shortcut to get the flash from the view context.
+        """
+        return self.response.context[CONTEXT_VAR]
+
+    def _assert_ignored(self, ignored_request):
+        """Asserts that the given request doesn't affect the flash lifecycle.
+        """
+        self.response = self.client.get(reverse(views.set_flash_var))
+        self.assertEqual('Message', self._flash()['message'])
+
+        ignored_request()
+
+        self.response = self.client.get(reverse(views.render_template))
+        self.assertEqual('Message', self._flash()['message'])
+
+        # Flash value will be removed when this request hits the app
+        self.response = self.client.get(reverse(views.render_template))
+        self.assertFalse('message' in self._flash())
+
+    def test_ignore_method(self):
+        """Integration: requests using an ignored method should not trigger the flash update.
+        """
+        settings.FLASH_IGNORE_METHODS = ('head',)
+        self._assert_ignored(lambda: \
+            self.client.head(reverse(views.render_template)))
+
+    def test_ignore_path(self):
+        """Integration: requests to an ignored path should not trigger the flash update.
+        """
+        settings.FLASH_IGNORE_PATHS = ('/json',)
+        self._assert_ignored(lambda: \
+            self.client.get(reverse(views.json_response)))
+
+    def test_ignore_status_code(self):
+        """Integration: responses with an ignored status code should not trigger the flash update.
+        """
+        settings.FLASH_IGNORE_STATUS_CODES = (304,)
+        self._assert_ignored(lambda: \
+            self.client.get(reverse(views.not_modified)))
+
+    def test_ignore_content_type(self):
+        """Integration: responses with an ignored content type should not trigger the flash update.
+        """
+        settings.FLASH_IGNORE_CONTENT_TYPES = ('application/json',)
+        self._assert_ignored(lambda: \
+            self.client.get(reverse(views.json_response)))
+
+    def test_ignore_content_type_prefix(self):
+        """Integration: responses with a content type that starts with an ignored prefix should not trigger the flash update.
+        """
+        settings.FLASH_IGNORE_CONTENT_TYPES = ('image/', 'application/')
+        self._assert_ignored(lambda: \
+            self.client.get(reverse(views.json_response)))
+
+    def test_flash_required(self):
+        """Integration: requests to views decorated with flash_required should never be ignored.
+        """
+        settings.FLASH_IGNORE_PATHS = ('/flash_required',)
+        self.response = self.client.get(reverse(views.set_flash_var))
+        self.response = self.client.get(reverse(views.flash_required_view))
+        self.assertEqual('Message', self._flash()['message'])
+
+        # Flash value will be removed when this request hits the app
+        self.response = self.client.get(reverse(views.render_template))
+        self.assertFalse('message' in self._flash())
+
+    def test_flash_required_loaded(self):
+        """Integration: the flash of views decorated with flash_required should be loaded before the view is called.
+        """
+        request = HttpRequest()
+        request.session = {}
+        flash_middleware = middleware.FlashMiddleware()
+        flash_middleware.process_request(request)
+        self.assertFalse(request.flash.is_loaded())
+        flash_middleware.process_view(request, views.flash_required_view,
+                                      (), {})
+        self.assertTrue(request.flash.is_loaded())
+
+    def test_not_ignored(self):
+        """Integration: responses that don't match any rule should trigger the flash update.
+        """
+        settings.FLASH_IGNORE_CONTENT_TYPES = ('image/', 'text/javascript')
+        self.response = self.client.get(reverse(views.set_flash_var))
+        self.client.get(reverse(views.json_response))
+
+        self.response = self.client.get(reverse(views.render_template))
+        self.assertFalse('message' in self._flash())
+
+
+class CountingStorageTestCase(TestCase):
+    """Base class for test cases that count the calls to the flash storage.
+    """
+    def setUp(self):
+        """Counts the calls to the flash storage.
+        """
+        self.calls, self.stored = [], False
+        storage = self.storage = middleware.storage
+        class CountingStorage(object):
+            def get(_, request):
+                self.calls.append('get')
+                return storage.get(request)
+            def set(_, flash, request, response):
+                self.calls.append('set')
+                self.stored = bool(flash)
+                return storage.set(flash, request, response)
+        middleware.storage = CountingStorage()
+
+    def tearDown(self):
+        middleware.storage = self.storage
+
+    def _flash(self):
+        """Shortcut to get the flash from the view context.
+        """
+        return self.response.context[CONTEXT_VAR]
+
+
+class StorageUsageIntegrationTestCase(CountingStorageTestCase):
+    """Test how the flash storage is used by different requests.
+    """
+    def test_no_flash(self):
+        """Integration: requests to views decorated with no_flash should not touch the flash storage.
+        """
+        self.response = self.client.get(reverse(views.set_flash_var))
+        self.assertEqual(['get', 'set'], self.calls)
+
+        self.response = self.client.get(reverse(views.no_flash_view))
+        self.assertEqual(['get', 'set'], self.calls)
+        self.assertFalse('message' in self._flash())
+        self.assertEqual('Another message', self._flash()['anotherMessage'])
+
+        self.response = self.client.get(reverse(views.render_template))
+        self.assertEqual('Message', self._flash()['message'])
+        self.assertFalse('anotherMessage' in self._flash())
+
+        # Flash value will be removed when this request hits the app
+        self.response = self.client.get(reverse(views.render_template))
+        self.assertFalse('message' in self._flash())
+
+    def test_now_not_stored(self):
+        """Integration: immediate values should not be written to the flash storage.
+        """
+        self.response = self.client.get(reverse(views.set_now_var))
+        self.assertEqual('Message', self._flash()['message'])
+        self.assertFalse(self.stored)
+
+    def test_used_values_not_stored(self):
+        """Integration: used values should be removed from the flash storage right away.
+        """
+        self.response = self.client.get(reverse(views.set_flash_var))
+        self.assertTrue(self.stored)
+
+        self.response = self.client.get(reverse(views.render_template))
+        self.assertEqual('Message', self._flash()['message'])
+        self.assertFalse(self.stored)
+        self.assertFalse('_djflash_session' in self.client.session)
+
+    def test_unused_flash(self):
+        """Integration: requests that don't reach a view should not touch the flash storage.
+        """
+        self.client.get('/default')
+        self.client.get('/not_found/')
+        self.assertEqual([], self.calls)
+
+
+class PresenceHintIntegrationTestCase(CountingStorageTestCase):
+    """Test the cookie that tells whether the user has a stored flash.
+    """
+    def setUp(self):
+        super(PresenceHintIntegrationTestCase, self).setUp()
+        settings.FLASH_PRESENCE_HINT = True
+
+    def tearDown(self):
+        super(PresenceHintIntegrationTestCase, self).tearDown()
+        del settings.FLASH_PRESENCE_HINT
+        if hasattr(settings, 'FLASH_BUCKETS'):
+            del settings.FLASH_BUCKETS
+
+    def _hint(self):
+        """Returns the value of the hint cookie sent by the last response.
+        """
+        return self.response.cookies[HINT_COOKIE].value
+
+    def test_no_hint(self):
+        """Integration: requests without the hint cookie should not query the flash storage.
+        """
+        self.response = self.client.get(reverse(views.render_template))
+        self.assertEqual({}, dict(self._flash().items()))
+        self.assertEqual([], self.calls)
+        self.assertFalse(HINT_COOKIE in self.response.cookies)
+
+    def test_hint_lifecycle(self):
+        """Integration: the hint cookie should be sent while the flash is stored.
+        """
+        self.response = self.client.get(reverse(views.set_flash_var))
+        self.assertEqual(['set'], self.calls)
+        self.assertEqual('1', self._hint())
+
+        self.response = self.client.get(reverse(views.keep_var))
+        self.assertEqual(['set', 'get', 'set'], self.calls)
+        self.assertEqual('2', self._hint())
+
+        self.response = self.client.get(reverse(views.render_template))
+        self.assertEqual('Message', self._flash()['message'])
+        self.assertEqual('', self._hint())
+        self.assertEqual(0, self.response.cookies[HINT_COOKIE]['max-age'])
+
+        self.calls = []
+        self.response = self.client.get(reverse(views.render_template))
+        self.assertFalse('message' in self._flash())
+        self.assertEqual([], self.calls)
+
+    def test_hint_after_merge(self):
+        """Integration: the hint cookie should be kept if the stored flash holds values added by a concurrent request.
+        """
+        self.response = self.client.get(reverse(views.set_flash_var))
+
+        # Another request adds a value, which is merged by the storage
+        merged = FlashScope()
+        merged['anotherMessage'] = 'Another message'
+        set_flash = middleware.storage.set
+        def set_merged(flash, request, response):
+            self.assertFalse(flash)
+            return set_flash(merged, request, response)
+        middleware.storage.set = set_merged
+        self.response = self.client.get(reverse(views.render_template))
+        self.assertEqual('2', self._hint())
+
+        del middleware.storage.set
+        self.response = self.client.get(reverse(views.render_template))
+        self.assertEqual('Another message', self._flash()['anotherMessage'])
+
+    def test_hint_with_buckets(self):
+        """Integration: flashes moved to a bucket should not be hinted.
+        """
+        settings.FLASH_BUCKETS = True
+        self.response = self.client.get(reverse(views.set_flash_var))
+        self.assertEqual('1', self._hint())
+
+        self.response = self.client.get(reverse(views.redirect_with_flash))
+        self.assertEqual('', self._hint())
+
+        # Requests carrying a bucket token always query the storage
+        self.response = self.client.get(self.response['Location'])
+        self.assertEqual('Message', self._flash()['message'])
+        self.assertFalse(HINT_COOKIE in self.response.cookies)
+
+
+class BucketsIntegrationTestCase(TestCase):
+    """Test the flash buckets created when redirecting.
+    """
+    def setUp(self):
+        settings.FLASH_BUCKETS = True
+
+    def tearDown(self):
+        del settings.FLASH_BUCKETS
+
+    def _flash(self):
+        """Shortcut to get the flash from the view context.
+        """
+        return self.response.context[CONTEXT_VAR]
+
+    def _redirect(self, message='Message'):
+        """Requests a view that redirects after setting a flash value, and
+        returns the redirect URL.
+        """
+        response = self.client.get(reverse(views.redirect_with_flash),
+                                   {'message': message})
+        self.assertEqual(302, response.status_code)
+        return response['Location']
+
+    def test_token_added_to_redirect(self):
+        """Integration: redirects should carry the token of a new flash bucket.
+        """
+        response = self.client.get(reverse(views.redirect_with_flash))
+        url, fragment = response['Location'].split('#')
+        self.assertEqual('top', fragment)
+        path, token = url.split('?_flash=')
+        self.assertTrue(path.endswith(reverse(views.render_template)))
+        self.assertEqual(8, len(token))
+        self.assertEqual(token, response['X-Flash-Bucket'])
+
+    def test_off_site_redirect(self):
+        """Integration: redirects to other sites should not carry a bucket token.
+        """
+        response = self.client.get(reverse(views.redirect_with_flash),
+                                   {'to': 'http://example.com/next/'})
+        self.assertEqual('http://example.com/next/', response['Location'])
+        self.assertFalse(response.has_header('X-Flash-Bucket'))
+
+        # The values stay in the main flash
+        self.response = self.client.get(reverse(views.render_template))
+        self.assertEqual('Message', self._flash()['message'])
+
+    def test_same_host_redirect(self):
+        """Integration: absolute redirects to the same host should carry a bucket token.
+        """
+        response = self.client.get(reverse(views.redirect_with_flash),
+                                   {'to': 'http://testserver/next/'})
+        self.assertTrue(response['Location'].startswith(
+            'http://testserver/next/?_flash='))
+
+    def test_bucket_lifecycle(self):
+        """Integration: values in a bucket should only be seen by requests that send its token.
+        """
+        url = self._redirect()
+        self.response = self.client.get(reverse(views.render_template))
+        self.assertFalse('message' in self._flash())
+
+        self.response = self.client.get(url)
+        self.assertEqual('Message', self._flash()['message'])
+
+        # Flash value will be removed when this request hits the app
+        self.response = self.client.get(url)
+        self.assertFalse('message' in self._flash())
+
+    def test_concurrent_tabs(self):
+        """Integration: redirects made by different tabs should not consume each other's values.
+        """
+        first_url = self._redirect('First')
+        second_url = self._redirect('Second')
+        self.assertNotEqual(first_url, second_url)
+
+        self.response = self.client.get(second_url)
+        self.assertEqual('Second', self._flash()['message'])
+        self.response = self.client.get(first_url)
+        self.assertEqual('First', self._flash()['message'])
+
+    def test_bucket_header(self):
+        """Integration: the bucket token might be sent in a request header.
+        """
+        token = self.client.get(reverse(views.redirect_with_flash))[
+            'X-Flash-Bucket']
+        self.response = self.client.get(reverse(views.render_template),
+                                        HTTP_X_FLASH_BUCKET=token)
+        self.assertEqual('Message', self._flash()['message'])
+
+    def test_invalid_token(self):
+        """Integration: invalid tokens should be treated as missing ones.
+        """
+        self.response = self.client.get(reverse(views.set_flash_var))
+        self.response = self.client.get(reverse(views.render_template),
+                                        {'_flash': '../../etc'})
+        self.assertEqual('Message', self._flash()['message'])
+
+    def test_chained_redirects(self):
+        """Integration: values kept across redirects should move to a new bucket.
+        """
+        url = self._redirect()
+        response = self.client.get(reverse(views.redirect_with_flash),
+                                   {'_flash': url.split('=')[1][:8]})
+        self.assertNotEqual(url, response['Location'])
+
+        self.response = self.client.get(url)
+        self.assertFalse('message' in self._flash())
+        self.response = self.client.get(response['Location'])
+        self.assertEqual('Message', self._flash()['message'])
+
+    def test_disabled(self):
+        """Integration: redirects should not be changed when buckets are disabled.
+        """
+        del settings.FLASH_BUCKETS
+        response = self.client.get(reverse(views.redirect_with_flash))
+        self.assertFalse('_flash=' in response['Location'])
+        self.assertFalse(response.has_header('X-Flash-Bucket'))
+        settings.FLASH_BUCKETS = True
+
+
+class PrefetchIntegrationTestCase(TestCase):
+    """Test the flashes retrieved by a background thread.
+    """
+    def setUp(self):
+        """Uses a server-side storage that records the threads that use it.
+        """
+        settings.FLASH_PREFETCH = True
+        self.threads, self.stored, self.overlapped = [], None, []
+        views.view_called.clear()
+        class RecordingStorage(object):
+            def load(_, client_id):
+                pass
+            def get(_, request):
+                self.threads.append(threading.currentThread())
+                if request.path == reverse(views.notify_view):
+                    # Waits until the view is called, as a slow storage would
+                    views.view_called.wait(2)
+                    self.overlapped.append(views.view_called.isSet())
+                return self.stored
+            def set(_, flash, request, response):
+                self.stored = flash
+        self.storage = middleware.storage
+        middleware.storage = RecordingStorage()
+
+    def tearDown(self):
+        middleware.storage = self.storage
+        del settings.FLASH_PREFETCH
+        if hasattr(settings, 'FLASH_IGNORE_PATHS'):
+            del settings.FLASH_IGNORE_PATHS
+
+    def _flash(self):
+        """Shortcut to get the flash from the view context.
+        """
+        return self.response.context[CONTEXT_VAR]
+
+    def test_prefetch(self):
+        """Integration: the flash should be retrieved by another thread.
+        """
+        self.response = self.client.get(reverse(views.set_flash_var))
+        self.response = self.client.get(reverse(views.render_template))
+        self.assertEqual('Message', self._flash()['message'])
+        self.assertEqual(2, len(self.threads))
+        self.assertFalse(threading.currentThread() in self.threads)
+
+        # Flash value will be removed when this request hits the app
+        self.response = self.client.get(reverse(views.render_template))
+        self.assertFalse('message' in self._flash())
+
+    def test_flash_required_loaded(self):
+        """Integration: the prefetched flash of views decorated with flash_required should be loaded before the view is called.
+        """
+        request = HttpRequest()
+        flash_middleware = middleware.FlashMiddleware()
+        flash_middleware.process_request(request)
+        flash_middleware.process_view(request, views.flash_required_view,
+                                      (), {})
+        self.assertTrue(request.flash.is_loaded())
+        self.assertEqual(1, len(self.threads))
+
+    def test_view_runs_while_prefetching(self):
+        """Integration: the view should be called while the flash is retrieved.
+        """
+        self.response = self.client.get(reverse(views.set_flash_var))
+        self.response = self.client.get(reverse(views.notify_view))
+        self.assertEqual([True], self.overlapped)
+        self.assertEqual('Message', self._flash()['message'])
+
+    def test_no_flash_not_prefetched(self):
+        """Integration: the flash of views decorated with no_flash should not be retrieved.
+        """
+        self.stored = FlashScope()
+        self.stored['message'] = 'Message'
+        stored = self.stored
+        self.response = self.client.get(reverse(views.no_flash_view))
+        self.assertFalse('message' in self._flash())
+        self.assertTrue(stored is self.stored)
+        self.assertEqual([], self.threads)
+
+    def test_ignored_not_prefetched(self):
+        """Integration: the flash of ignored requests should not be retrieved.
+        """
+        settings.FLASH_IGNORE_PATHS = ('/json',)
+        self.client.get(reverse(views.json_response))
+        self.client.get('/not_found/')
+        self.assertEqual([], self.threads)
+
+    def test_session_storage(self):
+        """Integration: the flash should not be prefetched from the session.
+        """
+        middleware.storage = self.storage
+        self.assertRaises(ImproperlyConfigured, middleware.FlashMiddleware)
+
+
+class OversizedFlashIntegrationTestCase(TestCase):
+    """Test flashes too large for the shared memory-based storage.
+    """
+    def setUp(self):
+        """Uses a shared memory-based storage whose slots are tiny.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.storage = middleware.storage
+        middleware.storage = shm.FlashStorageClass(
+            os.path.join(self.directory, 'flash'), 16, 40)
+        self.handler = logging.Handler()
+        self.records = []
+        self.handler.emit = self.records.append
+        shm.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        middleware.storage = self.storage
+        shm.logger.removeHandler(self.handler)
+        shutil.rmtree(self.directory)
+
+    def test_oversized_flash(self):
+        """Integration: a flash too large for the storage should be logged and dropped.
+        """
+        response = self.client.get(reverse(views.set_flash_var))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(self.records))
+
+        response = self.client.get(reverse(views.render_template))
+        self.assertFalse('message' in response.context[CONTEXT_VAR])
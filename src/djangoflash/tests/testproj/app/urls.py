@@ -7,9 +7,15 @@ urlpatterns = patterns('',
     (r'^set_flash_var/$', views.set_flash_var),
     (r'^set_another_flash_var/$', views.set_another_flash_var),
     (r'^set_now_var/$', views.set_now_var),
+    (r'^json_response/$', views.json_response),
+    (r'^not_modified/$', views.not_modified),
     (r'^keep_var/$', views.keep_var),
     (r'^keep_var_decorator/$', views.keep_var_decorator),
+    (r'^no_flash/$', views.no_flash_view),
+    (r'^flash_required/$', views.flash_required_view),
     (r'^discard_var/$', views.discard_var),
     (r'^replace_flash/$', views.replace_flash),
     (r'^remove_flash/$', views.remove_flash),
+    (r'^redirect_with_flash/$', views.redirect_with_flash),
+    (r'^notify_view/$', views.notify_view),
 )
@@ -1,11 +1,14 @@
 # Create your views here.
 
+import threading
+
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseNotModified, \
+    HttpResponseRedirect
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 
-from djangoflash.decorators import keep_messages
+from djangoflash.decorators import keep_messages, no_flash, flash_required
 
 
 def render_template(request):
@@ -24,6 +27,12 @@ def set_now_var(request):
     request.flash.now['message'] = 'Message'
     return render_template(request)
 
+def json_response(request):
+    return HttpResponse('{}', mimetype='application/json')
+
+def not_modified(request):
+    return HttpResponseNotModified()
+
 def keep_var(request):
     request.flash.keep('message')
     return render_template(request)
@@ -32,6 +41,15 @@ def keep_var(request):
 def keep_var_decorator(request):
     return render_template(request)
 
+@no_flash
+def no_flash_view(request):
+    request.flash['anotherMessage'] = 'Another message'
+    return render_template(request)
+
+@flash_required
+def flash_required_view(request):
+    return render_template(request)
+
 def discard_var(request):
     # Should behave the same way 'flash.now' does
     request.flash['message'] = 'Message'
@@ -46,3 +64,15 @@ def remove_flash(request):
     # I've seen this happen, I'm not kidding... :)
     del request.flash
     return render_template(request)
+
+# Set when notify_view is called, so tests can tell when views start running
+view_called = threading.Event()
+
+def notify_view(request):
+    view_called.set()
+    return render_template(request)
+
+def redirect_with_flash(request):
+    request.flash['message'] = request.GET.get('message', 'Message')
+    return HttpResponseRedirect(request.GET.get('to',
+        reverse(render_template) + '#top'))
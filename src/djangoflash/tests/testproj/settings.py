@@ -46,6 +46,8 @@ TEMPLATE_DIRS = (
 
 INSTALLED_APPS = (
     'app',
+    'djangoflash',
+    'djangoflash.storage.db',
     'django.contrib.sessions',
 )
 
@@ -53,5 +55,30 @@ INSTALLED_APPS = (
 # Settings introduced by Django-Flash:
 
 # FLASH_IGNORE_MEDIA = DEBUG     # True, False
-# FLASH_STORAGE      = 'session' # 'session, 'cookie', 'path.to.module'
-# FLASH_CODEC        = 'json'    # 'json', 'json_zlib', 'pickle', 'path.to.module'
+# FLASH_STORAGE      = 'session' # 'session, 'cookie', 'shm', 'database', 'file', 'path.to.module'
+# FLASH_CODEC        = 'json'    # 'json', 'json_zlib', 'json_lazy', 'json_typed', 'pickle', 'path.to.module'
+# FLASH_JSON_ENGINE  = 'auto'    # 'auto', 'simplejson', 'json', 'django', 'ujson'
+# FLASH_CODEC_FALLBACKS      = () # ('json', 'json_zlib')
+# FLASH_IGNORE_METHODS       = () # ('HEAD', 'OPTIONS')
+# FLASH_IGNORE_PATHS         = () # ('/api/',)
+# FLASH_IGNORE_STATUS_CODES  = () # (304,)
+# FLASH_IGNORE_CONTENT_TYPES = () # ('application/json', 'image/')
+# FLASH_COOKIE_CACHE_SIZE    = 100
+# FLASH_COOKIE_REJECTED_CACHE_SIZE = 100
+# FLASH_MAX_AGE              = None
+# FLASH_BUCKETS              = False
+# FLASH_BUCKET_PARAM         = '_flash'
+# FLASH_PRESENCE_HINT        = False
+# FLASH_PREFETCH             = False
+# FLASH_PREFETCH_THREADS     = 4
+# FLASH_STORAGE_TTL          = 3600
+# FLASH_SHM_PATH             = '/dev/shm/djangoflash-<uid>'
+# FLASH_SHM_SLOTS            = 4096
+# FLASH_SHM_SLOT_SIZE        = 4096
+# FLASH_FILE_PATH            = '/tmp/djangoflash-<uid>'
+# FLASH_WRITE_BEHIND         = False
+# FLASH_WRITE_BEHIND_INTERVAL   = 0.05
+# FLASH_WRITE_BEHIND_BATCH_SIZE = 100
+# FLASH_WRITE_BEHIND_MAX_SIZE   = 10000
+# FLASH_L1_CACHE_SIZE        = 0
+# FLASH_L1_CACHE_TTL         = 60
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""djangoflash.utils test cases.
+"""
+
+import threading
+from unittest import TestCase
+
+from djangoflash.utils import LRUCache, ThreadPool
+
+
+__all__ = ['LRUCacheTestCase', 'ThreadPoolTestCase']
+
+
+class LRUCacheTestCase(TestCase):
+    """Tests the LRU cache used to hold decoded flashes.
+    """
+    def setUp(self):
+        """Creates a small cache.
+        """
+        self.cache = LRUCache(2)
+
+    def test_get_missing(self):
+        """LRUCache: should return the default value for missing keys.
+        """
+        self.assertEqual(None, self.cache.get('a'))
+        self.assertEqual(0, self.cache.get('a', 0))
+        self.assertEqual(2, self.cache.stats()['misses'])
+
+    def test_set_and_get(self):
+        """LRUCache: should return cached values.
+        """
+        self.cache.set('a', 1)
+        self.assertEqual(1, self.cache.get('a'))
+        self.assertEqual(1, self.cache.stats()['hits'])
+
+    def test_replace(self):
+        """LRUCache: should replace the value cached under an existing key.
+        """
+        self.cache.set('a', 1)
+        self.cache.set('a', 2)
+        self.assertEqual(2, self.cache.get('a'))
+        self.assertEqual(1, len(self.cache))
+
+    def test_discard_least_recently_used(self):
+        """LRUCache: should discard the least recently used entry when full.
+        """
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertTrue('a' in self.cache)
+        self.assertFalse('b' in self.cache)
+        self.assertTrue('c' in self.cache)
+        self.assertEqual(2, len(self.cache))
+
+    def test_delete(self):
+        """LRUCache: should remove cached values.
+        """
+        self.cache.set('a', 1)
+        self.cache.delete('a')
+        self.cache.delete('b')
+        self.assertFalse('a' in self.cache)
+        self.assertEqual(0, len(self.cache))
+
+    def test_clear(self):
+        """LRUCache: should remove all cached values and reset its stats.
+        """
+        self.cache.set('a', 1)
+        self.cache.get('a')
+        self.cache.clear()
+        self.assertEqual({'hits': 0, 'misses': 0, 'size': 0, 'max_size': 2},
+                         self.cache.stats())
+
+    def test_disabled(self):
+        """LRUCache: should not hold anything if its maximum size is 0.
+        """
+        cache = LRUCache(0)
+        cache.set('a', 1)
+        self.assertEqual(None, cache.get('a'))
+        self.assertEqual(0, len(cache))
+
+
+class ThreadPoolTestCase(TestCase):
+    """Tests the thread pool used to prefetch flashes.
+    """
+    def setUp(self):
+        """Creates a small pool.
+        """
+        self.pool = ThreadPool(2)
+
+    def test_result(self):
+        """ThreadPool: should call functions in other threads.
+        """
+        future = self.pool.submit(lambda x: (x, threading.currentThread()), 1)
+        value, thread = future.result()
+        self.assertEqual(1, value)
+        self.assertNotEqual(threading.currentThread(), thread)
+        self.assertTrue(future.done())
+        self.assertEqual(2, len(self.pool._threads))
+
+    def test_error(self):
+        """ThreadPool: should raise the exceptions raised by the functions.
+        """
+        future = self.pool.submit(int, 'invalid')
+        self.assertRaises(ValueError, future.result)
+
+    def test_wait(self):
+        """ThreadPool: results should only be available after the function returns.
+        """
+        event = threading.Event()
+        future = self.pool.submit(event.wait)
+        self.assertFalse(future.done())
+        event.set()
+        future.result()
+        self.assertTrue(future.done())
+
+    def test_shutdown(self):
+        """ThreadPool: threads should call the finalizer when the pool is shut down.
+        """
+        finalized = []
+        self.pool = ThreadPool(2, lambda: finalized.append(
+            threading.currentThread()))
+        threads = [self.pool.submit(threading.currentThread).result()
+                   for i in range(4)]
+        self.assertEqual([], finalized)
+        self.pool.shutdown()
+        self.assertEqual(2, len(finalized))
+        self.assertTrue(set(threads) <= set(finalized))
+        self.assertEqual(3, self.pool.submit(lambda: 3).result())
+        self.pool.shutdown()
+        self.assertEqual(4, len(finalized))
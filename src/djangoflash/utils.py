@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+"""This module provides some utilities used by the other Django-Flash modules.
+"""
+
+import sys
+from Queue import Queue
+
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+
+# Indexes of the fields of a LRU cache entry
+_PREV, _NEXT, _KEY, _VALUE = 0, 1, 2, 3
+
+
+class LRUCache(object):
+    """Thread-safe, bounded mapping that discards the least recently used
+    entries when it's full. The number of cache hits and misses is recorded
+    and can be retrieved with :meth:`stats`.
+    """
+
+    def __init__(self, max_size=100):
+        """Returns a new cache that holds at most *max_size* entries. A cache
+        whose *max_size* is ``0`` (or less) never holds anything.
+        """
+        self.max_size = max_size
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        """Removes all entries from this cache. The lock must be held.
+        """
+        self._entries = {}
+        # Circular doubly linked list of entries, the most recent one first
+        self._root = [None, None, None, None]
+        self._root[_PREV] = self._root[_NEXT] = self._root
+
+    def _unlink(self, entry):
+        """Removes the given *entry* from the linked list.
+        """
+        entry[_PREV][_NEXT] = entry[_NEXT]
+        entry[_NEXT][_PREV] = entry[_PREV]
+
+    def _link(self, entry):
+        """Inserts the given *entry* at the head of the linked list.
+        """
+        root = self._root
+        entry[_PREV], entry[_NEXT] = root, root[_NEXT]
+        root[_NEXT][_PREV] = root[_NEXT] = entry
+
+    def get(self, key, default=None):
+        """Returns the value cached under the given *key*, or *default* if
+        there's no such value.
+        """
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._unlink(entry)
+            self._link(entry)
+            return entry[_VALUE]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        """Caches the given *value* under the given *key*, discarding the least
+        recently used entry if this cache is full.
+        """
+        if self.max_size <= 0:
+            return
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._unlink(entry)
+            elif len(self._entries) >= self.max_size:
+                oldest = self._root[_PREV]
+                self._unlink(oldest)
+                del self._entries[oldest[_KEY]]
+            entry = [None, None, key, value]
+            self._entries[key] = entry
+            self._link(entry)
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        """Removes the value cached under the given *key*, if any.
+        """
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._unlink(entry)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Removes all entries from this cache and resets its stats.
+        """
+        self._lock.acquire()
+        try:
+            self._clear()
+            self.hits = self.misses = 0
+        finally:
+            self._lock.release()
+
+    def __contains__(self, key):
+        """Returns ``True`` if there's a value cached under the given *key*.
+        The entry is not considered used.
+        """
+        return key in self._entries
+
+    def __len__(self):
+        """Returns the number of cached entries.
+        """
+        return len(self._entries)
+
+    def stats(self):
+        """Returns a :class:`dict` with the number of ``hits`` and ``misses``,
+        the current ``size`` and the ``max_size`` of this cache.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._entries), 'max_size': self.max_size}
+
+
+class Future(object):
+    """Result of a function called by a :class:`ThreadPool`.
+    """
+
+    def __init__(self):
+        """Returns a new future, whose result isn't available yet.
+        """
+        self._done = threading.Event()
+        self._result = self._error = None
+
+    def _run(self, function, args):
+        """Calls the given function, keeping its result or the exception it
+        raised.
+        """
+        try:
+            try:
+                self._result = function(*args)
+            except:
+                self._error = sys.exc_info()
+        finally:
+            self._done.set()
+
+    def done(self):
+        """Returns ``True`` if the function was already called.
+        """
+        return self._done.isSet()
+
+    def result(self):
+        """Waits for the function to be called and returns its result, or
+        raises the exception it raised.
+        """
+        self._done.wait()
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+        return self._result
+
+
+class ThreadPool(object):
+    """Calls functions in a fixed number of daemon threads, which are only
+    started when first needed (so pools can be created before a server forks
+    its worker processes).
+    """
+
+    def __init__(self, size=4, finalizer=None):
+        """Returns a new pool of *size* threads. If a *finalizer* is given,
+        each thread calls it when it exits (see :meth:`shutdown`), e.g. to
+        release the resources it kept between calls.
+        """
+        self.size = size
+        self.finalizer = finalizer
+        self._queue = Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        """Starts the threads that aren't running, e.g. because the process
+        was forked.
+        """
+        self._lock.acquire()
+        try:
+            self._threads = [thread for thread in self._threads
+                             if thread.isAlive()]
+            while len(self._threads) < self.size:
+                thread = threading.Thread(target=self._work)
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._lock.release()
+
+    def _work(self):
+        """Calls the functions submitted to this pool, until it's shut down.
+        """
+        try:
+            while True:
+                task = self._queue.get()
+                if task is None:
+                    break
+                future, function, args = task
+                future._run(function, args)
+        finally:
+            if self.finalizer is not None:
+                self.finalizer()
+
+    def submit(self, function, *args):
+        """Calls the given function with the given *args* in one of the
+        threads of this pool. Returns a :class:`Future` object holding its
+        result.
+        """
+        if len(self._threads) < self.size or \
+                not self._threads[-1].isAlive():
+            self._start()
+        future = Future()
+        self._queue.put((future, function, args))
+        return future
+
+    def shutdown(self, wait=True):
+        """Stops the threads of this pool once the functions already submitted
+        are called. If *wait* is ``True``, waits for them to exit. Threads
+        are started again if more functions are submitted.
+        """
+        self._lock.acquire()
+        try:
+            threads, self._threads = self._threads, []
+            for thread in threads:
+                self._queue.put(None)
+        finally:
+            self._lock.release()
+        if wait:
+            for thread in threads:
+                thread.join()